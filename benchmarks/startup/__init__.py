@@ -0,0 +1,9 @@
+"""
+Startup benchmark of the action lambda.
+
+Loads the handler in fresh interpreters, with the AWS services replaced by the
+stand-ins of the text-to-SQL benchmark, and fails when the init time, the heavy
+modules imported at init or the size of the container image regress past the
+budgets of `budgets.json`. Also reports where the import time goes, from the
+`-X importtime` output of the interpreter.
+"""
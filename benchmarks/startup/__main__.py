@@ -0,0 +1,167 @@
+"""
+__main__.py
+
+Command line entry point of the startup benchmark:
+
+    python -m benchmarks.startup --runs 5 --importtime
+    python -m benchmarks.startup --image genai-chatbot-action-lambda:latest
+
+Exits with status 1 when a budget of `budgets.json` is exceeded.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from .importtime import format_report, parse_importtime
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+BUDGETS_PATH = Path(__file__).resolve().parent / "budgets.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.startup",
+        description="Init time, import profile and image size budgets of the action lambda.",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Measured cold loads.")
+    parser.add_argument(
+        "--warmup", type=int, default=1, help="Unmeasured loads writing the snapshot and bytecode."
+    )
+    parser.add_argument("--budgets", default=str(BUDGETS_PATH), help="Budgets file (JSON).")
+    parser.add_argument("--max-init-ms", type=float, default=None, help="Overrides the init_ms budget.")
+    parser.add_argument("--image", default=None, help="Also check the size of this Docker image.")
+    parser.add_argument("--max-image-mb", type=float, default=None, help="Overrides the image_mb budget.")
+    parser.add_argument("--importtime", action="store_true", help="Print the import-time profile.")
+    parser.add_argument("--top", type=int, default=20, help="Rows of the import-time profile.")
+    parser.add_argument("--work-dir", default=None, help="Directory of the snapshot and caches.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    return parser.parse_args()
+
+
+def run_probe(work_dir, modules, importtime=False):
+    """
+    Loads the handler in a fresh interpreter, see `probe.py`.
+
+    Args:
+        work_dir (str): Directory of the snapshot and caches, shared by the runs.
+        modules (list): Modules whose import is reported.
+        importtime (bool): Run the interpreter with `-X importtime`.
+
+    Returns:
+        result (dict): Timings and imported modules of the run.
+        stderr (str): Standard error of the interpreter.
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ["-X", "importtime"]
+    command += ["-m", "benchmarks.startup.probe", "--work-dir", work_dir, "--modules", *modules]
+    process = subprocess.run(
+        command, cwd=REPO_ROOT, capture_output=True, text=True, env=dict(os.environ)
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"The probe failed:\n{process.stderr[-4000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr
+
+
+def image_size_mb(image):
+    """
+    Returns the size of a local Docker image in MiB.
+    """
+    size = subprocess.run(
+        ["docker", "image", "inspect", image, "--format", "{{.Size}}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    return round(int(size) / 2**20, 1)
+
+
+def check_budgets(summary, budgets):
+    """
+    Compares the measurements to the budgets.
+
+    Returns:
+        failures (list): One message per exceeded budget.
+    """
+    failures = []
+    if summary["init_ms"] > budgets["init_ms"]:
+        failures.append(f"init time {summary['init_ms']} ms > {budgets['init_ms']} ms")
+    if summary["init_modules"]:
+        failures.append(f"imported at init: {', '.join(summary['init_modules'])}")
+    if summary["request_modules"]:
+        failures.append(
+            f"imported by the first request: {', '.join(summary['request_modules'])}"
+        )
+    if summary.get("image_mb") is not None and summary["image_mb"] > budgets["image_mb"]:
+        failures.append(f"image size {summary['image_mb']} MiB > {budgets['image_mb']} MiB")
+    if summary["status_code"] != 200:
+        failures.append(f"first request answered with status {summary['status_code']}")
+    return failures
+
+
+def main():
+    args = parse_args()
+    with open(args.budgets, encoding="utf-8") as f:
+        budgets = json.load(f)
+    if args.max_init_ms is not None:
+        budgets["init_ms"] = args.max_init_ms
+    if args.max_image_mb is not None:
+        budgets["image_mb"] = args.max_image_mb
+    modules = budgets.get("forbidden_modules", [])
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="startup_benchmark_")
+
+    for _ in range(args.warmup):
+        run_probe(work_dir, modules)
+    runs = []
+    for i in range(args.runs):
+        result, _ = run_probe(work_dir, modules)
+        print(
+            f"run {i + 1}: init={result['init_ms']} ms "
+            f"first_request={result['first_request_ms']} ms modules={result['module_count']}"
+        )
+        runs.append(result)
+
+    median_run = sorted(runs, key=lambda run: run["init_ms"])[len(runs) // 2]
+    summary = {
+        "init_ms": statistics.median(run["init_ms"] for run in runs),
+        "first_request_ms": statistics.median(run["first_request_ms"] for run in runs),
+        "init_stages": median_run["init_stages"],
+        "init_modules": sorted({m for run in runs for m in run["init_modules"]}),
+        "request_modules": sorted(
+            {m for run in runs for m in run["request_modules"]} - set(median_run["init_modules"])
+        ),
+        "status_code": max(run["status_code"] for run in runs),
+        "image_mb": image_size_mb(args.image) if args.image else None,
+    }
+    print(f"\ninit (median): {summary['init_ms']} ms, budget {budgets['init_ms']} ms")
+    print(f"cold start phases (ms): {json.dumps(summary['init_stages'])}")
+    print(f"first request (median): {summary['first_request_ms']} ms")
+    if args.image:
+        print(f"image {args.image}: {summary['image_mb']} MiB, budget {budgets['image_mb']} MiB")
+
+    if args.importtime:
+        _, stderr = run_probe(work_dir, modules, importtime=True)
+        print("\n" + format_report(parse_importtime(stderr), args.top))
+
+    failures = check_budgets(summary, budgets)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"budgets": budgets, "summary": summary, "runs": runs, "failures": failures},
+                f,
+                indent=1,
+            )
+    if failures:
+        print("\nBudget exceeded:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nAll startup budgets met.")
+
+
+if __name__ == "__main__":
+    main()
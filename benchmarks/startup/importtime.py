@@ -0,0 +1,79 @@
+"""
+importtime.py
+
+Parses the `-X importtime` output of the interpreter into an import-time
+profile report.
+"""
+
+import re
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)\s*$")
+
+
+def parse_importtime(text):
+    """
+    Parses the `import time:` lines written to stderr by `python -X importtime`.
+
+    Args:
+        text (str): Standard error of the interpreter.
+
+    Returns:
+        entries (list): One {"module", "self_us", "cumulative_us", "depth"} dict
+            per imported module, in the order the imports completed.
+    """
+    entries = []
+    for line in text.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append(
+                {
+                    "module": module,
+                    "self_us": int(self_us),
+                    "cumulative_us": int(cumulative_us),
+                    "depth": (len(indent) - 1) // 2,
+                }
+            )
+    return entries
+
+
+def package_totals(entries):
+    """
+    Sums the self import time of the modules of each top-level package.
+
+    Returns:
+        totals (list): (package, milliseconds) pairs, the slowest first.
+    """
+    totals = {}
+    for entry in entries:
+        package = entry["module"].split(".")[0]
+        totals[package] = totals.get(package, 0) + entry["self_us"]
+    return sorted(
+        ((package, round(us / 1000, 1)) for package, us in totals.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+
+
+def slowest_imports(entries, top=20):
+    """
+    Returns the `top` modules with the largest cumulative import time.
+    """
+    return sorted(entries, key=lambda entry: entry["cumulative_us"], reverse=True)[:top]
+
+
+def format_report(entries, top=20):
+    """
+    Formats the import-time profile: the total, the slowest packages and the
+    slowest imports with their nesting depth.
+    """
+    total_ms = sum(entry["self_us"] for entry in entries) / 1000
+    lines = [f"import time: {total_ms:.1f} ms over {len(entries)} modules", ""]
+    lines.append(f"  {'package':<40}{'self ms':>10}")
+    for package, ms in package_totals(entries)[:top]:
+        lines.append(f"  {package:<40}{ms:>10}")
+    lines += ["", f"  {'module':<60}{'cumulative ms':>14}"]
+    for entry in slowest_imports(entries, top):
+        name = "  " * entry["depth"] + entry["module"]
+        lines.append(f"  {name:<60}{entry['cumulative_us'] / 1000:>14.1f}")
+    return "\n".join(lines)
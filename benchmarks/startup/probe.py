@@ -0,0 +1,70 @@
+"""
+probe.py
+
+Run by the startup benchmark in a fresh interpreter: loads the action lambda
+handler on the stand-ins, answers one question and prints the timings and the
+watched modules that were imported as one JSON line.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def imported(modules):
+    """
+    Returns the modules of the list that are imported.
+    """
+    return sorted(module for module in modules if module in sys.modules)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.startup.probe")
+    parser.add_argument("--work-dir", required=True, help="Directory of the snapshot and caches.")
+    parser.add_argument("--modules", nargs="*", default=[], help="Modules to watch.")
+    args = parser.parse_args()
+
+    # timed from here: the stand-ins and the handler are imported below
+    init_started = time.perf_counter()
+    from benchmarks.text_to_sql.runner import (
+        load_handler,
+        question_event,
+        quiet_logging,
+        read_questions,
+    )
+    from benchmarks.text_to_sql.stubs import LatencyProfile
+
+    questions = read_questions()
+    index, _ = load_handler(args.work_dir, questions, LatencyProfile())
+    init_ms = _elapsed_ms(init_started)
+    quiet_logging()
+    init_modules = imported(args.modules)
+
+    from metrics import init_metrics
+
+    started = time.perf_counter()
+    response = index.get_response(question_event(questions[0]["question"]), None)
+    first_request_ms = _elapsed_ms(started)
+
+    print(
+        json.dumps(
+            {
+                "init_ms": init_ms,
+                "init_stages": init_metrics.stages,
+                "first_request_ms": first_request_ms,
+                "status_code": response["response"]["httpStatusCode"],
+                "init_modules": init_modules,
+                "request_modules": imported(args.modules),
+                "module_count": len(sys.modules),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+"""
+Offline benchmark of the action lambda text-to-SQL engine.
+
+Runs the real `index.get_response` handler with Bedrock, Glue and S3 replaced
+by deterministic stand-ins with injected latencies, and Athena replaced by a
+local engine loaded from the EC2 pricing CSV, and reports per-stage latency
+percentiles, memory and throughput at several concurrency levels.
+"""
@@ -0,0 +1,152 @@
+"""
+__main__.py
+
+Command line entry point of the text-to-SQL benchmark:
+
+    python -m benchmarks.text_to_sql --concurrency 1 4 8 --iterations 5
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from .runner import (
+    QUESTIONS_PATH,
+    load_handler,
+    quiet_logging,
+    read_questions,
+    run_level,
+)
+from .stubs import LatencyProfile
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.text_to_sql",
+        description="Offline latency, memory and throughput benchmark of the action lambda.",
+    )
+    parser.add_argument("--questions", default=str(QUESTIONS_PATH), help="Question corpus (JSON lines).")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="Concurrency levels.")
+    parser.add_argument("--iterations", type=int, default=3, help="Passes over the corpus per level.")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured passes before the first level.")
+    parser.add_argument(
+        "--execution",
+        choices=["local", "athena"],
+        default="local",
+        help="Run the SQL on the DuckDB tier or on the SQLite stand-in of Athena.",
+    )
+    parser.add_argument("--embedding-ms", type=float, default=50, help="Latency of an embedding call.")
+    parser.add_argument("--first-token-ms", type=float, default=300, help="Latency of the first SQL chunk.")
+    parser.add_argument("--chunk-ms", type=float, default=10, help="Latency between two SQL chunks.")
+    parser.add_argument("--completion-ms", type=float, default=800, help="Latency of a Converse call.")
+    parser.add_argument("--athena-ms", type=float, default=1000, help="Latency of an Athena query.")
+    parser.add_argument(
+        "--questions-per-request",
+        type=int,
+        default=1,
+        help="Sub-questions asked per /uc2 request, answered concurrently by the lambda.",
+    )
+    parser.add_argument(
+        "--model",
+        default=None,
+        help="TEXT2SQL_MODEL of the lambda, e.g. Claude37Sonnet to emulate its prompt cache.",
+    )
+    parser.add_argument(
+        "--tables",
+        type=int,
+        default=1,
+        help="Tables of the Glue database, copies of the pricing table beyond the first one.",
+    )
+    parser.add_argument("--trace-memory", action="store_true", help="Report the tracemalloc peak of each level.")
+    parser.add_argument("--work-dir", default=None, help="Directory of the snapshot and caches.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    return parser.parse_args()
+
+
+def print_level(result):
+    print(
+        f"\nconcurrency={result['concurrency']} requests={result['requests']} "
+        f"questions={result['questions']} "
+        f"errors={result['errors']} throughput={result['throughput_rps']} req/s "
+        f"max_rss={result['max_rss_mb']} MiB"
+        + (f" traced_peak={result['traced_peak_mb']} MiB" if result["traced_peak_mb"] else "")
+    )
+    for sample in result["error_samples"]:
+        print(f"  error: {sample}")
+    print(f"  {'stage':<24}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+    for name, stats in result["stages"].items():
+        print(
+            f"  {name:<24}{stats['n']:>6}{stats['p50']:>10}{stats['p95']:>10}"
+            f"{stats['p99']:>10}{stats['mean']:>10}"
+        )
+
+
+def main():
+    args = parse_args()
+    latency = LatencyProfile(
+        embedding_ms=args.embedding_ms,
+        first_token_ms=args.first_token_ms,
+        chunk_ms=args.chunk_ms,
+        completion_ms=args.completion_ms,
+        athena_ms=args.athena_ms,
+    )
+    questions = read_questions(args.questions)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="text_to_sql_benchmark_")
+
+    started = time.perf_counter()
+    if args.model:
+        os.environ["TEXT2SQL_MODEL"] = args.model
+    index, bedrock = load_handler(
+        work_dir, questions, latency, execution=args.execution, tables=args.tables
+    )
+    load_time = round((time.perf_counter() - started) * 1000, 1)
+    quiet_logging()
+
+    from metrics import init_metrics
+
+    cold_start = dict(init_metrics.stages, load_handler=load_time)
+    print(f"cold start (ms): {json.dumps(cold_start)}")
+
+    if args.warmup:
+        run_level(
+            index,
+            questions,
+            1,
+            args.warmup,
+            questions_per_request=args.questions_per_request,
+        )
+
+    levels = []
+    for concurrency in args.concurrency:
+        result = run_level(
+            index,
+            questions,
+            concurrency,
+            args.iterations,
+            trace_memory=args.trace_memory,
+            questions_per_request=args.questions_per_request,
+        )
+        print_level(result)
+        levels.append(result)
+    print(f"\nBedrock stub calls: {json.dumps(bedrock.calls)}")
+    print(f"Bedrock stub prompt cache tokens: {json.dumps(bedrock.cache_tokens)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "config": vars(args),
+                    "cold_start_ms": cold_start,
+                    "levels": levels,
+                    "bedrock_calls": bedrock.calls,
+                    "prompt_cache_tokens": bedrock.cache_tokens,
+                },
+                f,
+                indent=1,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+runner.py
+
+Loads the action lambda on the local stand-ins and runs the question corpus
+at several concurrency levels.
+"""
+
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .stubs import (
+    StubBedrockRuntime,
+    StubGlue,
+    StubS3,
+    create_athena_stand_in,
+    table_names,
+)
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+ACTION_LAMBDA_DIR = REPO_ROOT / "code" / "lambdas" / "action-lambda"
+DATA_PATH = (
+    REPO_ROOT / "assets" / "data_query_data_source" / "ec2_pricing" / "ec2_pricing_762.csv"
+)
+QUESTIONS_PATH = Path(__file__).resolve().parent / "questions.jsonl"
+TABLE_NAME = "ec2_pricing"
+DATA_BUCKET = "benchmark-data"
+PERCENTILES = (50, 95, 99)
+
+
+def read_questions(path=QUESTIONS_PATH):
+    """
+    Reads the question corpus, one {"question", "sql"} JSON object per line.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class CollectingSink:
+    """
+    Metrics sink keeping the stage durations of every request in memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.records = []
+
+    def emit(self, metrics):
+        record = dict(metrics.stages, total=metrics.elapsed_ms())
+        with self._lock:
+            self.records.append(record)
+
+    def reset(self):
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+def load_handler(work_dir, questions, latency, execution="local", tables=1):
+    """
+    Imports the action lambda handler with the AWS services replaced by stubs.
+
+    Args:
+        work_dir (str): Directory of the snapshot, caches and Athena stand-in.
+        questions (list): Question corpus, with the canned SQL of each question.
+        latency (LatencyProfile): Injected latencies.
+        execution (str): "local" runs the SQL on the DuckDB tier, "athena" on
+            the SQLite stand-in of Athena.
+        tables (int): Number of tables of the Glue database, copies of the
+            pricing table beyond the first one.
+
+    Returns:
+        index (module): The handler module, its metrics collected in a CollectingSink.
+        bedrock (StubBedrockRuntime): The Bedrock stub, counting the calls.
+    """
+    defaults = {
+        "AWS_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "benchmark",
+        "AWS_SECRET_ACCESS_KEY": "benchmark",
+        "ATHENA_BUCKET_NAME": "benchmark-athena",
+        "TEXT2SQL_DATABASE": "benchmark",
+        "LOG_LEVEL": "WARNING",
+        "FEWSHOT_EXAMPLES_PATH": str(ACTION_LAMBDA_DIR / "dynamic_examples.csv"),
+        "INDEX_SNAPSHOT_PATH": os.path.join(work_dir, "index_snapshot.bin"),
+        "TABLE_CONTEXT_PATH": os.path.join(work_dir, "table_context.json"),
+        "EMBEDDING_CACHE_DIR": os.path.join(work_dir, "embedding_cache"),
+        "INDEX_SNAPSHOT": "optional",
+        "SEMANTIC_CACHE_BACKEND": "none",
+        "SQL_RESULT_CACHE_MAX_ENTRIES": "0",
+        "SQL_EXECUTION_MODE": "auto" if execution == "local" else "athena",
+        "SQL_GENERATION_MODE": "stream",
+        "LLM_API": "converse",
+        "RESPONSE_MODE": "llm",
+        "METRICS_SINK": "none",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, str(ACTION_LAMBDA_DIR))
+
+    from connections import Connections
+
+    bedrock = StubBedrockRuntime({q["question"]: q["sql"] for q in questions}, latency)
+    Connections.bedrock_client = bedrock
+    Connections.glue_client = StubGlue(
+        TABLE_NAME, str(DATA_PATH), bucket=DATA_BUCKET, tables=tables
+    )
+    Connections.s3_resource = StubS3(
+        {
+            (DATA_BUCKET, f"{name}/{DATA_PATH.name}"): str(DATA_PATH)
+            for name in table_names(TABLE_NAME, tables)
+        }
+    )
+
+    import build_query_engine
+    import index
+
+    build_query_engine.sql_database._engine = create_athena_stand_in(
+        TABLE_NAME, str(DATA_PATH), latency, os.path.join(work_dir, "athena.sqlite")
+    )
+    index.metrics_sink = CollectingSink()
+    return index, bedrock
+
+
+def question_event(question):
+    """
+    Returns the Bedrock agent action group event of a /uc2 question, or of
+    several sub-questions when given a list.
+    """
+    if isinstance(question, list):
+        parameter = {"name": "uc2Questions", "type": "array", "value": json.dumps(question)}
+    else:
+        parameter = {"name": "question", "type": "string", "value": question}
+    return {
+        "actionGroup": "benchmark",
+        "apiPath": "/uc2",
+        "httpMethod": "GET",
+        "parameters": [parameter],
+    }
+
+
+def summarize(records):
+    """
+    Computes the latency percentiles of every stage.
+
+    Args:
+        records (list): Stage durations of the requests, in milliseconds.
+
+    Returns:
+        stages (dict): Mapping of stage to its count, mean and percentiles.
+    """
+    durations = {}
+    for record in records:
+        for name, value in record.items():
+            durations.setdefault(name, []).append(value)
+    stages = {}
+    for name, values in durations.items():
+        percentiles = np.percentile(values, PERCENTILES)
+        stages[name] = {
+            "n": len(values),
+            "mean": round(statistics.fmean(values), 2),
+            **{f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, percentiles)},
+        }
+    return stages
+
+
+def _max_rss_mb():
+    # kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_level(
+    index,
+    questions,
+    concurrency,
+    iterations,
+    trace_memory=False,
+    questions_per_request=1,
+):
+    """
+    Answers the corpus `iterations` times with `concurrency` concurrent requests.
+    With `questions_per_request` above 1, each request asks that many
+    consecutive questions of the corpus as sub-questions.
+
+    Returns:
+        result (dict): Throughput, errors, memory and stage percentiles of the level.
+    """
+    texts = [q["question"] for q in questions]
+    if questions_per_request > 1:
+        texts = [
+            texts[i : i + questions_per_request]
+            for i in range(0, len(texts), questions_per_request)
+        ]
+    events = [question_event(text) for text in texts] * iterations
+    errors = []
+
+    def answer(event):
+        try:
+            index.get_response(event, None)
+        except Exception as e:
+            errors.append(repr(e))
+
+    index.metrics_sink.reset()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(answer, events))
+    wall_time = time.perf_counter() - started
+    peak_traced = None
+    if trace_memory:
+        peak_traced = round(tracemalloc.get_traced_memory()[1] / 1024**2, 1)
+        tracemalloc.stop()
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(events),
+        "questions": len(questions) * iterations,
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "wall_time_s": round(wall_time, 3),
+        "throughput_rps": round(len(events) / wall_time, 2),
+        "max_rss_mb": _max_rss_mb(),
+        "traced_peak_mb": peak_traced,
+        "stages": summarize(index.metrics_sink.reset()),
+    }
+
+
+def quiet_logging(level=logging.WARNING):
+    """
+    Lowers the log level set by the lambda modules on the root logger.
+    """
+    logging.getLogger().setLevel(level)
@@ -0,0 +1,372 @@
+"""
+stubs.py
+
+Deterministic local stand-ins for the AWS services used by the action lambda.
+
+    - StubBedrockRuntime: Titan embeddings from a hash of the text, canned SQL
+      streamed with ConverseStream and canned answers with Converse, each with
+      an injected latency, and the token counts of the Bedrock prompt cache.
+    - StubGlue and StubS3: a Glue database with one table read from a local CSV
+      file, optionally with copies under other names, so the local SQL tier
+      loads it into DuckDB, and S3 objects served from local files.
+    - create_athena_stand_in: SQLite engine loaded from the same CSV file, with
+      an injected query latency, replacing Athena.
+"""
+
+import csv
+import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import sqlalchemy
+from sqlalchemy import event
+
+EMBEDDING_DIMENSION = 1536
+DEFAULT_SQL = "SELECT instance_name, on_demand_hourly_price FROM ec2_pricing ORDER BY on_demand_hourly_price LIMIT 5"
+DEFAULT_ANSWER = "According to the latest information, the answer is in the table above."
+# Minimum number of tokens of a cached prefix of the models supporting prompt
+# caching, the other models cache nothing
+PROMPT_CACHE_MIN_TOKENS = {
+    "us.anthropic.claude-3-5-haiku-20241022-v1:0": 2048,
+    "us.anthropic.claude-3-7-sonnet-20250219-v1:0": 1024,
+}
+CHARS_PER_TOKEN = 4
+
+
+class LatencyProfile:
+    """
+    Latencies injected by the stubs, in milliseconds.
+
+    Args:
+        embedding_ms (float): Latency of an embedding call.
+        first_token_ms (float): Latency until the first streamed SQL chunk.
+        chunk_ms (float): Latency between two streamed chunks.
+        completion_ms (float): Latency of a Converse call.
+        athena_ms (float): Latency of a query on the Athena stand-in.
+    """
+
+    def __init__(
+        self, embedding_ms=0, first_token_ms=0, chunk_ms=0, completion_ms=0, athena_ms=0
+    ):
+        self.embedding_ms = embedding_ms
+        self.first_token_ms = first_token_ms
+        self.chunk_ms = chunk_ms
+        self.completion_ms = completion_ms
+        self.athena_ms = athena_ms
+
+
+def _sleep_ms(duration_ms):
+    if duration_ms > 0:
+        time.sleep(duration_ms / 1000)
+
+
+def hash_embedding(text, dimension=EMBEDDING_DIMENSION):
+    """
+    Returns a fixed unit vector for a text.
+    """
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def prompt_text(messages):
+    return "".join(
+        block.get("text", "") for block in messages[0]["content"] if "text" in block
+    )
+
+
+def prompt_question(prompt):
+    """
+    Extracts the question from a text-to-SQL or response synthesis prompt.
+    """
+    for marker, end in (("Question: ", "\n"), ("Query: ", "\n")):
+        start = prompt.rfind(marker)
+        if start != -1:
+            return prompt[start + len(marker) :].split(end, 1)[0].strip()
+    return ""
+
+
+class _Body:
+    def __init__(self, payload):
+        self._payload = json.dumps(payload).encode("utf-8")
+
+    def read(self):
+        return self._payload
+
+
+class _Stream:
+    def __init__(self, chunks, latency, usage):
+        self._chunks = chunks
+        self._latency = latency
+        self._usage = usage
+
+    def __iter__(self):
+        _sleep_ms(self._latency.first_token_ms)
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                _sleep_ms(self._latency.chunk_ms)
+            yield {"contentBlockDelta": {"delta": {"text": chunk}, "contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        yield {
+            "metadata": {
+                "usage": dict(self._usage, outputTokens=len(self._chunks)),
+            }
+        }
+
+    def close(self):
+        pass
+
+
+class StubBedrockRuntime:
+    """
+    Bedrock runtime client answering from canned SQL.
+
+    Prompt caching is emulated: the text before a `cachePoint` block with the
+    minimum number of tokens of the model is written to the cache on its first
+    call and read from it on the next ones, counted in `cache_tokens`.
+
+    Args:
+        canned_sql (dict): Mapping of question to the SQL generated for it.
+        latency (LatencyProfile): Injected latencies.
+        chunk_chars (int): Characters per streamed chunk.
+    """
+
+    def __init__(self, canned_sql, latency, chunk_chars=8):
+        self._canned_sql = canned_sql
+        self._latency = latency
+        self._chunk_chars = chunk_chars
+        self._lock = threading.Lock()
+        self.calls = {"invoke_model": 0, "converse": 0, "converse_stream": 0}
+        self.cache_tokens = {"read": 0, "write": 0}
+        self._cached_prefixes = set()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _usage(self, modelId, messages):
+        """
+        Returns the input token counts of a Converse request.
+        """
+        min_tokens = PROMPT_CACHE_MIN_TOKENS.get(modelId)
+        prefix, read, write = "", 0, 0
+        for block in messages[0]["content"]:
+            if "text" in block:
+                prefix += block["text"]
+                continue
+            tokens = len(prefix) // CHARS_PER_TOKEN
+            if min_tokens is None or tokens < min_tokens:
+                continue
+            key = hashlib.sha256(f"{modelId}\n{prefix}".encode("utf-8")).digest()
+            with self._lock:
+                if key in self._cached_prefixes:
+                    read, write = tokens, 0
+                else:
+                    self._cached_prefixes.add(key)
+                    write = tokens - read
+        with self._lock:
+            self.cache_tokens["read"] += read
+            self.cache_tokens["write"] += write
+        return {
+            "inputTokens": len(prefix) // CHARS_PER_TOKEN - read - write,
+            "cacheReadInputTokens": read,
+            "cacheWriteInputTokens": write,
+        }
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self._count("invoke_model")
+        _sleep_ms(self._latency.embedding_ms)
+        text = json.loads(body)["inputText"]
+        return {"body": _Body({"embedding": hash_embedding(text)})}
+
+    def converse_stream(self, modelId, messages, **kwargs):
+        self._count("converse_stream")
+        question = prompt_question(prompt_text(messages))
+        sql = self._canned_sql.get(question, DEFAULT_SQL)
+        text = f"SQLQuery: {sql}\nSQLResult: \nAnswer: "
+        chunks = [
+            text[i : i + self._chunk_chars] for i in range(0, len(text), self._chunk_chars)
+        ]
+        return {"stream": _Stream(chunks, self._latency, self._usage(modelId, messages))}
+
+    def converse(self, modelId, messages, **kwargs):
+        self._count("converse")
+        _sleep_ms(self._latency.completion_ms)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": DEFAULT_ANSWER}]}},
+            "stopReason": "end_turn",
+            "usage": dict(self._usage(modelId, messages), outputTokens=0),
+        }
+
+
+def _column_type(values):
+    for cast, glue_type in ((int, "bigint"), (float, "double")):
+        try:
+            for value in values:
+                if value != "":
+                    cast(value)
+            return glue_type
+        except ValueError:
+            continue
+    return "string"
+
+
+def read_csv_table(csv_path):
+    """
+    Reads a CSV file into lower-case column names, Glue column types and rows.
+    """
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    names = [name.lower() for name in rows[0]]
+    types = [_column_type([row[i] for row in rows[1:]]) for i in range(len(names))]
+    return names, types, rows[1:]
+
+
+class _Paginator:
+    def __init__(self, key, items):
+        self._key = key
+        self._items = items
+
+    def paginate(self, **kwargs):
+        return [{self._key: self._items}]
+
+
+def table_names(table_name, tables=1):
+    """
+    Returns the name of a table and of its `tables - 1` copies.
+    """
+    return [table_name] + [f"{table_name}_{i}" for i in range(1, tables)]
+
+
+class StubGlue:
+    """
+    Glue client with one CSV table stored under s3://<bucket>/<table>/.
+
+    Args:
+        table_name (str): Table name.
+        csv_path (str): Local CSV file of the table.
+        bucket (str): Bucket of the table location.
+        tables (int): Number of tables, the copies of the table are named
+            <table>_1, <table>_2...
+    """
+
+    def __init__(self, table_name, csv_path, bucket="benchmark-data", tables=1):
+        names, types, _ = read_csv_table(csv_path)
+        self._tables = {
+            name: {
+                "Name": name,
+                "UpdateTime": datetime.datetime(2024, 1, 1),
+                "Parameters": {"classification": "csv", "skip.header.line.count": "1"},
+                "PartitionKeys": [],
+                "StorageDescriptor": {
+                    "Location": f"s3://{bucket}/{name}/",
+                    "Columns": [{"Name": n, "Type": t} for n, t in zip(names, types)],
+                    "SerdeInfo": {"Parameters": {"field.delim": ","}},
+                },
+            }
+            for name in table_names(table_name, tables)
+        }
+
+    def get_paginator(self, operation_name):
+        if operation_name == "get_tables":
+            return _Paginator("TableList", list(self._tables.values()))
+        elif operation_name == "get_partitions":
+            return _Paginator("Partitions", [])
+        raise NotImplementedError(operation_name)
+
+    def get_table(self, DatabaseName, Name):
+        return {"Table": self._tables[Name]}
+
+
+class _S3Object:
+    def __init__(self, bucket_name, key, path):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.version_id = None
+        self.size = os.path.getsize(path)
+        self._path = path
+        with open(path, "rb") as f:
+            self.e_tag = f'"{hashlib.md5(f.read()).hexdigest()}"'
+
+    def get(self, **kwargs):
+        with open(self._path, "rb") as f:
+            return {"Body": io.BytesIO(f.read())}
+
+
+class _S3Objects:
+    def __init__(self, objects):
+        self._objects = objects
+
+    def filter(self, Prefix):
+        return [obj for obj in self._objects if obj.key.startswith(Prefix)]
+
+
+class _S3Bucket:
+    def __init__(self, name, files):
+        self.name = name
+        self._files = files
+        self.objects = _S3Objects(
+            [_S3Object(name, key, path) for key, path in files.items()]
+        )
+
+    def download_file(self, key, path):
+        shutil.copyfile(self._files[key], path)
+
+
+class StubS3:
+    """
+    S3 resource serving local files.
+
+    Args:
+        files (dict): Mapping of (bucket, key) to local file path.
+    """
+
+    def __init__(self, files):
+        self._buckets = {}
+        for (bucket, key), path in files.items():
+            self._buckets.setdefault(bucket, {})[key] = path
+
+    def Bucket(self, name):
+        return _S3Bucket(name, self._buckets.get(name, {}))
+
+    def Object(self, bucket_name, key):
+        return _S3Object(bucket_name, key, self._buckets[bucket_name][key])
+
+
+def create_athena_stand_in(table_name, csv_path, latency, database_path):
+    """
+    Creates a SQLite engine with a CSV table, sleeping `latency.athena_ms` per query.
+
+    Args:
+        table_name (str): Table name.
+        csv_path (str): Local CSV file of the table.
+        latency (LatencyProfile): Injected latencies.
+        database_path (str): SQLite database file, one connection per thread.
+
+    Returns:
+        engine (sqlalchemy.engine.base.Engine): SQL Alchemy engine.
+    """
+    names, types, rows = read_csv_table(csv_path)
+    sqlite_types = {"bigint": "INTEGER", "double": "REAL", "string": "TEXT"}
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    engine = sqlalchemy.create_engine(f"sqlite:///{database_path}")
+    columns = ", ".join(f'"{n}" {sqlite_types[t]}' for n, t in zip(names, types))
+    with engine.begin() as connection:
+        connection.exec_driver_sql(f'CREATE TABLE "{table_name}" ({columns})')
+        connection.exec_driver_sql(
+            f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * len(names))})',
+            [tuple(value if value != "" else None for value in row) for row in rows],
+        )
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _inject_latency(conn, cursor, statement, parameters, context, executemany):
+        _sleep_ms(latency.athena_ms)
+
+    return engine
@@ -16,6 +16,7 @@
     aws_kms as kms,
     aws_iam as iam,
     aws_s3 as s3,
+    aws_athena as athena,
     aws_glue as glue,
     aws_lambda as lambda_,
     aws_s3_deployment as s3deploy,
@@ -51,11 +52,13 @@ def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         opensearch_layer = self.create_lambda_layer("opensearch_layer")
 
         glue_database, glue_crawler = self.create_glue_database(athena_bucket, kms_key)
+        athena_workgroup = self.create_athena_workgroup(athena_bucket, kms_key)
         agent_executor_lambda = self.create_lambda_function(
             agent_assets_bucket,
             athena_bucket,
             kms_key,
             glue_database,
+            athena_workgroup,
             logging_context,
         )
 
@@ -117,6 +120,10 @@ def get_config(self):
             "knowledgebase_instruction"
         ]
 
+        self.ATHENA_BYTES_SCANNED_CUTOFF = config["athena"][
+            "bytes_scanned_cutoff_per_query"
+        ]
+
         self.FEWSHOT_EXAMPLES_PATH = config["paths"]["fewshot_examples_path"]
         self.LAMBDAS_SOURCE_FOLDER = config["paths"]["lambdas_source_folder"]
         self.LAYERS_SOURCE_FOLDER = config["paths"]["layers_source_folder"]
@@ -325,6 +332,28 @@ def create_glue_database(self, athena_bucket, kms_key):
 
         return glue_database, cfn_crawler
 
+    def create_athena_workgroup(self, athena_bucket, kms_key):
+        # Workgroup cancelling any query that scans more than the configured cutoff
+        athena_workgroup = athena.CfnWorkGroup(
+            self,
+            "AgentTextToSQLWorkGroup",
+            name=f"{Aws.STACK_NAME}-text2sql-workgroup",
+            description="Workgroup bounding the bytes scanned by generated SQL queries",
+            recursive_delete_option=True,
+            work_group_configuration=athena.CfnWorkGroup.WorkGroupConfigurationProperty(
+                bytes_scanned_cutoff_per_query=self.ATHENA_BYTES_SCANNED_CUTOFF,
+                enforce_work_group_configuration=False,
+                publish_cloud_watch_metrics_enabled=True,
+                result_configuration=athena.CfnWorkGroup.ResultConfigurationProperty(
+                    output_location=f"s3://{athena_bucket.bucket_name}/",
+                    encryption_configuration=athena.CfnWorkGroup.EncryptionConfigurationProperty(
+                        encryption_option="SSE_KMS", kms_key=kms_key.key_arn
+                    ),
+                ),
+            ),
+        )
+        return athena_workgroup
+
     def create_lambda_layer(self, layer_name):
         """
         create a Lambda layer with necessary dependencies.
@@ -348,14 +377,24 @@ def create_lambda_function(
         athena_bucket,
         kms_key,
         glue_database,
+        athena_workgroup,
         logging_context,
     ):
 
+        # The image build fails without the prebuilt index_snapshot.bin, unless
+        # deployed with -c index_snapshot=optional (first deploy, before the
+        # Glue crawler ran), see the action lambda README. SnapStart does not
+        # support container images, cold starts are shortened by the warm-up
+        # event and provisioned concurrency instead
         ecr_image = lambda_.EcrImageCode.from_asset_image(
             directory=path.join(
                 os.getcwd(), self.LAMBDAS_SOURCE_FOLDER, "action-lambda"
             ),
             platform=Platform.LINUX_AMD64,  # LINUX_AMD64, LINUX_ARM64
+            build_args={
+                "INDEX_SNAPSHOT": self.node.try_get_context("index_snapshot")
+                or "required"
+            },
         )
 
         # Create IAM role for Lambda function
@@ -391,6 +430,7 @@ def create_lambda_function(
                 "TEXT2SQL_DATABASE": glue_database.ref,
                 "LOG_LEVEL": logging_context["lambda_log_level"],
                 "FEWSHOT_EXAMPLES_PATH": self.FEWSHOT_EXAMPLES_PATH,
+                "ATHENA_WORKGROUP": athena_workgroup.ref,
             },
             environment_encryption=kms_key,
             role=lambda_role,
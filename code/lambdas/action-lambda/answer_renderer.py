@@ -0,0 +1,162 @@
+"""
+answer_renderer.py
+
+Deterministic rendering of small SQL results into answers.
+
+A single value or a single row becomes a sentence and a handful of rows a
+markdown table, with `$` escaped as the response prompt asks, so simple
+lookups skip the response synthesis LLM call. Results that are large or whose
+columns have no readable name return None and are left to the LLM.
+"""
+
+import math
+import re
+
+# Readable column names; unnamed Athena expressions are "_col0", "_col1", ...
+LABEL_PATTERN = re.compile(r"^(?!_col\d+$)[A-Za-z][A-Za-z0-9_ ]*$")
+# Column name fragments of amounts in dollars
+CURRENCY_HINTS = ("price", "cost")
+
+NO_DATA_ANSWER = "No data was found for the question."
+
+
+def escape_dollars(text):
+    """
+    Escapes every `$` of a text, as the answers are rendered as markdown.
+    """
+    return text.replace("$", "\\$")
+
+
+def column_label(column):
+    """
+    Returns the readable label of a column, or None if it has no readable name.
+    """
+    if not LABEL_PATTERN.match(column):
+        return None
+    return column.replace("_", " ").strip().lower()
+
+
+def format_value(value, column):
+    """
+    Formats a result value, with a dollar sign and at least two decimals for
+    amounts, and up to four decimals for other numbers.
+
+    Args:
+        value: Result value.
+        column (str): Column name.
+
+    Returns:
+        value_str (str): Formatted value, `$` not escaped.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "not available"
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return str(value)
+
+    is_currency = any(hint in column.lower() for hint in CURRENCY_HINTS)
+    if isinstance(value, float) and not value.is_integer():
+        value_str = f"{value:,.4f}".rstrip("0")
+        if is_currency and len(value_str.split(".")[1]) < 2:
+            value_str = f"{value:,.2f}"
+    elif is_currency:
+        value_str = f"{value:,.2f}"
+    else:
+        value_str = f"{int(value):,}"
+    return f"${value_str}" if is_currency else value_str
+
+
+def _is_measure(rows, index):
+    return all(
+        isinstance(row[index], (int, float)) and not isinstance(row[index], bool)
+        for row in rows
+        if row[index] is not None
+    )
+
+
+def render_row_sentence(labels, columns, row):
+    """
+    Renders a single result row as a sentence, naming the row by its only text
+    column when it has one.
+    """
+    subjects = [i for i in range(len(columns)) if not _is_measure([row], i)]
+    # a single column is the fact itself, not the name of the row
+    subject = subjects[0] if len(subjects) == 1 and len(columns) > 1 else None
+    parts = [
+        f"the {labels[i]} is {format_value(row[i], columns[i])}"
+        for i in range(len(columns))
+        if i != subject
+    ]
+    if len(parts) > 1:
+        facts = ", ".join(parts[:-1]) + f" and {parts[-1]}"
+    else:
+        facts = parts[0]
+    if subject is not None:
+        return f"According to the latest information, for {row[subject]} {facts}."
+    return f"According to the latest information, {facts}."
+
+
+def render_markdown_table(labels, columns, rows):
+    """
+    Renders result rows as a markdown table.
+    """
+    lines = [
+        "| " + " | ".join(label.capitalize() for label in labels) + " |",
+        "| " + " | ".join("---" for _ in labels) + " |",
+    ]
+    for row in rows:
+        cells = [
+            format_value(value, column).replace("|", "\\|")
+            for value, column in zip(row, columns)
+        ]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "According to the latest information:\n\n" + "\n".join(lines)
+
+
+def render_answer(columns, rows, max_rows=20, max_columns=6):
+    """
+    Renders a SQL result deterministically when it is small and unambiguous.
+
+    Args:
+        columns (list): Column names.
+        rows (list): Result rows.
+        max_rows (int): Largest number of rows rendered as a table.
+        max_columns (int): Largest number of columns rendered.
+
+    Returns:
+        answer (str): Answer with `$` escaped, or None if the result should be
+            synthesized by the LLM.
+    """
+    if not rows:
+        return NO_DATA_ANSWER
+    if not columns or len(rows) > max_rows or len(columns) > max_columns:
+        return None
+    labels = [column_label(column) for column in columns]
+    if None in labels or len(set(labels)) != len(labels):
+        return None
+
+    if len(rows) == 1:
+        answer = render_row_sentence(labels, columns, rows[0])
+    else:
+        answer = render_markdown_table(labels, columns, rows)
+    return escape_dollars(answer)
+
+
+def truncation_notice(metadata):
+    """
+    Returns the note added to the answer of a result truncated past the result
+    caps, or None if the result is complete.
+
+    Args:
+        metadata (dict): Result metadata, see `TextToSQLDatabase.run_sql`.
+
+    Returns:
+        notice (str): Notice, `$` escaped.
+    """
+    truncated = metadata.get("truncated")
+    if not truncated:
+        return None
+    return escape_dollars(
+        f"Note: the result was truncated, it has {truncated['row_count']} rows and "
+        f"this answer is based on the first {len(metadata.get('result') or [])} "
+        "and on statistics of all of them."
+    )
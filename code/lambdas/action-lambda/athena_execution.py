@@ -0,0 +1,177 @@
+"""
+athena_execution.py
+
+PyAthena cursors and engine options for running the generated SQL on Amazon Athena.
+
+The cursors poll the query state on an adaptive schedule (short intervals
+first, backing off for long-running queries) instead of PyAthena's fixed
+interval, and record the queue time, execution time and bytes scanned of every
+query. With the Arrow cursor, results are read from the S3 result object in one
+pass instead of being paged row by row through the GetQueryResults API.
+"""
+
+import json
+import logging
+import time
+from contextvars import ContextVar
+
+from pyathena.cursor import Cursor
+from pyathena.model import AthenaQueryExecution
+
+try:
+    from pyathena.arrow.cursor import ArrowCursor
+except ImportError:  # pyarrow is not installed
+    ArrowCursor = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Statistics of the last query executed in the current context
+last_query_stats = ContextVar("last_query_stats", default=None)
+# `time.perf_counter()` when the last query reached its terminal state
+last_query_finished = ContextVar("last_query_finished", default=None)
+
+TERMINAL_STATES = (
+    AthenaQueryExecution.STATE_SUCCEEDED,
+    AthenaQueryExecution.STATE_FAILED,
+    AthenaQueryExecution.STATE_CANCELLED,
+)
+
+
+def get_query_stats(query_execution, polls, wall_time):
+    """
+    Extracts the statistics of a finished query.
+
+    Args:
+        query_execution (AthenaQueryExecution): Finished query execution.
+        polls (int): Number of state checks.
+        wall_time (float): Seconds from the first state check to the terminal state.
+
+    Returns:
+        stats (dict): Query statistics.
+    """
+    return {
+        "query_id": query_execution.query_id,
+        "state": query_execution.state,
+        "queue_time_ms": query_execution.query_queue_time_in_millis,
+        "planning_time_ms": query_execution.query_planning_time_in_millis,
+        "execution_time_ms": query_execution.engine_execution_time_in_millis,
+        "total_time_ms": query_execution.total_execution_time_in_millis,
+        "data_scanned_bytes": query_execution.data_scanned_in_bytes,
+        "reused_previous_result": query_execution.reused_previous_result,
+        "polls": polls,
+        "poll_wall_time_ms": round(wall_time * 1000),
+    }
+
+
+class AdaptivePollingMixin:
+    """
+    Replaces PyAthena's fixed interval polling with a geometric backoff from
+    `initial_poll_interval` to `max_poll_interval`, and records query statistics.
+    """
+
+    initial_poll_interval = 0.05
+    max_poll_interval = 1.0
+    poll_backoff = 1.5
+
+    def _poll(self, query_id):
+        started = time.monotonic()
+        interval = self.initial_poll_interval
+        polls = 0
+        while True:
+            query_execution = self._get_query_execution(query_id)
+            polls += 1
+            if query_execution.state in TERMINAL_STATES:
+                break
+            time.sleep(interval)
+            interval = min(self.max_poll_interval, interval * self.poll_backoff)
+
+        stats = get_query_stats(query_execution, polls, time.monotonic() - started)
+        last_query_stats.set(stats)
+        last_query_finished.set(time.perf_counter())
+        logger.info(f"Athena query stats: {json.dumps(stats)}")
+        return query_execution
+
+
+class AdaptiveCursor(AdaptivePollingMixin, Cursor):
+    """
+    REST cursor with adaptive polling.
+    """
+
+
+if ArrowCursor is not None:
+
+    class AdaptiveArrowCursor(AdaptivePollingMixin, ArrowCursor):
+        """
+        Arrow cursor with adaptive polling, reading results from the S3 result object.
+        """
+
+else:
+    AdaptiveArrowCursor = None
+
+
+def get_engine_url(driver, region, database, s3_staging_dir):
+    """
+    Returns the SQLAlchemy URL of an Athena database.
+
+    Args:
+        driver (str): SQLAlchemy driver returned by `get_engine_options`.
+        region (str): AWS region.
+        database (str): Glue database name.
+        s3_staging_dir (str): Bucket of the query results.
+
+    Returns:
+        url (str): Connection string.
+    """
+    return f"awsathena+{driver}://athena.{region}.amazonaws.com/{database}?s3_staging_dir=s3://{s3_staging_dir}"
+
+
+def get_engine_options(
+    fetch_mode="arrow",
+    result_reuse_minutes=60,
+    initial_poll_interval=0.05,
+    max_poll_interval=1.0,
+    unload=False,
+    work_group=None,
+):
+    """
+    Returns the SQLAlchemy driver name and connect_args for the Athena engine.
+
+    Args:
+        fetch_mode (str): "arrow" to read results from the S3 result object, "rest"
+            to page them through the API. Falls back to "rest" without pyarrow.
+        result_reuse_minutes (int): Max age of reused Athena query results, 0 disables reuse.
+        initial_poll_interval (float): First polling interval in seconds.
+        max_poll_interval (float): Largest polling interval in seconds.
+        unload (bool): With "arrow", run queries as UNLOAD to Parquet files.
+        work_group (str): Athena workgroup, whose bytes scanned cutoff bounds every query.
+
+    Returns:
+        driver (str): SQLAlchemy driver, e.g. "rest" in awsathena+rest.
+        connect_args (dict): Arguments passed to pyathena.connect.
+    """
+    AdaptivePollingMixin.initial_poll_interval = initial_poll_interval
+    AdaptivePollingMixin.max_poll_interval = max_poll_interval
+
+    if fetch_mode == "arrow" and AdaptiveArrowCursor is None:
+        logger.warning("pyarrow is not installed, fetching Athena results over REST.")
+        fetch_mode = "rest"
+
+    connect_args = {}
+    if work_group:
+        connect_args["work_group"] = work_group
+    if result_reuse_minutes > 0:
+        connect_args.update(
+            {"result_reuse_enable": True, "result_reuse_minutes": result_reuse_minutes}
+        )
+
+    if fetch_mode == "arrow":
+        connect_args["cursor_class"] = AdaptiveArrowCursor
+        connect_args["cursor_kwargs"] = {"unload": unload}
+        return "arrow", connect_args
+    elif fetch_mode == "rest":
+        connect_args["cursor_class"] = AdaptiveCursor
+        return "rest", connect_args
+    else:
+        raise ValueError(f"Unknown Athena fetch mode: {fetch_mode}")
@@ -0,0 +1,40 @@
+"""
+build_index_snapshot.py
+
+Build-time step that precomputes the few-shot example and table schema
+embeddings into `index_snapshot.bin`, which the Dockerfile copies into the image.
+The image build fails without it, unless deployed with `-c index_snapshot=optional`.
+
+Run it from this folder before `cdk deploy`, once the Glue crawler created the
+tables, with AWS credentials and the Lambda environment variables (AWS_REGION,
+ATHENA_BUCKET_NAME, TEXT2SQL_DATABASE, LOG_LEVEL, FEWSHOT_EXAMPLES_PATH) set:
+
+    python build_index_snapshot.py
+"""
+
+import logging
+import os
+import sys
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    # Building the query engine loads the snapshot, or embeds and writes it to
+    # INDEX_SNAPSHOT_PATH when it is missing or its inputs changed.
+    os.environ["INDEX_SNAPSHOT"] = "optional"
+    import build_query_engine
+    from connections import Connections
+
+    build_query_engine.load_engine()
+    path = build_query_engine.index_snapshot.path
+    if os.path.abspath(path) != os.path.abspath(Connections.index_snapshot_path):
+        # written to the temporary directory, the image would not get it
+        logger.error(
+            f"Could not write the index snapshot to {Connections.index_snapshot_path}"
+        )
+        sys.exit(1)
+    logger.info(f"Index snapshot ready at {path}")
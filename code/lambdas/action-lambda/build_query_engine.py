@@ -1,12 +1,49 @@
 from sqlalchemy import create_engine
-from llama_index.core import SQLDatabase, VectorStoreIndex, Settings
+from llama_index.core import VectorStoreIndex, Settings
 from llama_index.core.objects import ObjectIndex, SQLTableNodeMapping, SQLTableSchema
-from llama_index.core.indices.struct_store import SQLTableRetrieverQueryEngine
 from llama_index.embeddings.bedrock import BedrockEmbedding
 from llama_index.core.prompts import PromptTemplate, Prompt
-from llama_index.core.schema import TextNode
-from connections import Connections
-from prompt_templates import SQL_TEMPLATE_STR, RESPONSE_TEMPLATE_STR, table_details
+from llama_index.core.schema import MetadataMode, QueryBundle, TextNode
+from athena_execution import get_engine_options, get_engine_url
+from connections import ClientHandle, Connections
+from data_version import DataVersion
+from embedding_cache import TieredEmbeddingCache, parse_s3_uri
+from few_shot_bank import FewShotBank
+from few_shot_retriever import (
+    FewShotRetriever,
+    normalize_rows,
+    pack_examples,
+    render_example,
+)
+from local_sql import LocalSQLEngine
+from metrics import init_metrics, set_property, stage
+from model_cascade import CascadeStats
+from index_snapshot import compute_fingerprint, load_snapshot, write_snapshot
+from sql_cache import SQLResultCache
+from schema_provider import GlueSchemaProvider
+from sql_database import TextToSQLDatabase
+from sql_guard import ScanEstimator, SQLGuard
+from sql_template_cache import SQLTemplateCache
+from streaming_sql import StreamingSQLGenerator
+from table_context import load_table_context
+from text_to_sql_engine import TextToSQLQueryEngine
+from value_linker import TOKEN_PATTERN, ValueLinker
+from semantic_cache import (
+    DynamoDBBackend,
+    FileBackend,
+    InMemoryBackend,
+    S3Backend,
+    SemanticCache,
+)
+from prompt_templates import (
+    RESPONSE_TEMPLATE_STR,
+    SQL_CACHE_BOUNDARIES,
+    SQL_LINKED_TEMPLATE_STR,
+    SQL_TEMPLATE_STR,
+    table_details,
+)
+from contextlib import contextmanager
+from contextvars import ContextVar
 import csv
 import json
 import logging
@@ -15,6 +52,13 @@
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+EMBED_MODEL_NAME = "amazon.titan-embed-text-v1"
+# Text embedded without the cache by `warm_up`, to open the Bedrock connection
+WARMUP_TEXT = "warm-up"
+
+# Question embeddings computed during the current request, see `embedding_context`
+request_embeddings = ContextVar("request_embeddings", default=None)
+
 
 def create_sql_engine():
     """
@@ -29,44 +73,615 @@ def create_sql_engine():
     s3_staging_dir = Connections.athena_bucket_name
     region = Connections.region_name
     database = Connections.text2sql_database
+    driver, connect_args = get_engine_options(
+        fetch_mode=Connections.athena_fetch_mode,
+        result_reuse_minutes=Connections.athena_result_reuse_minutes,
+        initial_poll_interval=Connections.athena_initial_poll_interval,
+        max_poll_interval=Connections.athena_max_poll_interval,
+        unload=Connections.athena_unload,
+        work_group=Connections.athena_workgroup,
+    )
     # Construct the connection string
-    conn_url = f"awsathena+rest://athena.{region}.amazonaws.com/{database}?s3_staging_dir=s3://{s3_staging_dir}"
+    conn_url = get_engine_url(driver, region, database, s3_staging_dir)
     # Create an SQLAlchemy engine
-    engine = create_engine(conn_url)
+    engine = create_engine(conn_url, connect_args=connect_args)
     return engine
 
 
-def get_few_shot_retriever(FEWSHOT_EXAMPLES_PATH):
+def read_few_shot_examples(FEWSHOT_EXAMPLES_PATH):
     """
-    Creates a fewshot retriever from a csv file.
+    Reads fewshot examples from a csv file.
 
     Args:
         FEWSHOT_EXAMPLES_PATH (str): Path to fewshot examples csv file.
 
     Returns:
-        few_shot_retriever (VectorStoreIndex): VectorStoreIndex with fewshot examples.
-        data_dict (dict): Dictionary with fewshot examples.
+        rows (list): List of dictionaries, one per example.
     """
     with open(FEWSHOT_EXAMPLES_PATH, newline="", encoding="utf-8-sig") as csvfile:
-        reader = csv.DictReader(csvfile)
-        data, data_dict, few_shot_nodes = [], {}, []
-        for row in reader:
-            data.append(row["example_input_question"])
-            data_dict[row["example_input_question"]] = row
-            few_shot_nodes.append(
-                TextNode(text=json.dumps(row["example_input_question"]))
+        return list(csv.DictReader(csvfile))
+
+
+def get_table_context():
+    """
+    Loads the precomputed table context from TABLE_CONTEXT_S3_URI, or from
+    TABLE_CONTEXT_PATH in the image.
+
+    Returns:
+        table_context (TableContextStore): Table context, or None if none was built.
+    """
+    bucket, key = None, None
+    if Connections.table_context_s3_uri:
+        bucket, _, key = Connections.table_context_s3_uri.removeprefix("s3://").partition("/")
+    table_context = load_table_context(
+        Connections.table_context_path, Connections.s3_resource, bucket, key
+    )
+    if table_context is None:
+        logger.warning("No table context found, using the Glue catalog schemas only.")
+    return table_context
+
+
+def get_table_description(table_name):
+    """
+    Returns the description of a table, from `table_details`, the table context
+    or the Glue catalog.
+    """
+    if table_name in table_details:
+        return table_details[table_name]
+    if table_context is not None and table_name in table_context:
+        return table_context.description(table_name)
+    return schema_provider.description(table_name)
+
+
+def get_table_schema_objs(sql_database):
+    """
+    Creates the table schema objects for all tables in the database.
+
+    Args:
+        sql_database (SQLDatabase): SQL database.
+
+    Returns:
+        table_schema_objs (list): List of SQLTableSchema objects.
+    """
+    return [
+        SQLTableSchema(table_name=table, context_str=get_table_description(table))
+        for table in sorted(sql_database._all_tables)
+    ]
+
+
+def get_table_nodes(sql_database):
+    """
+    Creates the schema nodes of all tables in the database, as embedded in the
+    table object index.
+
+    Args:
+        sql_database (SQLDatabase): SQL database.
+
+    Returns:
+        table_nodes (list): List of TextNode objects.
+    """
+    return SQLTableNodeMapping(sql_database).to_nodes(
+        get_table_schema_objs(sql_database)
+    )
+
+
+def build_index_snapshot(table_nodes, embed_model, fingerprint, inputs, previous=None):
+    """
+    Embeds the fewshot examples and table schema nodes and writes them to a snapshot.
+
+    Embeddings of a previous snapshot are reused for unchanged fewshot examples
+    and tables, so only new or changed tables are embedded. The snapshot is
+    written next to the code when possible (build time) and to the temporary
+    directory otherwise, as the Lambda task root is read-only.
+
+    Args:
+        table_nodes (list): Table schema nodes, see `get_table_nodes`.
+        embed_model (BedrockEmbedding): Embedding model.
+        fingerprint (str): Fingerprint of the snapshot inputs.
+        inputs (dict): Fingerprints of the inputs of individual sections.
+        previous (IndexSnapshot): Stale snapshot to reuse embeddings from.
+
+    Returns:
+        snapshot (IndexSnapshot): The loaded snapshot.
+    """
+    if previous is not None and previous.inputs.get("few_shot") == inputs["few_shot"]:
+        logger.info("Reusing the fewshot embeddings of the previous snapshot.")
+        few_shot_vectors = previous.vectors("few_shot")
+        few_shot_buffer = previous.vectors("few_shot_examples")
+        few_shot_offsets = previous.vectors("few_shot_offsets")
+    else:
+        rows = read_few_shot_examples(Connections.fewshot_examples_path)
+        few_shot_vectors = normalize_rows(
+            embed_model.get_text_embedding_batch(
+                [json.dumps(row["example_input_question"]) for row in rows]
             )
+        ).reshape(len(rows), -1)
+        few_shot_buffer, few_shot_offsets = pack_examples(
+            [render_example(row) for row in rows]
+        )
+        few_shot_buffer = few_shot_buffer.reshape(1, -1)
+        few_shot_offsets = few_shot_offsets.reshape(-1, 1)
 
-    embed_model = BedrockEmbedding(
-        client=Connections.bedrock_client, model_name="amazon.titan-embed-text-v1"
+    previous_vectors = {}
+    if previous is not None and "tables" in previous:
+        previous_vectors = {
+            (record["id"], record["text"]): vector
+            for record, vector in zip(
+                previous.records("tables"), previous.vectors("tables")
+            )
+        }
+    changed_nodes = [
+        node for node in table_nodes if (node.node_id, node.text) not in previous_vectors
+    ]
+    logger.info(
+        f"Embedding {len(changed_nodes)} new or changed tables out of {len(table_nodes)}."
+    )
+    changed_vectors = embed_model.get_text_embedding_batch(
+        [node.get_content(metadata_mode=MetadataMode.EMBED) for node in changed_nodes]
     )
+    for node, vector in zip(changed_nodes, changed_vectors):
+        previous_vectors[(node.node_id, node.text)] = vector
+    table_vectors = [previous_vectors[(node.node_id, node.text)] for node in table_nodes]
+    table_records = [
+        {"id": node.node_id, "text": node.text, "metadata": node.metadata}
+        for node in table_nodes
+    ]
 
-    # Update settings instead of using ServiceContext
-    Settings.embed_model = embed_model
+    sections = {
+        "few_shot": ([], few_shot_vectors),
+        "few_shot_examples": ([], few_shot_buffer),
+        "few_shot_offsets": ([], few_shot_offsets),
+        "tables": (table_records, table_vectors),
+    }
+    for path in (Connections.index_snapshot_path, Connections.index_snapshot_cache_path):
+        try:
+            write_snapshot(path, fingerprint, sections, inputs=inputs)
+        except OSError as e:
+            logger.info(f"Could not write index snapshot to {path}: {e}")
+            continue
+        return load_snapshot(path, fingerprint)
+    raise RuntimeError("Could not write the index snapshot to any location.")
+
+
+def get_index_snapshot(sql_database, embed_model):
+    """
+    Loads the prebuilt index snapshot, rebuilding it only when the fewshot
+    examples csv or the table schema nodes changed.
+
+    With INDEX_SNAPSHOT=required (the default), the snapshot built into the
+    image must exist; with "optional", a missing snapshot is embedded from
+    scratch at cold start.
+
+    Args:
+        sql_database (SQLDatabase): SQL database.
+        embed_model (BedrockEmbedding): Embedding model.
+
+    Returns:
+        snapshot (IndexSnapshot): Snapshot with "few_shot" and "tables" sections.
+
+    Raises:
+        ValueError: If INDEX_SNAPSHOT is neither "required" nor "optional".
+        RuntimeError: If the snapshot is required and missing.
+    """
+    if Connections.index_snapshot not in ("required", "optional"):
+        raise ValueError(f"Unknown INDEX_SNAPSHOT: {Connections.index_snapshot}")
+    table_nodes = get_table_nodes(sql_database)
+    fingerprint = compute_fingerprint(
+        Connections.fewshot_examples_path,
+        {node.node_id: node.text for node in table_nodes},
+        EMBED_MODEL_NAME,
+    )
+    inputs = {
+        "few_shot": compute_fingerprint(
+            Connections.fewshot_examples_path, {}, EMBED_MODEL_NAME
+        )
+    }
+
+    previous = None
+    for path in (Connections.index_snapshot_path, Connections.index_snapshot_cache_path):
+        snapshot = load_snapshot(path)
+        if snapshot is None:
+            continue
+        if snapshot.fingerprint == fingerprint:
+            logger.info(f"Loaded index snapshot from {path}")
+            return snapshot
+        logger.warning(
+            f"Index snapshot {path} is stale, embedding the changed tables and examples."
+        )
+        previous = previous or snapshot
+
+    if previous is None:
+        if Connections.index_snapshot == "required":
+            raise RuntimeError(
+                f"No index snapshot at {Connections.index_snapshot_path}: run "
+                "build_index_snapshot.py before building the image, or set "
+                "INDEX_SNAPSHOT=optional to embed everything at cold start."
+            )
+        logger.warning(
+            "No index snapshot, embedding every table and example at cold start."
+        )
+    return build_index_snapshot(table_nodes, embed_model, fingerprint, inputs, previous)
+
+
+def get_few_shot_retriever(snapshot):
+    """
+    Creates a fewshot retriever from the precomputed snapshot.
+
+    Args:
+        snapshot (IndexSnapshot): Index snapshot.
+
+    Returns:
+        few_shot_retriever (FewShotRetriever): Array-backed retriever over the fewshot examples.
+    """
+    return FewShotRetriever(
+        snapshot.vectors("few_shot"),
+        snapshot.vectors("few_shot_examples").reshape(-1),
+        snapshot.vectors("few_shot_offsets").reshape(-1),
+        dtype=Connections.fewshot_vector_dtype,
+        similarity_top_k=2,
+    )
+
+
+def get_few_shot_bank(snapshot):
+    """
+    Creates the fewshot example bank from the precomputed snapshot, reloaded
+    from FEWSHOT_EXAMPLES_S3_URI when it is set.
+
+    Args:
+        snapshot (IndexSnapshot): Index snapshot.
+
+    Returns:
+        few_shot_bank (FewShotBank): Fewshot example bank.
+    """
+    retriever = get_few_shot_retriever(snapshot)
+    if not Connections.fewshot_examples_s3_uri:
+        return FewShotBank(retriever, [], [], embed_model.get_text_embedding_batch)
+
+    bucket, _, key = Connections.fewshot_examples_s3_uri.removeprefix("s3://").partition("/")
+    bank = FewShotBank(
+        retriever,
+        # the rows the snapshot embedded, in the same order
+        read_few_shot_examples(Connections.fewshot_examples_path),
+        snapshot.vectors("few_shot"),
+        embed_model.get_text_embedding_batch,
+        s3_resource=Connections.s3_resource,
+        bucket=bucket,
+        key=key,
+        check_interval=Connections.fewshot_reload_interval,
+        dtype=Connections.fewshot_vector_dtype,
+        similarity_top_k=2,
+        on_reload=seed_sql_templates,
+    )
+    bank.refresh(force=True)
+    return bank
+
+
+def get_table_object_index(sql_database, snapshot):
+    """
+    Creates the table object index from the precomputed snapshot.
+
+    Args:
+        sql_database (SQLDatabase): SQL database.
+        snapshot (IndexSnapshot): Index snapshot.
+
+    Returns:
+        obj_index (ObjectIndex): ObjectIndex object.
+    """
+    table_nodes = [
+        TextNode(
+            id_=record["id"],
+            text=record["text"],
+            metadata=record["metadata"],
+            excluded_embed_metadata_keys=["name", "context"],
+            excluded_llm_metadata_keys=["name", "context"],
+            embedding=vector.tolist(),
+        )
+        for record, vector in zip(
+            snapshot.records("tables"), snapshot.vectors("tables")
+        )
+    ]
+    return ObjectIndex(VectorStoreIndex(table_nodes), SQLTableNodeMapping(sql_database))
+
+
+def get_snapshot_table_schema_objs(snapshot):
+    """
+    Returns the SQLTableSchema objects of the tables stored in the snapshot.
+
+    Args:
+        snapshot (IndexSnapshot): Index snapshot.
+
+    Returns:
+        table_schema_objs (list): List of SQLTableSchema objects.
+    """
+    return [
+        SQLTableSchema(
+            table_name=record["metadata"]["name"],
+            context_str=record["metadata"].get("context"),
+        )
+        for record in snapshot.records("tables")
+    ]
+
+
+@contextmanager
+def embedding_context():
+    """
+    Scopes question embeddings to a single request, so that the fewshot and table
+    retrievers share one embedding call per question.
+    """
+    token = request_embeddings.set({})
+    try:
+        yield
+    finally:
+        request_embeddings.reset(token)
+
+
+def get_question_bundle(question):
+    """
+    Creates a query bundle carrying the question embedding, computing it at most
+    once per request.
+
+    Args:
+        question (str): User question.
+
+    Returns:
+        query_bundle (QueryBundle): Query bundle with the question embedding.
+    """
+    embeddings = request_embeddings.get()
+    if embeddings is None:
+        with stage("question_embedding"):
+            embedding = embed_model.get_query_embedding(question)
+    else:
+        if question not in embeddings:
+            with stage("question_embedding"):
+                embeddings[question] = embed_model.get_query_embedding(question)
+        embedding = embeddings[question]
+    return QueryBundle(query_str=question, embedding=embedding)
+
+
+class TableRetriever:
+    """
+    Table retriever that reuses the request's question embedding, and skips
+    retrieval entirely when the database has a single table.
+
+    Args:
+        obj_index (ObjectIndex): Table object index.
+        table_schema_objs (list): SQLTableSchema objects of all tables.
+        similarity_top_k (int): Number of tables to retrieve.
+    """
+
+    def __init__(self, obj_index, table_schema_objs, similarity_top_k=5):
+        self._retriever = obj_index.as_retriever(similarity_top_k=similarity_top_k)
+        self._table_schema_objs = table_schema_objs
+
+    def retrieve(self, query_str):
+        if len(self._table_schema_objs) == 1:
+            return list(self._table_schema_objs)
+        query_bundle = get_question_bundle(query_str)
+        with stage("table_retrieval"):
+            return self._retriever.retrieve(query_bundle)
+
+
+def create_local_sql_engine():
+    """
+    Loads the small tables into the local SQL tier when SQL_EXECUTION_MODE is "auto".
+
+    Returns:
+        local_engine (LocalSQLEngine): Local SQL tier, or None to run everything on Athena.
+    """
+    if Connections.sql_execution_mode == "athena":
+        return None
+    elif Connections.sql_execution_mode != "auto":
+        raise ValueError(
+            f"Unknown SQL execution mode: {Connections.sql_execution_mode}"
+        )
+
+    try:
+        local_engine = LocalSQLEngine(
+            Connections.glue_client,
+            Connections.s3_resource,
+            Connections.text2sql_database,
+            max_table_bytes=Connections.local_table_max_bytes,
+            download_dir=Connections.local_tables_dir,
+        )
+    except ImportError as e:
+        logger.warning(f"Local SQL tier disabled: {e}")
+        return None
+    local_engine.load(data_version)
+    return local_engine
+
+
+def get_link_values(table_name, column_name):
+    """
+    Returns the distinct values of a linked column, from the table context or
+    from the local SQL tier.
+
+    Args:
+        table_name (str): Table name.
+        column_name (str): Column name.
+
+    Returns:
+        values (list): Distinct values, or None if they are not available
+            without querying Athena.
+    """
+    if table_context is not None and table_name in table_context:
+        values = table_context.link_values(table_name, column_name)
+        if values is not None:
+            return values
+    if local_sql_engine is not None and table_name in local_sql_engine.tables:
+        rows, _ = local_sql_engine.run_sql(
+            f'SELECT DISTINCT "{column_name}" FROM "{table_name}" '
+            f'WHERE "{column_name}" IS NOT NULL'
+        )
+        return [value for (value,) in rows]
+    return None
+
+
+def create_value_linker():
+    """
+    Builds the value index of the VALUE_LINK_COLUMNS columns.
 
-    few_shot_index = VectorStoreIndex(few_shot_nodes)
-    few_shot_retriever = few_shot_index.as_retriever(similarity_top_k=2)
-    return few_shot_retriever, data_dict
+    Returns:
+        value_linker (ValueLinker): Value linker, or None if no column values
+            are available.
+    """
+    values = {}
+    for column in Connections.value_link_columns:
+        table_name, _, column_name = column.partition(".")
+        try:
+            column_values = get_link_values(table_name, column_name)
+        except Exception as e:
+            logger.warning(f"Could not read the values of {column}: {e}")
+            continue
+        if column_values is None:
+            logger.warning(
+                f"No values of {column} in the table context or the local SQL "
+                "tier, it will not be linked."
+            )
+            continue
+        values[column] = column_values
+    if not values:
+        return None
+    linker = ValueLinker(values)
+    logger.info(f"Indexed {len(linker)} values of {', '.join(values)} for linking.")
+    return linker
+
+
+def link_question(question):
+    """
+    Rewrites the column values mentioned in a question to their canonical
+    form, e.g. "p32xlarge" to "p3.2xlarge", see `value_linker`.
+
+    Args:
+        question (str): User question.
+
+    Returns:
+        question (str): The linked question, or the question itself without
+            a value index.
+    """
+    if value_linker is None:
+        return question
+    with stage("value_linking"):
+        linked_question, links = value_linker.link(question)
+    set_property("value_links", len(links))
+    for link in links:
+        logger.info(
+            f"Linked {link['mention']!r} to {link['column']} = {link['value']!r} "
+            f"({link['match']} match)."
+        )
+    return linked_question
+
+
+def get_question_entities(question):
+    """
+    Returns the entities a cached answer must share with a question: the values
+    of the value index it mentions and its other words with a digit, such as
+    numbers or "m5". Questions differing only in these, e.g. two instance
+    names, embed close to each other but have different answers.
+
+    Args:
+        question (str): Linked question.
+
+    Returns:
+        entities (list): Sorted "table.column=value" and lower-case words.
+    """
+    mentions = value_linker.find(question) if value_linker is not None else []
+    entities = [f"{mention['column']}={mention['value']}" for mention in mentions]
+    for token in TOKEN_PATTERN.finditer(question):
+        if any(c.isdigit() for c in token.group()) and not any(
+            mention["start"] <= token.start() < mention["end"] for mention in mentions
+        ):
+            entities.append(token.group().lower())
+    return sorted(entities)
+
+
+def create_sql_template_cache():
+    """
+    Creates the SQL template cache, seeded with the templates of the fewshot
+    examples in use, see `seed_sql_templates`.
+
+    Returns:
+        template_cache (SQLTemplateCache): SQL template cache, or None if
+            SQL_TEMPLATE_CACHE_MAX_ENTRIES is 0.
+    """
+    if Connections.sql_template_cache_max_entries <= 0:
+        return None
+    return SQLTemplateCache(
+        value_linker, max_entries=Connections.sql_template_cache_max_entries
+    )
+
+
+def seed_sql_templates(rows):
+    """
+    Seeds the SQL template cache with the templates of fewshot example rows, at
+    cold start and after each reload of the example bank. Their SQL never ran,
+    so the seeds are unverified until they return rows, see `sql_template_cache`.
+
+    Args:
+        rows (list): Fewshot example rows.
+    """
+    if template_cache is None:
+        return
+    seeded = template_cache.seed(
+        [
+            (link_question(row["example_input_question"]), row["example_output_query"])
+            for row in rows
+        ]
+    )
+    logger.info(f"Seeded {seeded} SQL templates.")
+
+
+def create_sql_generator(model_name):
+    """
+    Creates the streaming SQL generator of a model.
+
+    Args:
+        model_name (str): Key of Connections.MODELID_MAPPING.
+
+    Returns:
+        sql_generator (StreamingSQLGenerator): SQL generator.
+    """
+    return StreamingSQLGenerator(
+        Connections.bedrock_client,
+        Connections.MODELID_MAPPING[model_name],
+        max_tokens=1024,
+        cache_boundaries=(
+            SQL_CACHE_BOUNDARIES if Connections.use_prompt_cache(model_name) else []
+        ),
+        cache_min_tokens=Connections.prompt_cache_min_tokens(model_name),
+    )
+
+
+def create_answer_cache():
+    """
+    Creates the semantic answer cache with the backend set in SEMANTIC_CACHE_BACKEND.
+
+    Returns:
+        answer_cache (SemanticCache): Semantic cache, or None if the backend is "none".
+    """
+    backend_name = Connections.semantic_cache_backend
+    if backend_name == "none":
+        return None
+    elif backend_name == "memory":
+        backend = InMemoryBackend()
+    elif backend_name == "file":
+        backend = FileBackend(Connections.semantic_cache_dir)
+    elif backend_name == "s3":
+        bucket, prefix = parse_s3_uri(Connections.semantic_cache_s3_uri)
+        backend = S3Backend(Connections.s3_resource, bucket, prefix)
+    elif backend_name == "dynamodb":
+        dynamodb = Connections.get_resource("dynamodb")
+        backend = DynamoDBBackend(
+            ClientHandle(lambda: dynamodb.Table(Connections.semantic_cache_table))
+        )
+    else:
+        raise ValueError(f"Unknown semantic cache backend: {backend_name}")
+
+    return SemanticCache(
+        backend,
+        threshold=Connections.semantic_cache_threshold,
+        ttl=Connections.semantic_cache_ttl,
+        max_entries=Connections.semantic_cache_max_entries,
+    )
 
 
 def few_shot_examples_fn(**kwargs):
@@ -80,28 +695,18 @@ def few_shot_examples_fn(**kwargs):
         example_set (str): Example set.
     """
     question = kwargs["query_str"]
-    retrieved_nodes = few_shot_retriever.retrieve(question)
-    result_strs = []
-    example_set = "No example set provided"
-    for n in retrieved_nodes:
-        logger.info(f"Few shots node:\n {n}")
-        content = json.loads(n.get_content())
-        raw_dict = data_dict[content]
-        example = [f"{k.capitalize()}: {raw_dict[k]}" for k in raw_dict.keys()]
-
-        result_str = "\n".join(example)
-        result_strs.append(result_str)
-
-    example_set = "\n\n".join(result_strs)
+    embedding = get_question_bundle(question).embedding
+    with stage("few_shot_retrieval"):
+        retrieved_examples = few_shot_bank.retrieve(embedding)
+    for example, score in retrieved_examples:
+        logger.info(f"Few shots example (score {score:.4f}):\n {example}")
+
+    example_set = "\n\n".join(example for example, _ in retrieved_examples)
     logger.info("Example set provided:")
     logger.info(example_set)
     return example_set
 
 
-few_shot_retriever, data_dict = get_few_shot_retriever(
-    Connections.fewshot_examples_path
-)
-
 SQL_PROMPT = PromptTemplate(
     SQL_TEMPLATE_STR,
     function_mappings={
@@ -109,61 +714,129 @@ def few_shot_examples_fn(**kwargs):
     },
 )
 
+# Prompt without the instance name normalization, for linked questions
+SQL_LINKED_PROMPT = PromptTemplate(
+    SQL_LINKED_TEMPLATE_STR,
+    function_mappings={
+        "few_shot_examples": few_shot_examples_fn,
+    },
+)
+
 RESPONSE_PROMPT = Prompt(RESPONSE_TEMPLATE_STR)
 
+# Escalation counters of the model cascade, shared by the query engines
+cascade_stats = CascadeStats()
+
+# Engine components, set by `load_engine`
+embedding_cache = None
+embed_model = None
+data_version = None
+answer_cache = None
+sql_result_cache = None
+local_sql_engine = None
+sql_guard = None
+table_context = None
+schema_provider = None
+sql_database = None
+index_snapshot = None
+few_shot_bank = None
+value_linker = None
+template_cache = None
+query_engine = None
+obj_index = None
+
+# Whether the AWS clients were created since the last snapshot, see `connect_engine`
+connected = False
+
 
 def create_query_engine(
-    model_name="Claude3Haiku", SQL_PROMPT=SQL_PROMPT, RESPONSE_PROMPT=RESPONSE_PROMPT
+    model_name=Connections.text2sql_model,
+    SQL_PROMPT=SQL_PROMPT,
+    RESPONSE_PROMPT=RESPONSE_PROMPT,
+    sql_database=None,
+    index_snapshot=None,
+    response_mode=Connections.response_mode,
+    sql_generation_mode=Connections.sql_generation_mode,
+    llm_api=Connections.llm_api,
+    cascade_models=Connections.cascade_models,
+    template_cache=None,
 ):
     """Generates a query engine and object index for answering questions using SQL retrieval.
 
     Args:
-        model_name (str): Model to use. Defaults to "Claude3Haiku".
+        model_name (str): Model to use. Defaults to TEXT2SQL_MODEL.
         SQL_PROMPT (PromptTemplate): Prompt for generating SQL. Defaults to SQL_PROMPT.
         RESPONSE_PROMPT (Prompt): Prompt for generating final response. Defaults to RESPONSE_PROMPT.
+        sql_database (SQLDatabase): SQL database, see `load_engine`.
+        index_snapshot (IndexSnapshot): Precomputed embeddings, see `load_engine`.
+        response_mode (str): "auto" renders small results without the LLM, "llm"
+            always synthesizes the answer. Defaults to RESPONSE_MODE.
+        sql_generation_mode (str): "stream" streams the SQL with early stopping,
+            "predict" generates it with the LLM. Defaults to SQL_GENERATION_MODE.
+        llm_api (str): "converse" calls the Converse API with prompt-cache
+            checkpoints, "invoke" the InvokeModel API. Defaults to LLM_API.
+        cascade_models (list): Models generating the SQL, from the cheapest to the
+            strongest, with "stream" generation. Fewer than two models disable
+            the cascade. Defaults to CASCADE_MODELS.
+        template_cache (SQLTemplateCache): SQL template cache, see `load_engine`.
+            None always generates the SQL.
 
     Returns:
-        query_engine (SQLTableRetrieverQueryEngine): SQLTableRetrieverQueryEngine object.
+        query_engine (TextToSQLQueryEngine): TextToSQLQueryEngine object.
         obj_index (ObjectIndex): ObjectIndex object.
     """
-    # create sql database object
-    engine = create_sql_engine()
-    sql_database = SQLDatabase(engine, sample_rows_in_table_info=2)
+    if sql_database is None or index_snapshot is None:
+        raise ValueError("The SQL database and the index snapshot are required.")
 
-    # Set up embeddings and LLM
-    embed_model = BedrockEmbedding(
-        client=Connections.bedrock_client, model_name="amazon.titan-embed-text-v1"
-    )
-    
     # initialize llm
-    llm = Connections.get_bedrock_llm(model_name=model_name, max_tokens=1024)
+    if llm_api not in ("converse", "invoke"):
+        raise ValueError(f"Unknown LLM API: {llm_api}")
+    if llm_api == "converse" and not Connections.use_prompt_cache(model_name):
+        logger.info(f"Prompt caching is off for {model_name}, see PROMPT_CACHE.")
+    llm = Connections.get_bedrock_llm(
+        model_name=model_name,
+        max_tokens=1024,
+        converse=llm_api == "converse",
+        # the response prompt has no stable block long enough to be cached
+        cache_boundaries=SQL_CACHE_BOUNDARIES,
+    )
 
     # Update global settings instead of using ServiceContext
-    Settings.embed_model = embed_model
     Settings.llm = llm
 
-    # Create table node mapping and schema objects
-    table_node_mapping = SQLTableNodeMapping(sql_database)
-    table_schema_objs = []
-    tables = list(sql_database._all_tables)
-    for table in tables:
-        table_schema_objs.append(
-            (SQLTableSchema(table_name=table, context_str=table_details[table]))
-        )
+    # Create the object index from the precomputed table schema nodes
+    obj_index = get_table_object_index(sql_database, index_snapshot)
 
-    # Create the object index
-    obj_index = ObjectIndex.from_objects(
-        table_schema_objs,
-        table_node_mapping,
-        VectorStoreIndex,
-    )
+    if sql_generation_mode == "stream":
+        sql_generator = create_sql_generator(model_name)
+    elif sql_generation_mode == "predict":
+        sql_generator = None
+    else:
+        raise ValueError(f"Unknown SQL generation mode: {sql_generation_mode}")
+
+    cascade = None
+    if len(cascade_models) > 1:
+        if sql_generator is None:
+            raise ValueError("The model cascade requires SQL_GENERATION_MODE=stream")
+        cascade = {
+            "sql_generators": [
+                (name, create_sql_generator(name)) for name in cascade_models
+            ],
+            "escalate_on": Connections.cascade_escalate_on,
+            "min_rows": Connections.cascade_min_rows,
+            "stats": cascade_stats,
+        }
 
     # Create the query engine
-    query_engine = SQLTableRetrieverQueryEngine(
+    query_engine = TextToSQLQueryEngine(
         sql_database,
-        obj_index.as_retriever(similarity_top_k=5),
+        TableRetriever(obj_index, get_snapshot_table_schema_objs(index_snapshot)),
         text_to_sql_prompt=SQL_PROMPT,
         response_synthesis_prompt=RESPONSE_PROMPT,
+        response_mode=response_mode,
+        sql_generator=sql_generator,
+        cascade=cascade,
+        template_cache=template_cache,
     )
     prompts_dict = query_engine.get_prompts()
     logger.info(f"prompts_dict{prompts_dict}")
@@ -171,4 +844,206 @@ def create_query_engine(
     return query_engine, obj_index
 
 
-query_engine, obj_index = create_query_engine()
+def get_answer_version():
+    """
+    Returns the version the semantic cache stores answers under: the data
+    version and the version of the fewshot example bank, since new examples
+    change the generated SQL.
+    """
+    return f"{data_version.current()}:{few_shot_bank.version}"
+
+
+def load_engine():
+    """
+    Snapshot-safe initialization phase: loads the table context, the Glue
+    schemas, the index snapshot and the small tables of the local SQL tier, and
+    builds the query engine. Runs once per execution environment, each phase
+    timed in `init_metrics`.
+
+    The AWS clients used here are ClientHandle objects, dropped before a
+    SnapStart snapshot and recreated by `connect_engine` after the restore, so
+    the engine does not keep connections or credentials from the snapshot.
+    """
+    global embedding_cache, embed_model, data_version, answer_cache
+    global sql_result_cache, local_sql_engine, sql_guard, table_context
+    global schema_provider, sql_database, index_snapshot, few_shot_bank
+    global value_linker, template_cache, query_engine, obj_index
+
+    if query_engine is not None:
+        return
+    init_metrics.lap("imports")
+
+    embedding_cache = TieredEmbeddingCache(
+        EMBED_MODEL_NAME,
+        max_entries=Connections.embedding_cache_max_entries,
+        cache_dir=Connections.embedding_cache_dir,
+        max_file_bytes=Connections.embedding_cache_file_max_bytes,
+        s3_resource=Connections.s3_resource,
+        s3_uri=Connections.embedding_cache_s3_uri,
+    )
+
+    embed_model = BedrockEmbedding(
+        client=Connections.bedrock_client,
+        model_name=EMBED_MODEL_NAME,
+        embeddings_cache=embedding_cache,
+    )
+
+    # Update settings instead of using ServiceContext
+    Settings.embed_model = embed_model
+    # The indexes are built from embedded nodes, so the default sentence splitter,
+    # and the tokenizer it loads, is never needed
+    Settings.transformations = []
+    init_metrics.lap("embedding_model")
+
+    data_version = DataVersion(
+        Connections.glue_client,
+        Connections.s3_resource,
+        Connections.text2sql_database,
+        check_interval=Connections.data_version_check_interval,
+    )
+
+    answer_cache = create_answer_cache()
+
+    sql_result_cache = (
+        SQLResultCache(
+            max_entries=Connections.sql_result_cache_max_entries,
+            ttl=Connections.sql_result_cache_ttl,
+        )
+        if Connections.sql_result_cache_max_entries > 0
+        else None
+    )
+    init_metrics.lap("caches")
+
+    local_sql_engine = create_local_sql_engine()
+    init_metrics.lap("local_sql_tier")
+
+    sql_guard = SQLGuard(
+        max_rows=Connections.sql_max_rows,
+        max_scan_bytes=Connections.sql_max_scan_bytes,
+        estimator=ScanEstimator(
+            Connections.glue_client,
+            Connections.s3_resource,
+            Connections.text2sql_database,
+            data_version=data_version,
+        ),
+    )
+
+    table_context = get_table_context()
+
+    schema_provider = GlueSchemaProvider(
+        Connections.glue_client, Connections.text2sql_database, table_details
+    )
+    schema_provider.load()
+    init_metrics.lap("schema")
+
+    # create sql database object
+    sql_database = TextToSQLDatabase(
+        create_sql_engine(),
+        result_cache=sql_result_cache,
+        data_version=data_version,
+        local_engine=local_sql_engine,
+        guard=sql_guard,
+        table_context=table_context,
+        schema_provider=schema_provider,
+        max_result_rows=Connections.sql_result_max_rows,
+        max_result_chars=Connections.sql_result_max_chars,
+        top_result_rows=Connections.sql_result_top_rows,
+        sample_rows_in_table_info=2,
+    )
+    init_metrics.lap("sql_database")
+
+    index_snapshot = get_index_snapshot(sql_database, embed_model)
+
+    few_shot_bank = get_few_shot_bank(index_snapshot)
+    init_metrics.lap("index_snapshot")
+
+    value_linker = create_value_linker()
+    init_metrics.lap("value_index")
+
+    template_cache = create_sql_template_cache()
+    seed_sql_templates(
+        few_shot_bank.rows or read_few_shot_examples(Connections.fewshot_examples_path)
+    )
+    init_metrics.lap("sql_templates")
+
+    query_engine, obj_index = create_query_engine(
+        SQL_PROMPT=SQL_PROMPT if value_linker is None else SQL_LINKED_PROMPT,
+        sql_database=sql_database,
+        index_snapshot=index_snapshot,
+        template_cache=template_cache,
+    )
+    init_metrics.lap("query_engine")
+
+
+def connect_engine(metrics=None, restored=False):
+    """
+    Post-restore initialization phase: creates the AWS session, its credentials
+    and the shared clients.
+
+    Args:
+        metrics (StageMetrics): Metrics timing the phase. Defaults to init_metrics.
+        restored (bool): The environment was restored from a snapshot:
+            recreate the clients and the pooled Athena connections, recheck the
+            data version and reload the local tables that changed.
+    """
+    global connected, value_linker
+
+    metrics = metrics or init_metrics
+    if restored:
+        Connections.reset_clients()
+        sql_database.engine.dispose()
+    Connections.connect()
+    metrics.lap("clients")
+    if restored:
+        data_version.refresh(force=True)
+        if local_sql_engine is not None:
+            local_sql_engine.load(data_version)
+        # new values, e.g. instance types, of the reloaded tables
+        value_linker = create_value_linker() or value_linker
+        if template_cache is not None:
+            template_cache.value_linker = value_linker
+        metrics.lap("data_refresh")
+    connected = True
+
+
+def disconnect_engine():
+    """
+    Drops the AWS clients and the pooled Athena connections, before a snapshot.
+    """
+    global connected
+
+    Connections.reset_clients()
+    sql_database.engine.dispose()
+    connected = False
+
+
+def warm_up(questions):
+    """
+    Primes the connections and caches of the engine without calling the LLM:
+    one uncached embedding call keeps the Bedrock connection open, the questions
+    are linked and embedded and their few-shot examples and tables retrieved, the data
+    version is checked, and Athena and the local SQL tier get a connection.
+
+    Args:
+        questions (list): Questions whose embeddings and retrievals are primed.
+    """
+    with stage("bedrock_connection"):
+        embed_model._get_query_embedding(WARMUP_TEXT)
+    with embedding_context():
+        for question in questions:
+            question = link_question(question)
+            embedding = get_question_bundle(question).embedding
+            with stage("few_shot_retrieval"):
+                few_shot_bank.retrieve(embedding)
+            with stage("table_retrieval"):
+                obj_index.as_retriever(similarity_top_k=5).retrieve(
+                    get_question_bundle(question)
+                )
+    with stage("data_version"):
+        data_version.current()
+    with stage("athena_connection"):
+        with sql_database.engine.connect():
+            pass
+    if local_sql_engine is not None:
+        with stage("local_execution"):
+            local_sql_engine.run_sql("SELECT 1")
@@ -0,0 +1,62 @@
+"""
+build_table_context.py
+
+Step run after the Glue crawler that profiles every table of the database with
+Athena and writes the table context into `table_context.json`, which the
+Dockerfile copies into the image. When TABLE_CONTEXT_S3_URI is set the context
+is uploaded there as well, so a re-crawl can refresh it without a new image.
+
+Run it from this folder before `build_index_snapshot.py` and `cdk deploy`, with
+AWS credentials and the Lambda environment variables set:
+
+    python build_table_context.py
+"""
+
+import logging
+
+from sqlalchemy import create_engine
+
+from athena_execution import get_engine_options, get_engine_url
+from connections import Connections
+from prompt_templates import table_details
+from schema_provider import GlueSchemaProvider
+from table_context import build_table_context
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    driver, connect_args = get_engine_options(
+        fetch_mode=Connections.athena_fetch_mode,
+        result_reuse_minutes=0,
+        work_group=Connections.athena_workgroup,
+    )
+    engine = create_engine(
+        get_engine_url(
+            driver,
+            Connections.region_name,
+            Connections.text2sql_database,
+            Connections.athena_bucket_name,
+        ),
+        connect_args=connect_args,
+    )
+    schema_provider = GlueSchemaProvider(
+        Connections.glue_client, Connections.text2sql_database, table_details
+    )
+    schema_provider.load()
+    table_context = build_table_context(
+        engine,
+        schema_provider,
+        Connections.text2sql_database,
+        link_columns=Connections.value_link_columns,
+    )
+
+    table_context.save(Connections.table_context_path)
+    logger.info(f"Table context written to {Connections.table_context_path}")
+    if Connections.table_context_s3_uri:
+        bucket, _, key = Connections.table_context_s3_uri.removeprefix("s3://").partition("/")
+        table_context.upload(Connections.s3_resource, bucket, key)
+        logger.info(f"Table context uploaded to {Connections.table_context_s3_uri}")
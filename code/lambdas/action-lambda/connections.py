@@ -1,28 +1,319 @@
 import os
+import tempfile
+import threading
+import weakref
 import boto3
-from llama_index.llms.bedrock import Bedrock
+from botocore.config import Config
+
+from converse_llm import BedrockConverseLLM
+
+
+class ClientHandle:
+    """
+    Stands for an AWS session, client or resource created on first use.
+
+    The objects of the query engine hold handles instead of clients, so that
+    `Connections.reset_clients` can drop every client before a SnapStart
+    snapshot, and the next call creates a new one with fresh credentials and
+    connections.
+
+    Args:
+        factory (callable): Creates the session, client or resource.
+    """
+
+    _handles = weakref.WeakSet()
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+        ClientHandle._handles.add(self)
+
+    def get(self):
+        """
+        Returns the client, creating it if needed.
+        """
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return target
+
+    def reset(self):
+        """
+        Drops the client, the next use creates a new one.
+        """
+        with self._lock:
+            self._target = None
+
+    def __getattr__(self, name):
+        if name in ("_factory", "_target", "_lock"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+# Region prefixes and the prefix of the cross-region inference profiles
+# available from them, the most specific first
+INFERENCE_PROFILE_PREFIXES = [
+    ("us-gov-", "us-gov."),
+    ("us-", "us."),
+    ("eu-", "eu."),
+    ("ap-", "apac."),
+]
+
+
+def inference_profile_prefix(region_name):
+    """
+    Returns the prefix of the cross-region inference profile IDs of a region,
+    e.g. "eu." for eu-west-1, and "us." for regions without a geography of
+    their own.
+    """
+    for region_prefix, profile_prefix in INFERENCE_PROFILE_PREFIXES:
+        if region_name.startswith(region_prefix):
+            return profile_prefix
+    return "us."
 
 
 class Connections:
     region_name = os.environ["AWS_REGION"]
+
+    # Models only invoked through a cross-region inference profile get the
+    # prefix of the geography of the region
+    MODELID_MAPPING = {
+        "Titan": "amazon.titan-tg1-large",
+        "Jurassic": "ai21.j2-ultra-v1",
+        "Claude2": "anthropic.claude-v2",
+        "ClaudeInstant": "anthropic.claude-instant-v1",
+        "Claude3Opus": "anthropic.claude-3-opus-20240229-v1:0",
+        "Claude3Sonnet": "anthropic.claude-3-sonnet-20240229-v1:0",
+        "Claude3Haiku": "anthropic.claude-3-haiku-20240307-v1:0",
+        "Claude35Haiku": inference_profile_prefix(region_name)
+        + "anthropic.claude-3-5-haiku-20241022-v1:0",
+        "Claude37Sonnet": inference_profile_prefix(region_name)
+        + "anthropic.claude-3-7-sonnet-20250219-v1:0",
+    }
+    # Models supporting Bedrock prompt caching, with the minimum number of
+    # tokens of a cached prefix. Only these get cache checkpoints with the
+    # default PROMPT_CACHE=auto; the default TEXT2SQL_MODEL, Claude3Haiku, is
+    # not one of them
+    PROMPT_CACHE_MIN_TOKENS = {"Claude35Haiku": 2048, "Claude37Sonnet": 1024}
+    PROMPT_CACHE_MODELS = set(PROMPT_CACHE_MIN_TOKENS)
+
     athena_bucket_name = os.environ["ATHENA_BUCKET_NAME"]
     text2sql_database = os.environ["TEXT2SQL_DATABASE"]
     log_level = os.environ["LOG_LEVEL"]
     fewshot_examples_path = os.environ["FEWSHOT_EXAMPLES_PATH"]
-    s3_resource = boto3.resource("s3", region_name=region_name)
-    bedrock_client = boto3.client("bedrock-runtime", region_name=region_name)
+    fewshot_vector_dtype = os.environ.get("FEWSHOT_VECTOR_DTYPE", "float32")
+    fewshot_examples_s3_uri = os.environ.get("FEWSHOT_EXAMPLES_S3_URI")
+    fewshot_reload_interval = float(os.environ.get("FEWSHOT_RELOAD_INTERVAL", "300"))
+    index_snapshot_path = os.environ.get("INDEX_SNAPSHOT_PATH", "index_snapshot.bin")
+    index_snapshot = os.environ.get("INDEX_SNAPSHOT", "required")
+    index_snapshot_cache_path = os.path.join(
+        tempfile.gettempdir(), "index_snapshot.bin"
+    )
+    table_context_path = os.environ.get("TABLE_CONTEXT_PATH", "table_context.json")
+    table_context_s3_uri = os.environ.get("TABLE_CONTEXT_S3_URI")
+    value_link_columns = [
+        column
+        for column in os.environ.get(
+            "VALUE_LINK_COLUMNS", "ec2_pricing.instance_name"
+        ).split(",")
+        if column
+    ]
+    embedding_cache_dir = os.environ.get(
+        "EMBEDDING_CACHE_DIR", os.path.join(tempfile.gettempdir(), "embedding_cache")
+    )
+    embedding_cache_max_entries = int(
+        os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", "4096")
+    )
+    embedding_cache_file_max_bytes = int(
+        os.environ.get("EMBEDDING_CACHE_FILE_MAX_BYTES", str(64 * 1024 * 1024))
+    )
+    embedding_cache_s3_uri = os.environ.get("EMBEDDING_CACHE_S3_URI")
+    semantic_cache_backend = os.environ.get("SEMANTIC_CACHE_BACKEND", "memory")
+    semantic_cache_threshold = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+    semantic_cache_ttl = float(os.environ.get("SEMANTIC_CACHE_TTL", "86400"))
+    semantic_cache_max_entries = int(
+        os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "1000")
+    )
+    semantic_cache_dir = os.environ.get(
+        "SEMANTIC_CACHE_DIR", os.path.join(tempfile.gettempdir(), "semantic_cache")
+    )
+    semantic_cache_s3_uri = os.environ.get("SEMANTIC_CACHE_S3_URI")
+    semantic_cache_table = os.environ.get("SEMANTIC_CACHE_TABLE")
+    athena_fetch_mode = os.environ.get("ATHENA_FETCH_MODE", "arrow")
+    athena_result_reuse_minutes = int(
+        os.environ.get("ATHENA_RESULT_REUSE_MINUTES", "60")
+    )
+    athena_initial_poll_interval = float(
+        os.environ.get("ATHENA_INITIAL_POLL_INTERVAL", "0.05")
+    )
+    athena_max_poll_interval = float(os.environ.get("ATHENA_MAX_POLL_INTERVAL", "1.0"))
+    athena_unload = os.environ.get("ATHENA_UNLOAD", "false").lower() == "true"
+    athena_workgroup = os.environ.get("ATHENA_WORKGROUP", "primary")
+    sql_max_rows = int(os.environ.get("SQL_MAX_ROWS", "1000"))
+    sql_max_scan_bytes = int(os.environ.get("SQL_MAX_SCAN_BYTES", str(1024**3)))
+    sql_execution_mode = os.environ.get("SQL_EXECUTION_MODE", "auto")
+    local_table_max_bytes = int(
+        os.environ.get("LOCAL_TABLE_MAX_BYTES", str(64 * 1024 * 1024))
+    )
+    local_tables_dir = os.path.join(tempfile.gettempdir(), "local_tables")
+    response_mode = os.environ.get("RESPONSE_MODE", "auto")
+    sql_generation_mode = os.environ.get("SQL_GENERATION_MODE", "stream")
+    text2sql_model = os.environ.get("TEXT2SQL_MODEL", "Claude3Haiku")
+    llm_api = os.environ.get("LLM_API", "converse")
+    prompt_cache = os.environ.get("PROMPT_CACHE", "auto")
+    cascade_models = [
+        name for name in os.environ.get("CASCADE_MODELS", "").split(",") if name
+    ]
+    cascade_escalate_on = [
+        reason
+        for reason in os.environ.get(
+            "CASCADE_ESCALATE_ON", "parse,schema,execution,empty"
+        ).split(",")
+        if reason
+    ]
+    cascade_min_rows = int(os.environ.get("CASCADE_MIN_ROWS", "1"))
+    metrics_sink = os.environ.get("METRICS_SINK", "emf")
+    metrics_path = os.environ.get(
+        "METRICS_PATH", os.path.join(tempfile.gettempdir(), "metrics.jsonl")
+    )
+    sql_result_cache_max_entries = int(
+        os.environ.get("SQL_RESULT_CACHE_MAX_ENTRIES", "256")
+    )
+    sql_result_cache_ttl = float(os.environ.get("SQL_RESULT_CACHE_TTL", "3600"))
+    sql_result_max_rows = int(os.environ.get("SQL_RESULT_MAX_ROWS", "100"))
+    sql_result_max_chars = int(os.environ.get("SQL_RESULT_MAX_CHARS", "20000"))
+    sql_result_top_rows = int(os.environ.get("SQL_RESULT_TOP_ROWS", "10"))
+    sql_template_cache_max_entries = int(
+        os.environ.get("SQL_TEMPLATE_CACHE_MAX_ENTRIES", "256")
+    )
+    data_version_check_interval = float(
+        os.environ.get("DATA_VERSION_CHECK_INTERVAL", "60")
+    )
+    aws_max_pool_connections = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "25"))
+    aws_max_attempts = int(os.environ.get("AWS_MAX_ATTEMPTS", "5"))
+    aws_connect_timeout = float(os.environ.get("AWS_CONNECT_TIMEOUT", "2"))
+    aws_read_timeout = float(os.environ.get("AWS_READ_TIMEOUT", "10"))
+    bedrock_read_timeout = float(os.environ.get("BEDROCK_READ_TIMEOUT", "60"))
+    # "on-demand", "provisioned-concurrency" or "snap-start", set by Lambda
+    initialization_type = os.environ.get("AWS_LAMBDA_INITIALIZATION_TYPE", "on-demand")
+    uc2_max_questions = int(os.environ.get("UC2_MAX_QUESTIONS", "5"))
+    uc2_max_parallel = int(os.environ.get("UC2_MAX_PARALLEL", "4"))
+    warmup_questions = [
+        question
+        for question in os.environ.get("WARMUP_QUESTIONS", "").split("|")
+        if question
+    ]
+
+    # One session and client configuration shared by every AWS client: pooled
+    # keep-alive connections, and adaptive retries that back off together when
+    # a service throttles. The clients are created on first use, see ClientHandle
+    session = ClientHandle(
+        lambda: boto3.session.Session(region_name=Connections.region_name)
+    )
+    client_config = Config(
+        max_pool_connections=aws_max_pool_connections,
+        connect_timeout=aws_connect_timeout,
+        read_timeout=aws_read_timeout,
+        tcp_keepalive=True,
+        retries={"mode": "adaptive", "total_max_attempts": aws_max_attempts},
+    )
+    bedrock_config = client_config.merge(Config(read_timeout=bedrock_read_timeout))
+
+    s3_resource = ClientHandle(
+        lambda: Connections.session.resource("s3", config=Connections.client_config)
+    )
+    bedrock_client = ClientHandle(
+        lambda: Connections.session.client(
+            "bedrock-runtime", config=Connections.bedrock_config
+        )
+    )
+    glue_client = ClientHandle(
+        lambda: Connections.session.client("glue", config=Connections.client_config)
+    )
 
     @staticmethod
-    def get_bedrock_llm(model_name="Claude3Haiku", max_tokens=256):
-        MODELID_MAPPING = {
-            "Titan": "amazon.titan-tg1-large",
-            "Jurassic": "ai21.j2-ultra-v1",
-            "Claude2": "anthropic.claude-v2",
-            "ClaudeInstant": "anthropic.claude-instant-v1",
-            "Claude3Opus": "anthropic.claude-3-opus-20240229",
-            "Claude3Sonnet": "anthropic.claude-3-sonnet-20240229",
-            "Claude3Haiku": "anthropic.claude-3-haiku-20240307",
-        }
+    def get_client(service_name):
+        """
+        Creates a client of an AWS service with the shared session and configuration.
+        """
+        return ClientHandle(
+            lambda: Connections.session.client(
+                service_name, config=Connections.client_config
+            )
+        )
+
+    @staticmethod
+    def get_resource(service_name):
+        """
+        Creates a resource of an AWS service with the shared session and configuration.
+        """
+        return ClientHandle(
+            lambda: Connections.session.resource(
+                service_name, config=Connections.client_config
+            )
+        )
+
+    @staticmethod
+    def reset_clients():
+        """
+        Drops the session and every client, so that none is captured in a snapshot.
+        """
+        for handle in list(ClientHandle._handles):
+            handle.reset()
+
+    @staticmethod
+    def connect():
+        """
+        Creates the session, resolves its credentials and creates the shared
+        clients, unless they already exist.
+        """
+        Connections.session.get_credentials()
+        for client in (
+            Connections.s3_resource,
+            Connections.bedrock_client,
+            Connections.glue_client,
+        ):
+            # the benchmarks replace the clients with stand-ins
+            if isinstance(client, ClientHandle):
+                client.get()
+
+    @staticmethod
+    def use_prompt_cache(model_name):
+        """
+        Returns whether cache checkpoints are sent to a model: always with
+        PROMPT_CACHE=true, never with false, and with "auto" when the model
+        supports prompt caching.
+        """
+        if Connections.prompt_cache == "auto":
+            return model_name in Connections.PROMPT_CACHE_MODELS
+        return Connections.prompt_cache == "true"
+
+    @staticmethod
+    def prompt_cache_min_tokens(model_name):
+        """
+        Returns the minimum number of tokens of a cached prefix of a model,
+        1024 for models forced into caching with PROMPT_CACHE=true.
+        """
+        return Connections.PROMPT_CACHE_MIN_TOKENS.get(model_name, 1024)
+
+    @staticmethod
+    def get_bedrock_llm(
+        model_name="Claude3Haiku", max_tokens=256, converse=False, cache_boundaries=None
+    ):
+        if converse:
+            use_cache = Connections.use_prompt_cache(model_name)
+            return BedrockConverseLLM(
+                Connections.bedrock_client,
+                model=Connections.MODELID_MAPPING[model_name],
+                max_tokens=max_tokens,
+                temperature=0,
+                cache_boundaries=(cache_boundaries or []) if use_cache else [],
+                cache_min_tokens=Connections.prompt_cache_min_tokens(model_name),
+            )
 
         MODEL_KWARGS_MAPPING = {
             "Titan": {
@@ -53,17 +344,38 @@ def get_bedrock_llm(model_name="Claude3Haiku", max_tokens=256):
                 "max_tokens": max_tokens,
                 "temperature": 0,
             },
+            "Claude35Haiku": {
+                "max_tokens": max_tokens,
+                "temperature": 0,
+            },
+            "Claude37Sonnet": {
+                "max_tokens": max_tokens,
+                "temperature": 0,
+            },
         }
         model_kwargs = MODEL_KWARGS_MAPPING[model_name].copy()
         model_kwargs = MODEL_KWARGS_MAPPING[model_name].copy()
 
+        # share the tuned client, whose adaptive retries replace the LLM's own
         model_kwargs.update(
             {
-                "model": MODELID_MAPPING[model_name],
+                "model": Connections.MODELID_MAPPING[model_name],
                 "aws_region_name": Connections.region_name,
+                "client": Connections.bedrock_client,
+                "max_retries": 1,
             }
         )
 
+        # imported on use: the integration pulls in the Anthropic SDK, seconds
+        # of cold start that the default Converse API path does not need
+        try:
+            from llama_index.llms.bedrock import Bedrock
+        except ImportError as e:
+            raise ImportError(
+                "LLM_API=invoke requires llama-index-llms-bedrock, build the "
+                "image with LEAN=false"
+            ) from e
+
         llm = Bedrock(**model_kwargs)
 
         return llm
@@ -0,0 +1,180 @@
+"""
+converse_llm.py
+
+Bedrock Converse API LLM with prompt-cache checkpoints.
+
+The prompts start with a static, byte-stable prefix followed by blocks that
+change less and less often (see `prompt_templates`): the table schemas, then
+the few-shot examples, then the question. A `cachePoint` block is placed at
+the start of each configured boundary, e.g. before the few-shot examples, so
+Bedrock can reuse the processed text before it across requests. Bedrock only
+caches a checkpoint whose prefix has the minimum number of tokens of the model,
+so boundaries with a shorter prefix get no checkpoint. The cache read and write
+token counts are logged with every call.
+"""
+
+import json
+import logging
+from typing import Any, List
+
+from llama_index.core.base.llms.types import (
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.llms import CustomLLM
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+CONTEXT_WINDOW = 200000
+# Characters per token of the Claude tokenizer on the prompts, a low estimate
+# of their token count
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    """
+    Returns a low estimate of the number of tokens of a text.
+    """
+    return len(text) // CHARS_PER_TOKEN
+
+
+def prompt_content(prompt, cache_boundaries=None, min_tokens=0):
+    """
+    Splits a prompt into Converse content blocks with a cache checkpoint at
+    the start of each of its cache boundaries.
+
+    Args:
+        prompt (str): Formatted prompt.
+        cache_boundaries (list): Texts starting the blocks that follow a cached
+            prefix, in prompt order, e.g. the header of the few-shot examples.
+            The last occurrence of each boundary is used.
+        min_tokens (int): Minimum number of tokens of a cached prefix. A
+            boundary with a shorter prefix gets no checkpoint.
+
+    Returns:
+        content (list): Converse content blocks of the user message.
+    """
+    content, position = [], 0
+    for boundary in cache_boundaries or []:
+        index = prompt.rfind(boundary)
+        if index <= position or estimate_tokens(prompt[:index]) < min_tokens:
+            continue
+        content.extend([{"text": prompt[position:index]}, CACHE_POINT])
+        position = index
+    content.append({"text": prompt[position:]})
+    return content
+
+
+def cache_usage(usage):
+    """
+    Returns the token usage of a Converse response, including the prompt cache counts.
+
+    Args:
+        usage (dict): "usage" of a Converse response or stream metadata event.
+
+    Returns:
+        stats (dict): Input, output, cache read and cache write token counts.
+    """
+    return {
+        "input_tokens": usage.get("inputTokens"),
+        "output_tokens": usage.get("outputTokens"),
+        "cache_read_input_tokens": usage.get("cacheReadInputTokens", 0),
+        "cache_write_input_tokens": usage.get("cacheWriteInputTokens", 0),
+    }
+
+
+class BedrockConverseLLM(CustomLLM):
+    """
+    LLM calling the Bedrock Converse API, with cache checkpoints before prompt boundaries.
+
+    Args:
+        client (boto3.client): Bedrock runtime client.
+        model (str): Bedrock model id.
+        max_tokens (int): Maximum number of output tokens.
+        temperature (float): Sampling temperature.
+        cache_boundaries (list): Prompt texts preceded by a cache checkpoint,
+            see `prompt_content`.
+        cache_min_tokens (int): Minimum number of tokens of a cached prefix.
+    """
+
+    model: str = Field(description="Bedrock model id.")
+    max_tokens: int = Field(default=256, description="Maximum number of output tokens.")
+    temperature: float = Field(default=0.0, description="Sampling temperature.")
+    cache_boundaries: List[str] = Field(
+        default_factory=list,
+        description="Prompt texts preceded by a cache checkpoint.",
+    )
+    cache_min_tokens: int = Field(
+        default=0, description="Minimum number of tokens of a cached prefix."
+    )
+
+    _client: Any = PrivateAttr()
+
+    def __init__(self, client, **kwargs):
+        super().__init__(**kwargs)
+        self._client = client
+
+    @classmethod
+    def class_name(cls):
+        return "BedrockConverseLLM"
+
+    @property
+    def metadata(self):
+        return LLMMetadata(
+            context_window=CONTEXT_WINDOW,
+            num_output=self.max_tokens,
+            model_name=self.model,
+        )
+
+    def _request(self, prompt):
+        return {
+            "modelId": self.model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt_content(
+                        prompt, self.cache_boundaries, self.cache_min_tokens
+                    ),
+                }
+            ],
+            "inferenceConfig": {
+                "maxTokens": self.max_tokens,
+                "temperature": self.temperature,
+            },
+        }
+
+    def _log_usage(self, usage):
+        stats = {"model_id": self.model, **cache_usage(usage)}
+        logger.info(f"Converse usage: {json.dumps(stats)}")
+        return stats
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        response = self._client.converse(**self._request(prompt))
+        text = "".join(
+            block.get("text", "") for block in response["output"]["message"]["content"]
+        )
+        stats = self._log_usage(response.get("usage", {}))
+        return CompletionResponse(text=text, raw=response, additional_kwargs=stats)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs) -> CompletionResponseGen:
+        response = self._client.converse_stream(**self._request(prompt))
+
+        def gen():
+            text = ""
+            for event in response["stream"]:
+                if "contentBlockDelta" in event:
+                    delta = event["contentBlockDelta"]["delta"].get("text", "")
+                    text += delta
+                    yield CompletionResponse(text=text, delta=delta, raw=event)
+                elif "metadata" in event:
+                    self._log_usage(event["metadata"].get("usage", {}))
+
+        return gen()
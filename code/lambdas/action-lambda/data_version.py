@@ -0,0 +1,126 @@
+"""
+data_version.py
+
+Tracks the version of the data behind the Glue tables, so that caches of
+answers and query results can be invalidated when the data is refreshed.
+
+The version of a table combines its Glue `UpdateTime` with the keys and ETags
+of the S3 objects under its location, so both a re-crawl and new data files
+written under the same schema change it.
+
+Listing the objects of every table takes too long for the request path: the
+versions are computed synchronously once, then refreshed in a background thread
+when the check interval elapsed, while requests keep the last known versions.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class DataVersion:
+    """
+    Data version of every table of a Glue database, refreshed in the background at
+    most once per interval.
+
+    In Lambda, the background refresh only progresses while an invocation runs,
+    so a change is seen one or two requests after the interval elapsed.
+
+    Args:
+        glue_client (boto3.client): Glue client.
+        s3_resource (boto3.resource): S3 resource.
+        database (str): Glue database name.
+        check_interval (float): Minimum number of seconds between two checks.
+    """
+
+    def __init__(self, glue_client, s3_resource, database, check_interval=60):
+        self._glue_client = glue_client
+        self._s3_resource = s3_resource
+        self._database = database
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._refreshing = False
+        self._table_versions = {}
+
+    def _s3_fingerprint(self, location, digest):
+        bucket, _, prefix = location.removeprefix("s3://").partition("/")
+        for obj in self._s3_resource.Bucket(bucket).objects.filter(Prefix=prefix):
+            digest.update(f"{obj.key}:{obj.e_tag}".encode("utf-8"))
+
+    def _compute(self):
+        table_versions = {}
+        paginator = self._glue_client.get_paginator("get_tables")
+        for page in paginator.paginate(DatabaseName=self._database):
+            for table in page["TableList"]:
+                digest = hashlib.sha256(str(table.get("UpdateTime")).encode("utf-8"))
+                location = table.get("StorageDescriptor", {}).get("Location", "")
+                if location.startswith("s3://"):
+                    self._s3_fingerprint(location, digest)
+                table_versions[table["Name"]] = digest.hexdigest()[:16]
+        return table_versions
+
+    def _update(self):
+        table_versions = None
+        try:
+            table_versions = self._compute()
+        except (BotoCoreError, ClientError) as e:
+            # keep serving the last known version
+            logger.warning(f"Could not refresh the data version: {e}")
+        finally:
+            with self._lock:
+                if table_versions is not None:
+                    self._table_versions = table_versions
+                self._checked_at = time.monotonic()
+                self._refreshing = False
+
+    def refresh(self, force=False):
+        """
+        Returns the table versions, computing them the first time and starting a
+        background refresh if the check interval elapsed.
+
+        Args:
+            force (bool): Recompute synchronously, e.g. after a SnapStart restore.
+
+        Returns:
+            table_versions (dict): Mapping of table name to version.
+        """
+        with self._lock:
+            # cold start or forced: there is no version to serve meanwhile
+            background = not force and self._checked_at is not None
+            if background and (
+                self._refreshing
+                or time.monotonic() - self._checked_at < self._check_interval
+            ):
+                return self._table_versions
+            self._refreshing = True
+        if background:
+            threading.Thread(
+                target=self._update, name="data-version-refresh", daemon=True
+            ).start()
+        else:
+            self._update()
+        return self._table_versions
+
+    def table_version(self, table_name):
+        """
+        Returns the version of one table, or "unknown" if it is not in the catalog.
+        """
+        return self.refresh().get(table_name, "unknown")
+
+    def current(self):
+        """
+        Returns the version of the whole database.
+        """
+        table_versions = self.refresh()
+        digest = hashlib.sha256()
+        for name in sorted(table_versions):
+            digest.update(f"{name}:{table_versions[name]}".encode("utf-8"))
+        return digest.hexdigest()[:16]
@@ -0,0 +1,322 @@
+"""
+embedding_cache.py
+
+Tiered, content-addressed cache for text embeddings, plugged into llama_index
+embedding models through their `embeddings_cache` key-value store hook.
+
+Entries are keyed by a hash of (model id, text) and looked up in order in:
+    1. an in-process LRU,
+    2. a file store under /tmp that survives warm invocations, bounded in
+       bytes by dropping the oldest files,
+    3. an optional S3 prefix shared by all concurrent Lambda instances.
+A hit in a slower tier is promoted to the faster ones. /tmp is shared with the
+index snapshot, the local SQL tier and the other caches, so a file error is a
+miss rather than a failed request.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from botocore.exceptions import BotoCoreError, ClientError
+from llama_index.core.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def parse_s3_uri(s3_uri):
+    """
+    Splits an s3://bucket/prefix URI into bucket and prefix.
+
+    Args:
+        s3_uri (str): S3 URI.
+
+    Returns:
+        bucket (str): Bucket name.
+        prefix (str): Key prefix, with a trailing slash when not empty.
+    """
+    bucket, _, prefix = s3_uri.removeprefix("s3://").partition("/")
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    return bucket, prefix
+
+
+class TieredEmbeddingCache(BaseKVStore):
+    """
+    Embedding cache with an in-process LRU, a local file store and an optional S3 store.
+
+    Args:
+        model_name (str): Embedding model id, part of every cache key.
+        max_entries (int): Capacity of the in-process LRU.
+        cache_dir (str): Directory of the file store. None disables the tier.
+        max_file_bytes (int): Capacity of the file store in bytes.
+        s3_resource (boto3.resource): S3 resource used by the S3 tier.
+        s3_uri (str): s3://bucket/prefix of the shared store. None disables the tier.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        max_entries=4096,
+        cache_dir=None,
+        max_file_bytes=64 * 1024 * 1024,
+        s3_resource=None,
+        s3_uri=None,
+    ):
+        self._model_name = model_name
+        self._max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._cache_dir = cache_dir
+        self._max_file_bytes = max_file_bytes
+        # digest -> size of the files of the file store, oldest first
+        self._files = OrderedDict()
+        self._file_bytes = 0
+        self._s3_resource = s3_resource
+        self._s3_bucket, self._s3_prefix = (
+            parse_s3_uri(s3_uri) if s3_uri else (None, None)
+        )
+        self._stats = {
+            "lru_hits": 0,
+            "file_hits": 0,
+            "s3_hits": 0,
+            "misses": 0,
+            "s3_errors": 0,
+            "file_errors": 0,
+            "file_evictions": 0,
+        }
+        if cache_dir:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                self._scan_files()
+            except OSError as e:
+                logger.warning(f"Embedding file cache disabled: {e}")
+                self._cache_dir = None
+
+    @property
+    def stats(self):
+        """
+        Returns a copy of the hit/miss counters, including the overall hit rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["lru_hits"] + stats["file_hits"] + stats["s3_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _digest(self, text):
+        return hashlib.sha256(
+            f"{self._model_name}\0{text}".encode("utf-8")
+        ).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _lru_get(self, digest):
+        with self._lock:
+            vector = self._lru.get(digest)
+            if vector is not None:
+                self._lru.move_to_end(digest)
+            return vector
+
+    def _lru_put(self, digest, vector):
+        with self._lock:
+            self._lru[digest] = vector
+            self._lru.move_to_end(digest)
+            while len(self._lru) > self._max_entries:
+                self._lru.popitem(last=False)
+
+    def _file_path(self, digest):
+        return os.path.join(self._cache_dir, digest[:2], f"{digest}.bin")
+
+    def _scan_files(self):
+        # files left by earlier invocations of this environment, oldest first
+        files = []
+        for entry in os.scandir(self._cache_dir):
+            if not entry.is_dir():
+                continue
+            for file in os.scandir(entry.path):
+                if file.name.endswith(".bin"):
+                    stat = file.stat()
+                    files.append((stat.st_mtime, file.name[:-4], stat.st_size))
+        for _, digest, size in sorted(files):
+            self._files[digest] = size
+            self._file_bytes += size
+        self._evict_files()
+
+    def _evict_files(self):
+        # drops the oldest files past the capacity, called with the lock held
+        while self._files and self._file_bytes > self._max_file_bytes:
+            digest, size = self._files.popitem(last=False)
+            self._file_bytes -= size
+            self._stats["file_evictions"] += 1
+            try:
+                os.remove(self._file_path(digest))
+            except OSError:
+                pass
+
+    def _file_error(self, action, e):
+        self._count("file_errors")
+        logger.warning(f"Embedding cache file {action} failed: {e}")
+
+    def _file_get(self, digest):
+        if not self._cache_dir:
+            return None
+        try:
+            with open(self._file_path(digest), "rb") as f:
+                return np.frombuffer(f.read(), dtype=np.float32)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            # unreadable or torn file, dropped so that it is written again
+            self._file_error("read", e)
+            self._file_remove(digest)
+            return None
+
+    def _file_remove(self, digest):
+        with self._lock:
+            size = self._files.pop(digest, None)
+            if size is not None:
+                self._file_bytes -= size
+        try:
+            os.remove(self._file_path(digest))
+            return True
+        except OSError:
+            return False
+
+    def _file_put(self, digest, vector):
+        if not self._cache_dir:
+            return
+        path = self._file_path(digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        data = vector.tobytes()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # e.g. /tmp is full: the embedding stays in the other tiers
+            self._file_error("write", e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._file_bytes += len(data) - self._files.pop(digest, 0)
+            self._files[digest] = len(data)
+            self._evict_files()
+
+    def _s3_get(self, digest):
+        if not self._s3_bucket:
+            return None
+        try:
+            obj = self._s3_resource.Object(
+                self._s3_bucket, f"{self._s3_prefix}{digest}.bin"
+            )
+            return np.frombuffer(obj.get()["Body"].read(), dtype=np.float32)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                self._count("s3_errors")
+                logger.warning(f"Embedding cache S3 read failed: {e}")
+        except BotoCoreError as e:
+            self._count("s3_errors")
+            logger.warning(f"Embedding cache S3 read failed: {e}")
+        return None
+
+    def _s3_put(self, digest, vector):
+        if not self._s3_bucket:
+            return
+        try:
+            self._s3_resource.Object(
+                self._s3_bucket, f"{self._s3_prefix}{digest}.bin"
+            ).put(Body=vector.tobytes())
+        except (BotoCoreError, ClientError) as e:
+            self._count("s3_errors")
+            logger.warning(f"Embedding cache S3 write failed: {e}")
+
+    def get(self, key, collection=DEFAULT_COLLECTION):
+        """
+        Looks up the embedding of a text, promoting hits to the faster tiers.
+
+        Args:
+            key (str): Text that was embedded.
+            collection (str): Ignored, the model id namespaces the keys.
+
+        Returns:
+            val (dict): {digest: embedding} or None on a miss.
+        """
+        digest = self._digest(key)
+        vector = self._lru_get(digest)
+        if vector is not None:
+            self._count("lru_hits")
+            return {digest: vector.tolist()}
+
+        vector = self._file_get(digest)
+        if vector is not None:
+            self._count("file_hits")
+            self._lru_put(digest, vector)
+            return {digest: vector.tolist()}
+
+        vector = self._s3_get(digest)
+        if vector is not None:
+            self._count("s3_hits")
+            self._lru_put(digest, vector)
+            self._file_put(digest, vector)
+            return {digest: vector.tolist()}
+
+        self._count("misses")
+        return None
+
+    def put(self, key, val, collection=DEFAULT_COLLECTION):
+        """
+        Stores the embedding of a text in every tier.
+
+        Args:
+            key (str): Text that was embedded.
+            val (dict): Single entry dictionary holding the embedding.
+            collection (str): Ignored, the model id namespaces the keys.
+        """
+        digest = self._digest(key)
+        vector = np.asarray(next(iter(val.values())), dtype=np.float32)
+        self._lru_put(digest, vector)
+        self._file_put(digest, vector)
+        self._s3_put(digest, vector)
+
+    def get_all(self, collection=DEFAULT_COLLECTION):
+        """
+        Returns the entries of the in-process tier.
+        """
+        with self._lock:
+            return {digest: vector.tolist() for digest, vector in self._lru.items()}
+
+    def delete(self, key, collection=DEFAULT_COLLECTION):
+        """
+        Removes the embedding of a text from the local tiers.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            deleted = self._lru.pop(digest, None) is not None
+        if self._cache_dir and self._file_remove(digest):
+            deleted = True
+        return deleted
+
+    async def aput(self, key, val, collection=DEFAULT_COLLECTION):
+        self.put(key, val, collection)
+
+    async def aget(self, key, collection=DEFAULT_COLLECTION):
+        return self.get(key, collection)
+
+    async def aget_all(self, collection=DEFAULT_COLLECTION):
+        return self.get_all(collection)
+
+    async def adelete(self, key, collection=DEFAULT_COLLECTION):
+        return self.delete(key, collection)
@@ -0,0 +1,234 @@
+"""
+few_shot_bank.py
+
+Few-shot example bank reloaded from S3 while the Lambda is warm.
+
+The bank starts from the examples of the image, embedded in the index
+snapshot. When an S3 object is configured, its ETag is checked at most once
+per interval in a background thread, off the request path; when it changed,
+the object version is downloaded, only the questions without an embedding yet
+are embedded, and a new retriever replaces the current one at once. Requests
+keep using the previous retriever until then, and a failed reload keeps it.
+"""
+
+import csv
+import io
+import json
+import logging
+import threading
+import time
+
+import numpy as np
+from botocore.exceptions import BotoCoreError, ClientError
+
+from few_shot_retriever import (
+    FewShotRetriever,
+    normalize_rows,
+    pack_examples,
+    render_example,
+)
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+REQUIRED_COLUMNS = ("example_input_question", "example_output_query")
+
+
+def embedding_text(row):
+    """
+    Returns the text embedded for an example row, its JSON-quoted question.
+    """
+    return json.dumps(row["example_input_question"])
+
+
+def parse_examples(text):
+    """
+    Parses a fewshot examples csv document.
+
+    Args:
+        text (str): CSV with an `example_input_question` and an
+            `example_output_query` column.
+
+    Returns:
+        rows (list): List of dictionaries, one per example.
+
+    Raises:
+        ValueError: If a column is missing or there is no example.
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing fewshot example columns: {missing}")
+    rows = list(reader)
+    if not rows:
+        raise ValueError("The fewshot example bank is empty.")
+    return rows
+
+
+class FewShotBank:
+    """
+    Few-shot retriever swapped for a new one when the S3 example bank changes.
+
+    Args:
+        retriever (FewShotRetriever): Retriever over the examples of the image.
+        rows (list): Example rows of the image, in the order of the retriever.
+        vectors (np.ndarray): Row-normalized embeddings of these rows.
+        embed_texts (callable): Embeds a list of texts, e.g.
+            `embed_model.get_text_embedding_batch`.
+        s3_resource (boto3.resource): S3 resource.
+        bucket (str): Bucket of the example bank, None disables reloading.
+        key (str): Key of the example bank csv object.
+        check_interval (float): Minimum number of seconds between two ETag checks.
+        dtype (str): Storage type of the retriever matrix.
+        similarity_top_k (int): Number of examples to retrieve.
+        on_reload (callable): Called with the new example rows after a reload,
+            e.g. to seed the SQL template cache.
+    """
+
+    def __init__(
+        self,
+        retriever,
+        rows,
+        vectors,
+        embed_texts,
+        s3_resource=None,
+        bucket=None,
+        key=None,
+        check_interval=300,
+        dtype="float32",
+        similarity_top_k=2,
+        on_reload=None,
+    ):
+        self._retriever = retriever
+        self._rows = list(rows)
+        self._vectors = {
+            embedding_text(row): vector for row, vector in zip(rows, vectors)
+        }
+        self._embed_texts = embed_texts
+        self._s3_resource = s3_resource
+        self._bucket = bucket
+        self._key = key
+        self._check_interval = check_interval
+        self._dtype = dtype
+        self._similarity_top_k = similarity_top_k
+        self.on_reload = on_reload
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self.etag = None
+        self.version_id = None
+        self.stats = {"checks": 0, "reloads": 0, "embedded": 0, "reused": 0}
+
+    @property
+    def retriever(self):
+        return self._retriever
+
+    @property
+    def rows(self):
+        """
+        Example rows of the retriever in use.
+        """
+        return self._rows
+
+    @property
+    def version(self):
+        """
+        ETag of the S3 example bank in use, or "image" for the examples of the image.
+        """
+        return self.etag or "image"
+
+    def _build(self, rows):
+        texts = [embedding_text(row) for row in rows]
+        missing = list(dict.fromkeys(t for t in texts if t not in self._vectors))
+        if missing:
+            for text, vector in zip(missing, normalize_rows(self._embed_texts(missing))):
+                self._vectors[text] = vector
+        buffer, offsets = pack_examples([render_example(row) for row in rows])
+        retriever = FewShotRetriever(
+            np.stack([self._vectors[text] for text in texts]),
+            buffer,
+            offsets,
+            dtype=self._dtype,
+            similarity_top_k=self._similarity_top_k,
+        )
+        # drop the vectors of removed examples
+        self._vectors = {text: self._vectors[text] for text in texts}
+        return retriever, len(missing), len(set(texts)) - len(missing)
+
+    def refresh(self, force=False):
+        """
+        Reloads the example bank if its S3 ETag changed, at most once per interval,
+        in a background thread. Only one check runs at a time, requests keep the
+        current retriever meanwhile.
+
+        Args:
+            force (bool): Check now and wait for the reload, e.g. at cold start.
+
+        Returns:
+            reloaded (bool): True if a forced check put a new example bank in use.
+        """
+        if self._bucket is None:
+            return False
+        now = time.monotonic()
+        if (
+            not force
+            and self._checked_at is not None
+            and now - self._checked_at < self._check_interval
+        ):
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False
+        self._checked_at = now
+        if force:
+            return self._reload()
+        threading.Thread(target=self._reload, name="fewshot-reload", daemon=True).start()
+        return False
+
+    def _reload(self):
+        # called with the lock acquired, released when done
+        try:
+            self.stats["checks"] += 1
+            obj = self._s3_resource.Object(self._bucket, self._key)
+            if obj.e_tag == self.etag:
+                return False
+            etag, version_id = obj.e_tag, obj.version_id
+            # read the version whose ETag was checked, on a versioned bucket
+            kwargs = {}
+            if version_id and version_id != "null":
+                kwargs["VersionId"] = version_id
+            body = obj.get(**kwargs)["Body"].read().decode("utf-8-sig")
+            rows = parse_examples(body)
+            retriever, embedded, reused = self._build(rows)
+            # requests pick up the new retriever with their next retrieval
+            self._retriever, self._rows = retriever, rows
+        except (BotoCoreError, ClientError, ValueError) as e:
+            # keep serving the current examples
+            logger.warning(f"Could not reload the fewshot examples: {e}")
+            return False
+        else:
+            self.etag, self.version_id = etag, version_id
+            self.stats["reloads"] += 1
+            self.stats["embedded"] += embedded
+            self.stats["reused"] += reused
+        finally:
+            self._lock.release()
+
+        logger.info(
+            f"Reloaded {len(rows)} fewshot examples from s3://{self._bucket}/{self._key} "
+            f"(version {version_id}, ETag {etag}): {embedded} embedded, {reused} reused."
+        )
+        if self.on_reload is not None:
+            try:
+                self.on_reload(rows)
+            except Exception as e:
+                logger.warning(f"Could not apply the reloaded fewshot examples: {e}")
+        return True
+
+    def retrieve(self, query_embedding, top_k=None):
+        """
+        Retrieves the examples closest to a query embedding, see
+        `FewShotRetriever.retrieve`, and starts a background check of the
+        example bank when its interval elapsed.
+        """
+        self.refresh()
+        return self._retriever.retrieve(query_embedding, top_k)
@@ -0,0 +1,170 @@
+"""
+few_shot_retriever.py
+
+Array-backed retriever for the few-shot example bank.
+
+Example embeddings live in one contiguous, row-normalized matrix (float32, or
+quantized to float16 / int8) and the pre-rendered example strings in a single
+UTF-8 buffer indexed by an offsets array, so memory and retrieval latency stay
+flat per row as the example bank grows to tens of thousands of entries.
+"""
+
+import numpy as np
+
+# Rows scored per matrix product, bounds the temporary memory of a search
+CHUNK_ROWS = 8192
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+
+def render_example(row):
+    """
+    Renders a fewshot example as it is inserted into the SQL prompt.
+
+    Args:
+        row (dict): Example row, e.g. {"example_input_question": ..., "example_output_query": ...}.
+
+    Returns:
+        example (str): One "Key: value" line per column.
+    """
+    return "\n".join(f"{k.capitalize()}: {v}" for k, v in row.items())
+
+
+def normalize_rows(vectors):
+    """
+    Returns float32 vectors scaled to unit L2 norm, leaving zero rows untouched.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def pack_examples(examples):
+    """
+    Packs example strings into one UTF-8 buffer.
+
+    Args:
+        examples (list): Rendered example strings.
+
+    Returns:
+        buffer (np.ndarray): uint8 array with the concatenated examples.
+        offsets (np.ndarray): int64 array of len(examples) + 1 boundaries.
+    """
+    encoded = [example.encode("utf-8") for example in examples]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return buffer, offsets
+
+
+class FewShotRetriever:
+    """
+    Dot-product top-k retriever over pre-normalized example embeddings.
+
+    Args:
+        vectors (np.ndarray): (rows, dim) row-normalized float32 embeddings.
+        buffer (np.ndarray): uint8 buffer of the pre-rendered examples.
+        offsets (np.ndarray): int64 boundaries of each example in the buffer.
+        dtype (str): Storage type of the matrix, one of "float32", "float16", "int8".
+        similarity_top_k (int): Default number of examples to retrieve.
+    """
+
+    def __init__(self, vectors, buffer, offsets, dtype="float32", similarity_top_k=2):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(
+                f"Unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}"
+            )
+        self._scales = None
+        if dtype == "float32":
+            # keeps a memory-mapped matrix as is, without copying it
+            self._matrix = np.asarray(vectors, dtype=np.float32)
+        elif dtype == "float16":
+            self._matrix = np.asarray(vectors, dtype=np.float16)
+        else:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            scales = np.abs(vectors).max(axis=1, keepdims=True) / 127.0
+            scales[scales == 0] = 1.0
+            self._matrix = np.round(vectors / scales).astype(np.int8)
+            self._scales = scales.astype(np.float32)
+        self._buffer = buffer
+        self._offsets = offsets
+        self._similarity_top_k = similarity_top_k
+
+    @classmethod
+    def from_rows(cls, rows, vectors, **kwargs):
+        """
+        Creates a retriever from example rows and their (unnormalized) embeddings.
+        """
+        buffer, offsets = pack_examples([render_example(row) for row in rows])
+        return cls(normalize_rows(vectors), buffer, offsets, **kwargs)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def example(self, i):
+        """
+        Returns the pre-rendered example string of row i.
+        """
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._buffer[start:end].tobytes().decode("utf-8")
+
+    def search(self, query_vectors, top_k=None):
+        """
+        Scores a batch of queries against every example.
+
+        Args:
+            query_vectors (list): One embedding or a (queries, dim) batch of embeddings.
+            top_k (int): Number of examples per query. Defaults to similarity_top_k.
+
+        Returns:
+            indices (np.ndarray): (queries, k) row indices, best first.
+            scores (np.ndarray): (queries, k) cosine similarities.
+        """
+        queries = normalize_rows(query_vectors)
+        k = min(top_k or self._similarity_top_k, len(self))
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        if k == 0:
+            return best_idx, best_scores
+
+        for start in range(0, len(self), CHUNK_ROWS):
+            chunk = self._matrix[start : start + CHUNK_ROWS]
+            scores = chunk.astype(np.float32, copy=False) @ queries.T
+            if self._scales is not None:
+                scores *= self._scales[start : start + CHUNK_ROWS]
+            scores = scores.T
+            idx = np.broadcast_to(
+                np.arange(start, start + len(chunk), dtype=np.int64), scores.shape
+            )
+            cand_scores = np.concatenate([best_scores, scores], axis=1)
+            cand_idx = np.concatenate([best_idx, idx], axis=1)
+            if cand_scores.shape[1] > k:
+                top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+                cand_scores = np.take_along_axis(cand_scores, top, axis=1)
+                cand_idx = np.take_along_axis(cand_idx, top, axis=1)
+            best_scores, best_idx = cand_scores, cand_idx
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        return (
+            np.take_along_axis(best_idx, order, axis=1),
+            np.take_along_axis(best_scores, order, axis=1),
+        )
+
+    def retrieve(self, query_embedding, top_k=None):
+        """
+        Retrieves the pre-rendered examples closest to a query embedding.
+
+        Args:
+            query_embedding (list): Query embedding.
+            top_k (int): Number of examples. Defaults to similarity_top_k.
+
+        Returns:
+            examples (list): List of (example, score) tuples, best first.
+        """
+        indices, scores = self.search(query_embedding, top_k)
+        return [
+            (self.example(i), float(score)) for i, score in zip(indices[0], scores[0])
+        ]
@@ -3,47 +3,259 @@
 
 os.environ["NLTK_DATA"] = tempfile.gettempdir()
 
-from build_query_engine import query_engine
+from metrics import (
+    StageMetrics,
+    create_sink,
+    emit_init_metrics,
+    init_metrics,
+    request_metrics,
+    set_property,
+    stage,
+)
+import build_query_engine
+from build_query_engine import (
+    connect_engine,
+    disconnect_engine,
+    embedding_context,
+    get_question_bundle,
+    load_engine,
+    warm_up,
+)
+from connections import Connections
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import json
 import logging
 
+try:
+    from snapshot_restore_py import register_after_restore, register_before_snapshot
+except ImportError:  # only in the Lambda Python runtimes
+    register_after_restore = register_before_snapshot = None
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+metrics_sink = create_sink(Connections.metrics_sink, Connections.metrics_path)
+
+# Whether no request was answered yet by this execution environment
+cold_start = True
+
+# Threads answering the sub-questions of a /uc2 request, see `answer_questions`
+question_pool = None
+
+
+def before_snapshot():
+    """
+    Drops the AWS clients and connections before SnapStart takes the snapshot.
+    """
+    disconnect_engine()
+
+
+def after_restore():
+    """
+    Post-restore phase: creates the AWS clients with fresh credentials and
+    reloads the data that changed since the snapshot, timed as the "restore"
+    phases.
+    """
+    restore_metrics = StageMetrics("restore")
+    connect_engine(restore_metrics, restored=True)
+    emit_init_metrics(metrics_sink, restore_metrics)
+
+
+# Snapshot-safe phase: prompts, indexes and data
+load_engine()
+# SnapStart does not support container images: with the image of this stack,
+# only the on-demand and provisioned concurrency paths run
+if Connections.initialization_type == "snap-start" and register_after_restore:
+    register_before_snapshot(before_snapshot)
+    register_after_restore(after_restore)
+elif Connections.initialization_type in ("on-demand", "provisioned-concurrency"):
+    # a provisioned concurrency environment may wait long for its first
+    # invocation: the background data version refresh catches the changes
+    connect_engine()
+# else SnapStart without the restore hooks: the first invocation runs the
+# post-restore phase
+init_metrics.lap("handler")
+emit_init_metrics(metrics_sink)
+
 
 def log(message):
     logger.info(message)
 
 
+def answer_question(user_input):
+    """
+    Answers a quantitative question, from the semantic cache when a similar
+    question with the same entities was already answered on the current data.
+    The values it mentions are linked to their canonical form first.
+    """
+    user_input = build_query_engine.link_question(user_input)
+    answer_cache = build_query_engine.answer_cache
+    embedding = None
+    if answer_cache is not None:
+        embedding = get_question_bundle(user_input).embedding
+        current_version = build_query_engine.get_answer_version()
+        entities = build_query_engine.get_question_entities(user_input)
+        with stage("semantic_cache_lookup"):
+            cached = answer_cache.lookup(embedding, current_version, entities)
+        set_property("semantic_cache_hit", cached is not None)
+        if cached is not None:
+            log(f"Semantic cache stats: {json.dumps(answer_cache.stats)}")
+            return {"source": cached["sql"], "answer": cached["answer"]}
+
+    response = build_query_engine.query_engine.query(user_input)
+
+    log("Sql query:")
+    log(response.metadata["sql_query"].replace("\n", " "))
+    log(f"Provided response: {response.response}")
+    log(f"Response mode: {response.metadata.get('response_mode')}")
+    log(f"Embedding cache stats: {json.dumps(build_query_engine.embedding_cache.stats)}")
+
+    # only cache answers computed from a successful query
+    if answer_cache is not None and "result" in response.metadata:
+        answer_cache.store(
+            user_input,
+            embedding,
+            response.metadata["sql_query"],
+            response.response,
+            current_version,
+            entities,
+        )
+        log(f"Semantic cache stats: {json.dumps(answer_cache.stats)}")
+
+    return {
+        "source": response.metadata["sql_query"],
+        "answer": response.response,
+    }
+
+
+def get_questions(parameters):
+    """
+    Returns the questions of a /uc2 request: the `uc2Question` string, or the
+    `uc2Questions` sub-questions, a list or a JSON array string.
+
+    Args:
+        parameters (list): Parameters of the action group event.
+
+    Returns:
+        questions (list): The questions, or None if the parameters are not a
+            string or a list of strings.
+    """
+    values = {parameter.get("name"): parameter.get("value") for parameter in parameters}
+    if "uc2Questions" in values:
+        value = values["uc2Questions"]
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                value = [value]
+    elif parameters:
+        value = [parameters[0]["value"]]
+    else:
+        return None
+    # Only allow strings, to mitigate mixed prompt injection
+    if (
+        not isinstance(value, list)
+        or not value
+        or not all(isinstance(question, str) and question for question in value)
+    ):
+        return None
+    return value
+
+
+def answer_questions(questions, api_path):
+    """
+    Answers the questions of a request, each in its own request metrics and
+    embedding contexts. Several questions are answered concurrently on up to
+    UC2_MAX_PARALLEL threads, and a question that fails gets an error answer
+    without failing the others.
+
+    Returns:
+        outputs (list): The "source" and "answer" of each question.
+    """
+    global cold_start, question_pool
+
+    request_cold_start, cold_start = cold_start, False
+    properties = {"api_path": api_path, "cold_start": request_cold_start}
+    if len(questions) > 1:
+        properties["questions"] = len(questions)
+
+    def answer(question):
+        with embedding_context(), request_metrics(metrics_sink, **properties):
+            return answer_question(question)
+
+    if len(questions) == 1:
+        return [answer(questions[0])]
+
+    if question_pool is None:
+        question_pool = ThreadPoolExecutor(
+            max_workers=Connections.uc2_max_parallel, thread_name_prefix="uc2"
+        )
+    futures = [
+        question_pool.submit(contextvars.copy_context().run, answer, question)
+        for question in questions
+    ]
+    outputs = []
+    for question, future in zip(questions, futures):
+        try:
+            outputs.append(future.result())
+        except Exception:
+            logger.exception(f"Could not answer the question {question!r}")
+            outputs.append(
+                {"source": "Error", "answer": "This question could not be answered."}
+            )
+    return outputs
+
+
+def is_warmup_event(event):
+    """
+    Returns True for a synthetic warm-up event, {"warmup": true} with an
+    optional list of "questions".
+    """
+    return isinstance(event, dict) and event.get("warmup") is True
+
+
+def handle_warmup(event):
+    """
+    Primes the clients, connections and caches without calling the LLM, so
+    the next questions are answered by a warm engine.
+
+    Returns:
+        response (dict): The warm-up stages and their durations in milliseconds.
+    """
+    global cold_start
+
+    questions = event.get("questions") or Connections.warmup_questions
+    with request_metrics(metrics_sink, kind="warmup", cold_start=cold_start) as metrics:
+        cold_start = False
+        warm_up(questions)
+    return {"warmup": True, "questions": len(questions), "stages": metrics.stages}
+
+
 def get_response(event, context):
     """
     Get response RAG or Query
     """
-
     log("Logging event:")
     log(json.dumps(event))
+    if not build_query_engine.connected:
+        after_restore()
+    if is_warmup_event(event):
+        return handle_warmup(event)
     responses = []
 
     prediction = event
     response_code = 200
     api_path = prediction["apiPath"]
     parameters = prediction["parameters"]
-    user_input = parameters[0]["value"]
+    questions = get_questions(parameters)
+    outputs = None
 
-    # Only allow one str, to mitigate mixed prompt injection
-    if isinstance(user_input, str):
+    if questions is not None and len(questions) <= Connections.uc2_max_questions:
 
-        log(f"Question {user_input}")
+        log(f"Questions {questions}")
         if api_path == "/uc2":
-            response = query_engine.query(user_input)
-
-            log("Sql query:")
-            log(response.metadata["sql_query"].replace("\n", " "))
-            log(f"Provided response: {response.response}")
-            output = {
-                "source": response.metadata["sql_query"],
-                "answer": response.response,
-            }
+            outputs = answer_questions(questions, api_path)
 
         elif api_path == "/uc1":
             output = {
@@ -57,17 +269,40 @@ def get_response(event, context):
                 "answer": "I don't know enough to answer this question, please try to clarify you quesiton.",
             }
 
+    elif questions is not None:
+        output = {
+            "source": "Not Found",
+            "answer": f"Please ask at most {Connections.uc2_max_questions} questions at once.",
+        }
+
     else:
         output = {
             "source": "Not Found",
             "answer": "Please ask questions one by one.",
         }
 
-    body = f"""
+    if outputs is None:
+        body = f"""
+            Source: {output["source"]}
+            Returned information: {output["answer"]}
+
+            """
+    elif len(outputs) == 1:
+        body = f"""
+            Source: {outputs[0]["source"]}
+            Returned information: {outputs[0]["answer"]}
+
+            """
+    else:
+        body = "".join(
+            f"""
+            Question: {question}
             Source: {output["source"]}
             Returned information: {output["answer"]}
 
             """
+            for question, output in zip(questions, outputs)
+        )
     response_body = {"application/json": {"body": body}}  # output["answer"]#str(body)
 
     action_response = {
@@ -0,0 +1,180 @@
+"""
+index_snapshot.py
+
+Precomputed embeddings for the few-shot examples and the table schema nodes.
+
+The snapshot is a single binary file: a small JSON header describing each
+section (its records, matrix shape and dtype) followed by 64-byte aligned
+matrices. Loading maps the file into memory, so no embedding call is made
+at cold start while the snapshot fingerprint matches the current inputs.
+"""
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SNAPSHOT_MAGIC = b"T2SQLIDX"
+SNAPSHOT_VERSION = 2
+ALIGNMENT = 64
+
+
+def _aligned(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def compute_fingerprint(fewshot_examples_path, table_details, model_name):
+    """
+    Computes the fingerprint of the inputs a snapshot was built from.
+
+    Args:
+        fewshot_examples_path (str): Path to fewshot examples csv file.
+        table_details (dict): Mapping of table (or table node id) to the text embedded for it.
+        model_name (str): Embedding model id.
+
+    Returns:
+        fingerprint (str): Hex digest of the csv file, table texts and model id.
+    """
+    digest = hashlib.sha256()
+    with open(fewshot_examples_path, "rb") as csvfile:
+        digest.update(csvfile.read())
+    digest.update(json.dumps(table_details, sort_keys=True).encode("utf-8"))
+    digest.update(model_name.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_snapshot(path, fingerprint, sections, inputs=None):
+    """
+    Writes a snapshot file atomically.
+
+    Args:
+        path (str): Destination path.
+        fingerprint (str): Fingerprint of the inputs, see `compute_fingerprint`.
+        sections (dict): Mapping of section name to a (records, vectors) tuple,
+            where records is a list of JSON serializable objects and vectors either
+            the matching list of embeddings (stored as float32) or a 2D numpy array
+            of any fixed-size dtype.
+        inputs (dict): Fingerprints of the inputs of individual sections, used to
+            reuse them when the snapshot is rebuilt.
+
+    Returns:
+        None
+    """
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "fingerprint": fingerprint,
+        "inputs": inputs or {},
+        "sections": {},
+    }
+    matrices = []
+    offset = 0
+    for name, (records, vectors) in sections.items():
+        if isinstance(vectors, np.ndarray):
+            matrix = np.ascontiguousarray(vectors)
+        else:
+            matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(records), -1 if len(records) else 0)
+        header["sections"][name] = {
+            "records": records,
+            "shape": list(matrix.shape),
+            "dtype": matrix.dtype.str,
+            "offset": offset,
+        }
+        matrices.append((offset, matrix))
+        offset += _aligned(matrix.nbytes)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for matrix_offset, matrix in matrices:
+            f.seek(data_start + matrix_offset)
+            f.write(matrix.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote index snapshot to {path}")
+
+
+class IndexSnapshot:
+    """
+    Read-only view over a memory-mapped snapshot file.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not an index snapshot")
+        header_start = len(SNAPSHOT_MAGIC) + 8
+        (header_len,) = struct.unpack(
+            "<Q", self._mmap[len(SNAPSHOT_MAGIC) : header_start]
+        )
+        header = json.loads(self._mmap[header_start : header_start + header_len])
+        if header["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {header['version']}")
+        self.path = path
+        self.fingerprint = header["fingerprint"]
+        self.inputs = header.get("inputs", {})
+        self._sections = header["sections"]
+        self._data_start = _aligned(header_start + header_len)
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def records(self, name):
+        """
+        Returns the records stored in a section.
+        """
+        return self._sections[name]["records"]
+
+    def vectors(self, name):
+        """
+        Returns the matrix of a section as a read-only (rows, dim) array backed by
+        the memory map.
+        """
+        section = self._sections[name]
+        rows, dim = section["shape"]
+        return np.frombuffer(
+            self._mmap,
+            dtype=np.dtype(section["dtype"]),
+            count=rows * dim,
+            offset=self._data_start + section["offset"],
+        ).reshape(rows, dim)
+
+
+def load_snapshot(path, fingerprint=None):
+    """
+    Loads a snapshot if it exists and was built from the same inputs.
+
+    Args:
+        path (str): Snapshot path.
+        fingerprint (str): Expected fingerprint, see `compute_fingerprint`. None
+            loads the snapshot whatever its inputs.
+
+    Returns:
+        snapshot (IndexSnapshot): The snapshot, or None if it is missing, stale or unreadable.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = IndexSnapshot(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Ignoring unreadable index snapshot {path}: {e}")
+        return None
+    if fingerprint is not None and snapshot.fingerprint != fingerprint:
+        logger.info(f"Index snapshot {path} is stale, it will be rebuilt.")
+        return None
+    return snapshot
@@ -0,0 +1,390 @@
+"""
+local_sql.py
+
+In-process SQL execution tier for small tables.
+
+At cold start the tables of the Glue database whose S3 data is below a size
+threshold are downloaded from the same location the Glue crawler reads and
+loaded into an embedded DuckDB database. Generated Athena (Trino) SQL that only
+reads those tables is transpiled to DuckDB with sqlglot and runs locally in
+milliseconds; anything else, including SQL that fails the dialect check or that
+DuckDB cannot run, still goes to Athena.
+
+Trino divides integers as integers (`COUNT(*) / 2` is 2) where DuckDB returns a
+double, so the transpilation types the operands of each division and turns the
+integer ones into the DuckDB integer division; a division whose operand types
+are unknown goes to Athena. Dividing by zero still differs: Trino fails where
+DuckDB returns NULL or infinity.
+"""
+
+import logging
+import os
+import threading
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.annotate_types import annotate_types
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.schema import ensure_schema
+
+try:
+    import duckdb
+except ImportError:  # the local tier is optional
+    duckdb = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Glue column types and their DuckDB equivalents, anything else is read as text
+GLUE_TO_DUCKDB_TYPES = {
+    "string": "VARCHAR",
+    "varchar": "VARCHAR",
+    "char": "VARCHAR",
+    "double": "DOUBLE",
+    "float": "FLOAT",
+    "bigint": "BIGINT",
+    "int": "INTEGER",
+    "integer": "INTEGER",
+    "smallint": "SMALLINT",
+    "tinyint": "TINYINT",
+    "boolean": "BOOLEAN",
+    "date": "DATE",
+    "timestamp": "TIMESTAMP",
+}
+
+# DuckDB errors of statements Athena may still run: syntax or functions the
+# transpilation did not map, or the memory and disk of the Lambda
+UNSUPPORTED_ERRORS = (
+    (
+        duckdb.ParserException,
+        duckdb.CatalogException,
+        duckdb.BinderException,
+        duckdb.NotImplementedException,
+        duckdb.OutOfMemoryException,
+        duckdb.IOException,
+    )
+    if duckdb is not None
+    else ()
+)
+
+
+class LocalSQLUnsupportedError(Exception):
+    """
+    Raised when DuckDB cannot run a statement that Athena may run.
+    """
+
+
+class LocalSQLQueryError(Exception):
+    """
+    Raised when a statement fails on the data of the local tier, as it would
+    on Athena.
+    """
+
+
+def to_duckdb_type(glue_type):
+    """
+    Maps a Glue column type to a DuckDB type.
+    """
+    base_type = glue_type.split("(")[0].strip().lower()
+    if base_type == "decimal":
+        return glue_type.upper()
+    return GLUE_TO_DUCKDB_TYPES.get(base_type, "VARCHAR")
+
+
+def sql_literal(value):
+    """
+    Renders a string, boolean, list or dict as a DuckDB literal.
+    """
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(sql_literal(v) for v in value) + "]"
+    if isinstance(value, dict):
+        return (
+            "{"
+            + ", ".join(f"{sql_literal(k)}: {sql_literal(v)}" for k, v in value.items())
+            + "}"
+        )
+    raise TypeError(f"Unsupported literal: {value!r}")
+
+
+def _integer_divisions(tree, source_dialect, schema):
+    # types the operands of the divisions with Trino semantics, the statement
+    # is qualified for that, and turns the integer ones into DuckDB //, which
+    # truncates towards zero like Trino
+    if not any(div.args.get("typed") for div in tree.find_all(exp.Div)):
+        return tree
+    schema = ensure_schema(schema, dialect=source_dialect)
+    try:
+        tree = annotate_types(
+            qualify(tree, dialect=source_dialect, schema=schema), schema=schema
+        )
+    except SqlglotError as e:
+        raise ValueError(f"Cannot type the divisions for the local tier: {e}") from e
+    for div in list(tree.find_all(exp.Div)):
+        if not div.args.get("typed"):
+            continue
+        # window functions have the type of their function
+        types = [
+            (operand.this if isinstance(operand, exp.Window) else operand).type
+            for operand in (div.left, div.right)
+        ]
+        if any(t is None or t.is_type(exp.DataType.Type.UNKNOWN) for t in types):
+            raise ValueError(
+                f"Unknown operand types of {div.sql(dialect=source_dialect)}"
+            )
+        if all(t.is_type(*exp.DataType.INTEGER_TYPES) for t in types):
+            div.replace(exp.IntDiv(this=div.left, expression=div.right))
+        else:
+            div.set("typed", False)
+    return tree
+
+
+def transpile_to_duckdb(sql, source_dialect="athena", schema=None):
+    """
+    Transpiles a single Athena SELECT statement to DuckDB, dropping catalog and
+    database qualifiers from table names and keeping the integer division of
+    Trino.
+
+    Args:
+        sql (str): SQL statement.
+        source_dialect (str): sqlglot dialect of the statement.
+        schema (dict): DuckDB column types by column name by table name, used
+            to type the operands of divisions.
+
+    Returns:
+        duckdb_sql (str): Transpiled statement.
+        tables (set): Names of the tables the statement reads.
+
+    Raises:
+        ValueError: If the statement cannot be parsed, is not a single query or
+            divides operands of unknown types.
+    """
+    try:
+        statements = [
+            s for s in sqlglot.parse(sql, read=source_dialect) if s is not None
+        ]
+    except SqlglotError as e:
+        raise ValueError(f"Unsupported SQL for the local tier: {e}") from e
+    if len(statements) != 1 or not isinstance(statements[0], exp.Query):
+        raise ValueError("The local tier only runs single SELECT statements.")
+
+    tree = statements[0]
+    ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    tables = set()
+    for table in tree.find_all(exp.Table):
+        if table.name in ctes:
+            continue
+        tables.add(table.name)
+        table.set("db", None)
+        table.set("catalog", None)
+    tree = _integer_divisions(tree, source_dialect, schema)
+    return tree.sql(dialect="duckdb"), tables
+
+
+class LocalSQLEngine:
+    """
+    Embedded DuckDB copy of the small tables of a Glue database.
+
+    Args:
+        glue_client (boto3.client): Glue client.
+        s3_resource (boto3.resource): S3 resource.
+        database (str): Glue database name.
+        max_table_bytes (int): Tables with more S3 data than this stay on Athena.
+        download_dir (str): Local directory for the downloaded table files.
+    """
+
+    def __init__(self, glue_client, s3_resource, database, max_table_bytes, download_dir):
+        if duckdb is None:
+            raise ImportError("duckdb is required by the local SQL tier")
+        self._glue_client = glue_client
+        self._s3_resource = s3_resource
+        self._database = database
+        self._max_table_bytes = max_table_bytes
+        self._download_dir = download_dir
+        self._connection = duckdb.connect()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._table_versions = {}
+        self._table_columns = {}
+
+    @property
+    def tables(self):
+        """
+        Names of the tables loaded locally.
+        """
+        return set(self._table_versions)
+
+    @property
+    def schema(self):
+        """
+        DuckDB column types by column name of the tables loaded locally.
+        """
+        with self._lock:
+            return {
+                name: dict(columns) for name, columns in self._table_columns.items()
+            }
+
+    def _glue_tables(self):
+        paginator = self._glue_client.get_paginator("get_tables")
+        for page in paginator.paginate(DatabaseName=self._database):
+            yield from page["TableList"]
+
+    def _table_objects(self, location):
+        bucket, _, prefix = location.removeprefix("s3://").partition("/")
+        return [
+            obj
+            for obj in self._s3_resource.Bucket(bucket).objects.filter(Prefix=prefix)
+            if not obj.key.endswith("/") and obj.size > 0
+        ]
+
+    def _download(self, table_name, objects):
+        table_dir = os.path.join(self._download_dir, table_name)
+        os.makedirs(table_dir, exist_ok=True)
+        paths = []
+        for i, obj in enumerate(objects):
+            path = os.path.join(table_dir, f"{i}_{os.path.basename(obj.key)}")
+            self._s3_resource.Bucket(obj.bucket_name).download_file(obj.key, path)
+            paths.append(path)
+        return paths
+
+    def _load_table(self, table, version):
+        name = table["Name"]
+        storage = table.get("StorageDescriptor", {})
+        location = storage.get("Location", "")
+        if not location.startswith("s3://"):
+            return False
+
+        objects = self._table_objects(location)
+        size = sum(obj.size for obj in objects)
+        if not objects or size > self._max_table_bytes:
+            logger.info(f"Table {name} ({size} bytes) stays on Athena.")
+            return False
+
+        parameters = {**table.get("Parameters", {}), **storage.get("Parameters", {})}
+        serde_parameters = storage.get("SerdeInfo", {}).get("Parameters", {})
+        classification = parameters.get("classification", "csv").lower()
+        columns = {
+            column["Name"]: to_duckdb_type(column["Type"])
+            for column in storage.get("Columns", [])
+        }
+        paths = self._download(name, objects)
+
+        # arguments are inlined as literals: binding Python parameters makes
+        # DuckDB import pandas, which costs more cold start than the load itself
+        if classification == "parquet":
+            select_list = ", ".join(f'"{c}"' for c in columns) or "*"
+            source = f"SELECT {select_list} FROM read_parquet({sql_literal(paths)})"
+        elif classification == "csv":
+            header = int(parameters.get("skip.header.line.count", "0")) > 0
+            delimiter = serde_parameters.get(
+                "field.delim", serde_parameters.get("separatorChar", ",")
+            )
+            source = (
+                f"SELECT * FROM read_csv({sql_literal(paths)}, "
+                f"header = {sql_literal(header)}, delim = {sql_literal(delimiter)}, "
+                f"columns = {sql_literal(columns)})"
+            )
+        else:
+            logger.info(f"Table {name} ({classification}) stays on Athena.")
+            return False
+
+        with self._lock:
+            self._connection.execute(f'CREATE OR REPLACE TABLE "{name}" AS {source}')
+            self._table_versions[name] = version
+            self._table_columns[name] = columns
+        logger.info(f"Loaded table {name} ({size} bytes) into the local SQL tier.")
+        return True
+
+    def load(self, data_version=None):
+        """
+        Loads every small table of the database, or reloads the tables whose
+        data version changed since they were loaded.
+
+        Args:
+            data_version (DataVersion): Data version of the tables.
+        """
+        for table in self._glue_tables():
+            name = table["Name"]
+            version = data_version.table_version(name) if data_version else None
+            if name in self._table_versions and self._table_versions[name] == version:
+                continue
+            try:
+                self._load_table(table, version)
+            except Exception as e:
+                logger.warning(f"Could not load table {name} locally: {e}")
+                with self._lock:
+                    self._table_versions.pop(name, None)
+                    self._table_columns.pop(name, None)
+                    self._connection.execute(f'DROP TABLE IF EXISTS "{name}"')
+
+    def reload(self, data_version):
+        """
+        Reloads the tables whose data version changed in a background thread,
+        unless a reload is already running. Queries keep running on the loaded
+        tables meanwhile, and each table is replaced at once.
+
+        Args:
+            data_version (DataVersion): Data version of the tables.
+
+        Returns:
+            started (bool): True if a reload was started.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self.load(data_version)
+            except Exception as e:
+                logger.warning(f"Could not reload the local SQL tier: {e}")
+            finally:
+                self._reload_lock.release()
+
+        threading.Thread(target=run, name="local-sql-reload", daemon=True).start()
+        return True
+
+    def is_stale(self, tables, data_version):
+        """
+        Returns True if any of the tables changed since it was loaded.
+        """
+        return any(
+            self._table_versions.get(table) != data_version.table_version(table)
+            for table in tables
+        )
+
+    def run_sql(self, duckdb_sql, fetch=None):
+        """
+        Runs a DuckDB statement.
+
+        Args:
+            duckdb_sql (str): Statement, see `transpile_to_duckdb`.
+            fetch (callable): Reads the result from the `fetchmany` of the
+                cursor and the column names, and returns what `run_sql` returns.
+                Defaults to fetching all rows.
+
+        Returns:
+            rows (list): List of result tuples.
+            col_keys (list): Column names.
+
+        Raises:
+            LocalSQLUnsupportedError: If DuckDB cannot run the statement.
+            LocalSQLQueryError: If the statement fails on the data.
+        """
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(duckdb_sql)
+            col_keys = [column[0] for column in cursor.description]
+            if fetch is not None:
+                return fetch(cursor.fetchmany, col_keys)
+            return cursor.fetchall(), col_keys
+        except UNSUPPORTED_ERRORS as e:
+            raise LocalSQLUnsupportedError(str(e)) from e
+        except duckdb.Error as e:
+            raise LocalSQLQueryError(str(e)) from e
+        finally:
+            cursor.close()
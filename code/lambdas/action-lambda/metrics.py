@@ -0,0 +1,266 @@
+"""
+metrics.py
+
+Per-stage latency metrics of the action lambda.
+
+Every request runs in a `request_metrics` context; the stages timed with
+`stage` or recorded with `record` while it is active (question embedding,
+few-shot and table retrieval, prompt rendering, SQL generation, Athena queue
+and execution, result fetch, response synthesis) are emitted at the end of the
+request as one CloudWatch Embedded Metric Format (EMF) document, and logged as
+one `Request summary` line. The cold start phases are recorded separately in
+`init_metrics` and emitted once.
+
+EMF documents are printed to stdout, where CloudWatch Logs extracts the
+metrics, or appended as JSON lines to a local file with `FileSink`.
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+METRICS_NAMESPACE = "GenAIChatbot/ActionLambda"
+
+# Metrics of the request being answered, see `request_metrics`
+current_metrics = ContextVar("current_metrics", default=None)
+
+
+class StageMetrics:
+    """
+    Durations in milliseconds of named stages, counts of events, and properties
+    describing them.
+
+    Args:
+        kind (str): "request", "warmup", "cold_start" or "restore", the
+            dimension of the metrics.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.stages = {}
+        self.counts = {}
+        self.properties = {}
+        self._started = time.perf_counter()
+        self._last_lap = self._started
+
+    def record(self, name, duration_ms):
+        """
+        Adds a duration to a stage. A stage recorded several times is summed.
+        """
+        if duration_ms is None:
+            return
+        self.stages[name] = round(self.stages.get(name, 0) + duration_ms, 1)
+
+    def count(self, name, value=1):
+        """
+        Adds to the count of an event.
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block as a stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def lap(self, name):
+        """
+        Records the time since the previous lap, or since creation, as a stage.
+        """
+        now = time.perf_counter()
+        self.record(name, (now - self._last_lap) * 1000)
+        self._last_lap = now
+
+    def elapsed_ms(self):
+        """
+        Returns the milliseconds since creation.
+        """
+        return round((time.perf_counter() - self._started) * 1000, 1)
+
+    def to_emf(self, namespace=METRICS_NAMESPACE):
+        """
+        Returns the stages as an EMF document, one millisecond metric per stage
+        plus "total" and one count metric per event, with the properties as
+        extra fields.
+        """
+        values = {f"{name}_ms": value for name, value in self.stages.items()}
+        values["total_ms"] = self.elapsed_ms()
+        units = {name: "Milliseconds" for name in values}
+        values.update(self.counts)
+        units.update({name: "Count" for name in self.counts})
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [["kind"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit} for name, unit in units.items()
+                        ],
+                    }
+                ],
+            },
+            "kind": self.kind,
+            **self.properties,
+            **values,
+        }
+
+
+class EMFSink:
+    """
+    Prints EMF documents to stdout, where CloudWatch Logs extracts the metrics.
+    """
+
+    def __init__(self, namespace=METRICS_NAMESPACE):
+        self.namespace = namespace
+
+    def emit(self, metrics):
+        print(json.dumps(metrics.to_emf(self.namespace), default=str), flush=True)
+
+
+class FileSink:
+    """
+    Appends EMF documents as JSON lines to a local file.
+    """
+
+    def __init__(self, path, namespace=METRICS_NAMESPACE):
+        self.path = path
+        self.namespace = namespace
+
+    def emit(self, metrics):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(metrics.to_emf(self.namespace), default=str) + "\n")
+
+
+def create_sink(name, path=None, namespace=METRICS_NAMESPACE):
+    """
+    Creates the metrics sink set in METRICS_SINK.
+
+    Args:
+        name (str): "emf", "file" or "none".
+        path (str): JSON lines file of the "file" sink.
+        namespace (str): CloudWatch namespace of the metrics.
+
+    Returns:
+        sink (EMFSink): The sink, or None if metrics are disabled.
+    """
+    if name == "none":
+        return None
+    elif name == "emf":
+        return EMFSink(namespace)
+    elif name == "file":
+        return FileSink(path, namespace)
+    raise ValueError(f"Unknown metrics sink: {name}")
+
+
+def record(name, duration_ms):
+    """
+    Adds a duration to a stage of the current request, if any.
+    """
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.record(name, duration_ms)
+
+
+def count(name, value=1):
+    """
+    Adds to the count of an event of the current request, if any.
+    """
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def set_property(name, value):
+    """
+    Sets a property of the current request, if any.
+    """
+    metrics = current_metrics.get()
+    if metrics is not None:
+        metrics.properties[name] = value
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block as a stage of the current request, if any.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+@contextmanager
+def request_metrics(sink, kind="request", **properties):
+    """
+    Collects the stage metrics of a request, then emits them and logs the
+    request summary.
+
+    Args:
+        sink (EMFSink): Metrics sink, None only logs the summary.
+        kind (str): Dimension of the metrics, "request" or "warmup".
+        **properties: Properties of the request, such as the API path.
+
+    Yields:
+        metrics (StageMetrics): Metrics of the request.
+    """
+    metrics = StageMetrics(kind)
+    metrics.properties.update(properties)
+    token = current_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        current_metrics.reset(token)
+        summary = {
+            **metrics.properties,
+            **metrics.counts,
+            **metrics.stages,
+            "total": metrics.elapsed_ms(),
+        }
+        logger.info(f"Request summary: {json.dumps(summary, default=str)}")
+        if sink is not None:
+            try:
+                sink.emit(metrics)
+            except OSError as e:
+                logger.warning(f"Could not emit the request metrics: {e}")
+
+
+def emit_init_metrics(sink, metrics=None):
+    """
+    Logs the cold start summary and emits the cold start phases.
+
+    Args:
+        sink (EMFSink): Metrics sink, None only logs the summary.
+        metrics (StageMetrics): Phases to emit, the "restore" phases after a
+            SnapStart restore. Defaults to init_metrics.
+    """
+    metrics = metrics or init_metrics
+    title = "Restore summary" if metrics.kind == "restore" else "Cold start summary"
+    summary = {**metrics.stages, "total": metrics.elapsed_ms()}
+    logger.info(f"{title}: {json.dumps(summary)}")
+    if sink is not None:
+        try:
+            sink.emit(metrics)
+        except OSError as e:
+            logger.warning(f"Could not emit the {metrics.kind} metrics: {e}")
+
+
+# Cold start phases, timed from the import of this module
+init_metrics = StageMetrics("cold_start")
@@ -0,0 +1,181 @@
+"""
+model_cascade.py
+
+Model cascade for the SQL generation.
+
+The SQL is first generated by the cheapest and fastest model of the cascade,
+and only generated again by the next, stronger model when the statement fails
+to parse, reads tables or columns missing from the schema, fails on execution
+or returns fewer rows than `min_rows`. The prompt is rendered once for all the
+models. The escalation reasons that trigger a retry are configurable, and the
+escalation rate is kept in `CascadeStats`.
+"""
+
+import json
+import logging
+import threading
+
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+from metrics import count, set_property
+from sql_guard import SQLGuardError, check_schema, parse_query
+from streaming_sql import StreamingNLSQLRetriever
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ESCALATION_REASONS = ("parse", "schema", "execution", "empty")
+
+
+class CascadeStats:
+    """
+    Thread-safe counters of the questions answered by each model and of the
+    escalations by reason.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.questions = 0
+        self.escalated = 0
+        self.answered_by = {}
+        self.reasons = {}
+
+    def record(self, model_name, escalations):
+        """
+        Records the model that answered a question and the escalations before it.
+        """
+        with self._lock:
+            self.questions += 1
+            self.escalated += 1 if escalations else 0
+            self.answered_by[model_name] = self.answered_by.get(model_name, 0) + 1
+            for escalation in escalations:
+                reason = escalation["reason"]
+                self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    @property
+    def escalation_rate(self):
+        """
+        Fraction of the questions escalated at least once.
+        """
+        return self.escalated / self.questions if self.questions else 0.0
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "questions": self.questions,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalation_rate, 4),
+                "answered_by": dict(self.answered_by),
+                "reasons": dict(self.reasons),
+            }
+
+
+class CascadeNLSQLRetriever(StreamingNLSQLRetriever):
+    """
+    StreamingNLSQLRetriever trying the SQL generators of a model cascade in order.
+
+    Args:
+        sql_database (TextToSQLDatabase): SQL database.
+        sql_generators (list): (model name, StreamingSQLGenerator) pairs, from the
+            cheapest model to the strongest.
+        escalate_on (list): Escalation reasons, among ESCALATION_REASONS, that
+            trigger a retry with the next model.
+        min_rows (int): Smallest number of result rows that is not escalated
+            as "empty".
+        stats (CascadeStats): Counters shared by the query engines.
+        **kwargs: Arguments of NLSQLRetriever.
+    """
+
+    def __init__(
+        self,
+        sql_database,
+        sql_generators,
+        escalate_on=ESCALATION_REASONS,
+        min_rows=1,
+        stats=None,
+        **kwargs,
+    ):
+        unknown = set(escalate_on) - set(ESCALATION_REASONS)
+        if unknown:
+            raise ValueError(f"Unknown escalation reasons: {sorted(unknown)}")
+        super().__init__(sql_database, sql_generators[0][1], **kwargs)
+        self._sql_generators = sql_generators
+        self._escalate_on = set(escalate_on)
+        self._min_rows = min_rows
+        self._stats = stats or CascadeStats()
+
+    @property
+    def stats(self):
+        return self._stats
+
+    def _validate_sql(self, sql_query_str):
+        # escalation reason of a statement that should not be executed, if any
+        try:
+            tree = parse_query(sql_query_str)
+        except SQLGuardError as e:
+            return "parse", e
+        if hasattr(self._sql_database, "column_names"):
+            try:
+                check_schema(tree, self._sql_database.column_names)
+            except SQLGuardError as e:
+                return "schema", e
+        return None, None
+
+    def _attempt(self, query_bundle, prompt, sql_generator, escalate):
+        sql_query_str, generation_metadata = self._generate_sql(
+            query_bundle, prompt, sql_generator
+        )
+        reason, error = self._validate_sql(sql_query_str)
+        if self._sql_only or (escalate and reason in self._escalate_on):
+            return sql_query_str, generation_metadata, reason, error, None
+
+        try:
+            result = self._sql_retriever.retrieve_with_metadata(sql_query_str)
+        except Exception as e:
+            return sql_query_str, generation_metadata, "execution", e, None
+        if len(result[1].get("result") or []) < self._min_rows:
+            return sql_query_str, generation_metadata, "empty", None, result
+        return sql_query_str, generation_metadata, None, None, result
+
+    def retrieve_with_metadata(self, str_or_query_bundle):
+        """Retrieve with metadata, escalating along the model cascade."""
+        if isinstance(str_or_query_bundle, str):
+            query_bundle = QueryBundle(str_or_query_bundle)
+        else:
+            query_bundle = str_or_query_bundle
+        table_desc_str = self._get_table_context(query_bundle)
+        logger.info(f"> Table desc str: {table_desc_str}")
+        prompt = self._render_prompt(query_bundle, table_desc_str)
+
+        escalations = []
+        for tier, (model_name, sql_generator) in enumerate(self._sql_generators):
+            escalate = tier < len(self._sql_generators) - 1
+            sql_query_str, generation_metadata, reason, error, result = self._attempt(
+                query_bundle, prompt, sql_generator, escalate
+            )
+            if not escalate or reason not in self._escalate_on:
+                break
+            logger.info(f"Escalating the SQL generation from {model_name} ({reason}): {error}")
+            escalations.append({"model": model_name, "reason": reason, "sql": sql_query_str})
+
+        self._stats.record(model_name, escalations)
+        logger.info(f"Model cascade stats: {json.dumps(self._stats.as_dict())}")
+        set_property("sql_model", model_name)
+        count("sql_escalations", len(escalations))
+        count("sql_escalated", 1 if escalations else 0)
+
+        if self._sql_only:
+            retrieved_nodes = [NodeWithScore(node=TextNode(text=sql_query_str))]
+            metadata = {"result": sql_query_str}
+        elif result is not None:
+            retrieved_nodes, metadata = result
+        else:
+            retrieved_nodes, metadata = self._error_result(error)
+
+        return retrieved_nodes, {
+            "sql_query": sql_query_str,
+            **generation_metadata,
+            "cascade": {"model": model_name, "escalations": escalations},
+            **metadata,
+        }
@@ -3,8 +3,11 @@
     "ec2_pricing": "Information about EC2 instance pricing and other details.",
 }
 
-# prompts for pricing details retrieval
-SQL_TEMPLATE_STR = """Given an input question, first create a syntactically correct {dialect} query to run, then look at the results of the query and return the answer.
+# Static prefixes of the prompts. They contain no template variable, so the
+# formatted prompts start with the same bytes on every call and the Converse
+# API can cache them, with the blocks that follow, behind a cache checkpoint
+# (see `converse_llm`). Keep any per-request content out of them.
+SQL_LINKED_STATIC_PREFIX = """Given an input question, first create a syntactically correct SQL query to run, then look at the results of the query and return the answer.
     You can order the results by a relevant column to return the most interesting examples in the database.\n\n
     Never query for all the columns from a specific table, only ask for a few relevant columns given the question.\n\n
     Pay attention to use only the column names that you can see in the schema description. Be careful to not query for columns that do not exist.
@@ -18,9 +21,16 @@
     trn*: "accelerated computing instances specifically optimized for cost-effective machine learning training tasks, providing a balance of compute, memory, and networking."
 
     You are required to use the following format, each taking one line:\n\nQuestion: Question here\nSQLQuery: SQL Query to run\n
-    SQLResult: Result of the SQLQuery\nAnswer: Final answer here\n\nOnly use tables listed below.\n{schema}\n\n
+    SQLResult: Result of the SQLQuery\nAnswer: Final answer here\n\n
     Do not under any circumstance use SELECT * in your query.
+"""
 
+# Instance name normalization taught to the model. With value linking (see
+# `value_linker`) the question already holds the canonical instance names, and
+# the prompts start with SQL_LINKED_STATIC_PREFIX alone.
+SQL_STATIC_PREFIX = (
+    SQL_LINKED_STATIC_PREFIX
+    + """
     You must convert any mentioned instance names to the format INSTANCE_FAMILY.INSTANCE_SIZE. A few examples:
 
     Query: "how much is p3.8xlarge per hour?"
@@ -31,20 +41,41 @@
 
     Query: "Compare the price per hour of c5.4xlarge and trn1n.32xlarge."
     Response: "SELECT instance_name, on_demand_hourly_price \nFROM ec2_pricing\nWHERE instance_name IN ('c5.4xlarge', 'trn1n.32xlarge')\nORDER BY on_demand_hourly_price ASC;"
+"""
+)
+
+RESPONSE_STATIC_PREFIX = """If the <SQL Response> below contains data, then given an input question, synthesize a response from the query results.
+    If the <SQL Response> is empty, then you should not synthesize a response and instead respond that no data was found for the quesiton..\n
+    Do not make any mention of queries or databases in your response, instead you can say 'according to the latest information' .\n\n
+    Please make sure to mention any additional details from the context supporting your response.
+    If the final answer contains <dollar_sign>$</dollar_sign>, ADD '\' ahead of each <dollar_sign>$</dollar_sign>.
+"""
 
+# Starts of the blocks of the SQL prompt that change with each request. The text
+# before the few-shot examples only changes with the retrieved tables, and the
+# text before the question with the retrieved examples, so the prompt cache
+# checkpoints go right before them (see `converse_llm`). The static prefix
+# alone is shorter than the minimum cacheable prefix of the models.
+SQL_EXAMPLES_BOUNDARY = "\n    Here are some other useful examples:"
+SQL_QUESTION_BOUNDARY = "\n\n    Question: "
+SQL_CACHE_BOUNDARIES = [SQL_EXAMPLES_BOUNDARY, SQL_QUESTION_BOUNDARY]
+
+SQL_TEMPLATE_SUFFIX = """
+    The query must be valid {dialect} SQL. Only use tables listed below.\n{schema}\n\n
     Here are some other useful examples:
     {few_shot_examples}
 
     Question: {query_str}\nSQLQuery: """
 
-# prompt for summarize pricing details retrieval
-RESPONSE_TEMPLATE_STR = """If the <SQL Response> below contains data, then given an input question, synthesize a response from the query results.
-    If the <SQL Response> is empty, then you should not synthesize a response and instead respond that no data was found for the quesiton..\n
+# prompts for pricing details retrieval
+SQL_TEMPLATE_STR = SQL_STATIC_PREFIX + SQL_TEMPLATE_SUFFIX
+SQL_LINKED_TEMPLATE_STR = SQL_LINKED_STATIC_PREFIX + SQL_TEMPLATE_SUFFIX
 
+# prompt for summarize pricing details retrieval
+RESPONSE_TEMPLATE_STR = (
+    RESPONSE_STATIC_PREFIX
+    + """
     \nQuery: {query_str}\nSQL: {sql_query}\n<SQL Response>: {context_str}\n</SQL Response>\n
 
-    Do not make any mention of queries or databases in your response, instead you can say 'according to the latest information' .\n\n
-    Please make sure to mention any additional details from the context supporting your response.
-    If the final answer contains <dollar_sign>$</dollar_sign>, ADD '\' ahead of each <dollar_sign>$</dollar_sign>.
-
     Response: """
+)
@@ -0,0 +1,205 @@
+"""
+result_summary.py
+
+Bounded fetching of SQL results.
+
+The rows of a query are read in batches. While they fit in a row and character
+cap they are returned as they are; past the cap only the first rows are kept,
+and the remaining batches only update per-column statistics (counts, min, max,
+mean), so memory and the prompt stay bounded whatever SQL the model wrote. The
+summary of a truncated result replaces its rows in the response prompt.
+"""
+
+import logging
+from decimal import Decimal
+
+import numpy as np
+import sqlglot
+from sqlglot.errors import SqlglotError
+
+from sql_cache import SQL_DIALECT
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Distinct values counted per text column, past which the count is a lower bound
+MAX_DISTINCT_VALUES = 1000
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _format_number(value):
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+def order_by_columns(sql):
+    """
+    Returns the ORDER BY expressions of a query, e.g. ["on_demand_hourly_price DESC"],
+    or an empty list if it has none or does not parse.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read=SQL_DIALECT)
+    except SqlglotError:
+        return []
+    order = tree.args.get("order") if tree is not None else None
+    if order is None:
+        return []
+    return [expression.sql(dialect=SQL_DIALECT) for expression in order.expressions]
+
+
+class ResultSummary:
+    """
+    Per-column statistics of a result, updated one batch of rows at a time.
+
+    Args:
+        col_keys (list): Column names.
+    """
+
+    def __init__(self, col_keys):
+        self.col_keys = list(col_keys)
+        self.row_count = 0
+        self._counts = [0] * len(self.col_keys)
+        self._numeric = [True] * len(self.col_keys)
+        self._min = [None] * len(self.col_keys)
+        self._max = [None] * len(self.col_keys)
+        self._sum = [0.0] * len(self.col_keys)
+        self._distinct = [set() for _ in self.col_keys]
+
+    def add(self, rows):
+        """
+        Updates the statistics with a batch of rows.
+        """
+        self.row_count += len(rows)
+        for i, column in enumerate(zip(*rows)):
+            values = [value for value in column if value is not None]
+            self._counts[i] += len(values)
+            if self._numeric[i] and all(_is_number(value) for value in values):
+                if values:
+                    array = np.asarray(values, dtype=np.float64)
+                    low, high = array.min(), array.max()
+                    if self._min[i] is not None:
+                        low, high = min(self._min[i], low), max(self._max[i], high)
+                    self._min[i], self._max[i] = low, high
+                    self._sum[i] += array.sum()
+                continue
+            self._numeric[i] = False
+            distinct = self._distinct[i]
+            for value in values:
+                if len(distinct) >= MAX_DISTINCT_VALUES:
+                    break
+                distinct.add(str(value))
+
+    def to_dict(self):
+        """
+        Returns the statistics, with "row_count" and the "columns" statistics.
+        """
+        columns = {}
+        for i, name in enumerate(self.col_keys):
+            stats = {"count": self._counts[i]}
+            if self._numeric[i] and self._counts[i]:
+                stats.update(
+                    min=float(self._min[i]),
+                    max=float(self._max[i]),
+                    mean=float(self._sum[i] / self._counts[i]),
+                )
+            elif not self._numeric[i]:
+                stats["distinct"] = len(self._distinct[i])
+            columns[name] = stats
+        return {"row_count": self.row_count, "columns": columns}
+
+    def render(self, top_rows, order_by=None):
+        """
+        Renders the summary of a truncated result for the response prompt.
+
+        Args:
+            top_rows (list): First rows of the result.
+            order_by (list): ORDER BY expressions of the query.
+
+        Returns:
+            summary_str (str): Summary text.
+        """
+        column_strs = []
+        for name, stats in self.to_dict()["columns"].items():
+            if "mean" in stats:
+                column_strs.append(
+                    f"{name}: min {_format_number(stats['min'])}, "
+                    f"max {_format_number(stats['max'])}, "
+                    f"mean {_format_number(stats['mean'])}"
+                )
+            elif "distinct" in stats:
+                more = "+" if stats["distinct"] >= MAX_DISTINCT_VALUES else ""
+                column_strs.append(
+                    f"{name}: {stats['count']} values, {stats['distinct']}{more} distinct"
+                )
+            else:
+                column_strs.append(f"{name}: {stats['count']} values")
+        ordering = (
+            f"ordered by {', '.join(order_by)}" if order_by else "in no particular order"
+        )
+        return (
+            f"The result has {self.row_count} rows, too many to list. "
+            f"Statistics of all rows: {'; '.join(column_strs)}.\n"
+            f"The first {len(top_rows)} rows, {ordering}: {top_rows}"
+        )
+
+
+def fetch_bounded(
+    fetchmany,
+    col_keys,
+    row_fn=tuple,
+    max_rows=100,
+    max_chars=20000,
+    top_rows=10,
+    batch_size=100,
+):
+    """
+    Reads the rows of a result in batches, keeping all of them if they fit in
+    the caps and only the first ones and a summary otherwise.
+
+    Args:
+        fetchmany (callable): `fetchmany` of the cursor, returning up to `size` rows.
+        col_keys (list): Column names.
+        row_fn (callable): Converts a row to the tuple returned, e.g. shortening
+            its long strings.
+        max_rows (int): Largest number of rows returned in full, 0 for no cap.
+        max_chars (int): Largest length of the rows as text, 0 for no cap.
+        top_rows (int): Number of first rows kept with the summary.
+        batch_size (int): Number of rows read at a time.
+
+    Returns:
+        rows (list): All the rows, or the first `top_rows` rows past a cap.
+        summary (ResultSummary): Statistics of all the rows, or None if no
+            cap was hit.
+    """
+    rows = []
+    summary = ResultSummary(col_keys)
+    truncated = False
+    chars = 2
+    while True:
+        batch = fetchmany(batch_size)
+        if not batch:
+            break
+        batch = [row_fn(row) for row in batch]
+        summary.add(batch)
+        if truncated:
+            continue
+        for row in batch:
+            rows.append(row)
+            chars += len(str(row)) + 2
+            if (max_rows and len(rows) > max_rows) or (
+                max_chars and chars > max_chars
+            ):
+                truncated = True
+                break
+        if truncated:
+            del rows[top_rows:]
+    if not truncated:
+        return rows, None
+    logger.info(
+        f"Result of {summary.row_count} rows truncated to its first {len(rows)} rows "
+        "and a summary."
+    )
+    return rows, summary
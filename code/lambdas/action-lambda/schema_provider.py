@@ -0,0 +1,119 @@
+"""
+schema_provider.py
+
+Schema of the text-to-SQL tables read from the Glue Data Catalog.
+
+The whole database is read with paginated `get_tables` calls (up to 100 tables
+per call) instead of one SQLAlchemy reflection round trip per table, and every
+table gets a description: the curated `table_details` entry, else the Glue
+table description or comment, else one derived from its column comments.
+"""
+
+import logging
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+GLUE_PAGE_SIZE = 100
+
+
+class GlueSchemaProvider:
+    """
+    Tables, columns and descriptions of a Glue database.
+
+    Args:
+        glue_client (boto3.client): Glue client.
+        database (str): Glue database name.
+        table_details (dict): Curated table descriptions, taking precedence over the catalog.
+    """
+
+    def __init__(self, glue_client, database, table_details=None):
+        self._glue_client = glue_client
+        self._database = database
+        self._table_details = table_details or {}
+        self._tables = {}
+
+    def load(self):
+        """
+        Reads every table of the database from the catalog.
+
+        Returns:
+            tables (list): Sorted table names.
+        """
+        tables = {}
+        paginator = self._glue_client.get_paginator("get_tables")
+        for page in paginator.paginate(
+            DatabaseName=self._database,
+            PaginationConfig={"PageSize": GLUE_PAGE_SIZE},
+        ):
+            for table in page["TableList"]:
+                tables[table["Name"]] = table
+        self._tables = tables
+        logger.info(f"Loaded {len(tables)} tables from the Glue catalog.")
+        return self.tables
+
+    @property
+    def tables(self):
+        """
+        Sorted table names.
+        """
+        return sorted(self._tables)
+
+    def __contains__(self, table_name):
+        return table_name in self._tables
+
+    def columns(self, table_name):
+        """
+        Returns the columns of a table, partition keys last.
+
+        Args:
+            table_name (str): Table name.
+
+        Returns:
+            columns (list): Dictionaries with the "name", "type" and "comment" of the columns.
+        """
+        table = self._tables[table_name]
+        return [
+            {
+                "name": column["Name"],
+                "type": column["Type"],
+                "comment": column.get("Comment", ""),
+            }
+            for column in table.get("StorageDescriptor", {}).get("Columns", [])
+            + table.get("PartitionKeys", [])
+        ]
+
+    def description(self, table_name):
+        """
+        Returns the description of a table, falling back from `table_details` to
+        the Glue description or comment, then to the column comments.
+        """
+        if table_name in self._table_details:
+            return self._table_details[table_name]
+        table = self._tables.get(table_name, {})
+        description = table.get("Description") or table.get("Parameters", {}).get(
+            "comment"
+        )
+        if description:
+            return description
+        commented = [
+            f"{column['name']}: {column['comment']}"
+            for column in self.columns(table_name)
+            if column["comment"]
+        ]
+        if commented:
+            return f"Table {table_name} with columns " + "; ".join(commented)
+        return f"Table {table_name}."
+
+    def table_info(self, table_name):
+        """
+        Renders the schema of a table in the format of `SQLDatabase.get_single_table_info`.
+        """
+        columns = []
+        for column in self.columns(table_name):
+            if column["comment"]:
+                columns.append(f"{column['name']} ({column['type']}): '{column['comment']}'")
+            else:
+                columns.append(f"{column['name']} ({column['type']})")
+        return f"Table '{table_name}' has columns: {', '.join(columns)}."
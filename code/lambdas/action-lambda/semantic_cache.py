@@ -0,0 +1,478 @@
+"""
+semantic_cache.py
+
+Semantic cache of answered questions, checked before the text-to-SQL pipeline.
+
+A question whose embedding is within a cosine similarity threshold of a cached
+question mentioning the same entities (instance names, numbers) gets the cached
+SQL and answer back. Only entries of the current version of the underlying
+data are hits; entries expire after a TTL and the least recently used ones are
+evicted from memory beyond a maximum size.
+
+Entries are persisted through a pluggable backend: in-memory, local files,
+S3 objects or a DynamoDB table. A shared backend may hold entries of several
+versions while containers catch up with a data refresh, so entries are stored
+per version and never cleared; expired entries, including those of the old
+versions, are purged from the backend.
+
+The entries of the current version written by other containers are reloaded
+periodically in a background thread, at most `max_entries` of the newest, so
+lookups never wait for the backend.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from boto3.dynamodb.conditions import Attr
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def entry_key(question, data_version):
+    """
+    Returns the backend key of a question answered on a data version.
+    """
+    text = f"{data_version}\n{question.strip().lower()}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def version_id(data_version):
+    """
+    Returns the short hash naming the entries of a data version in a backend.
+    """
+    return hashlib.sha256(str(data_version).encode("utf-8")).hexdigest()[:16]
+
+
+def encode_entry(entry):
+    """
+    Serializes an entry to a JSON string, with the embedding as base64 float32.
+    """
+    item = dict(entry)
+    item["embedding"] = base64.b64encode(
+        np.asarray(entry["embedding"], dtype=np.float32).tobytes()
+    ).decode("ascii")
+    return json.dumps(item)
+
+
+def decode_entry(payload):
+    """
+    Deserializes an entry written by `encode_entry`.
+    """
+    entry = json.loads(payload)
+    entry["embedding"] = np.frombuffer(
+        base64.b64decode(entry["embedding"]), dtype=np.float32
+    )
+    return entry
+
+
+class InMemoryBackend:
+    """
+    Backend that keeps nothing beyond the process lifetime.
+    """
+
+    def load(self, data_version, limit):
+        return []
+
+    def save(self, entry):
+        pass
+
+    def delete(self, entry):
+        pass
+
+    def purge(self, expired_before):
+        return 0
+
+
+class FileBackend:
+    """
+    Backend storing one JSON file per entry in a directory per data version.
+
+    Args:
+        cache_dir (str): Directory of the entries.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, entry):
+        return os.path.join(
+            self._cache_dir, version_id(entry["data_version"]), f"{entry['key']}.json"
+        )
+
+    def _files(self, directory):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            # no entry of that version yet, or not a version directory
+            return []
+        return [
+            os.path.join(directory, name) for name in names if name.endswith(".json")
+        ]
+
+    def load(self, data_version, limit):
+        paths = self._files(os.path.join(self._cache_dir, version_id(data_version)))
+        entries = []
+        for path in sorted(paths, key=os.path.getmtime, reverse=True)[:limit]:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entries.append(decode_entry(f.read()))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable semantic cache entry {path}: {e}")
+        return entries
+
+    def save(self, entry):
+        path = self._path(entry)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(encode_entry(entry))
+        os.replace(tmp_path, path)
+
+    def delete(self, entry):
+        try:
+            os.remove(self._path(entry))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, expired_before):
+        purged = 0
+        for name in os.listdir(self._cache_dir):
+            for path in self._files(os.path.join(self._cache_dir, name)):
+                try:
+                    if os.path.getmtime(path) < expired_before:
+                        os.remove(path)
+                        purged += 1
+                except FileNotFoundError:
+                    pass
+        return purged
+
+
+class S3Backend:
+    """
+    Backend storing one JSON object per entry under an S3 prefix per data version.
+
+    Args:
+        s3_resource (boto3.resource): S3 resource.
+        bucket (str): Bucket name.
+        prefix (str): Key prefix, ending with a slash.
+    """
+
+    def __init__(self, s3_resource, bucket, prefix):
+        self._s3_resource = s3_resource
+        self._bucket_name = bucket
+        self._prefix = prefix
+
+    @property
+    def _bucket(self):
+        # resolved on use, the S3 resource is recreated after a snapshot restore
+        return self._s3_resource.Bucket(self._bucket_name)
+
+    def _object_key(self, entry):
+        return f"{self._prefix}{version_id(entry['data_version'])}/{entry['key']}.json"
+
+    def load(self, data_version, limit):
+        # the listing has the write times, only the newest objects are read
+        summaries = sorted(
+            (
+                obj
+                for obj in self._bucket.objects.filter(
+                    Prefix=f"{self._prefix}{version_id(data_version)}/"
+                )
+                if obj.key.endswith(".json")
+            ),
+            key=lambda obj: obj.last_modified,
+            reverse=True,
+        )
+        return [decode_entry(obj.get()["Body"].read()) for obj in summaries[:limit]]
+
+    def save(self, entry):
+        self._bucket.put_object(Key=self._object_key(entry), Body=encode_entry(entry))
+
+    def delete(self, entry):
+        self._bucket.Object(self._object_key(entry)).delete()
+
+    def purge(self, expired_before):
+        keys = [
+            {"Key": obj.key}
+            for obj in self._bucket.objects.filter(Prefix=self._prefix)
+            if obj.key.endswith(".json")
+            and obj.last_modified.timestamp() < expired_before
+        ]
+        for i in range(0, len(keys), 1000):
+            self._bucket.delete_objects(Delete={"Objects": keys[i : i + 1000]})
+        return len(keys)
+
+
+class DynamoDBBackend:
+    """
+    Backend storing one item per entry in a DynamoDB table with a string `key`
+    partition key. Items carry their data version in `data_version` and their
+    expiry time in `expires_at`, to be set as the TTL attribute of the table,
+    which deletes the expired items.
+
+    Args:
+        table (boto3 DynamoDB Table): DynamoDB table resource.
+    """
+
+    def __init__(self, table):
+        self._table = table
+
+    def load(self, data_version, limit):
+        entries = []
+        kwargs = {
+            "FilterExpression": Attr("data_version").eq(data_version)
+            & Attr("expires_at").gt(int(time.time()))
+        }
+        while True:
+            page = self._table.scan(**kwargs)
+            entries.extend(decode_entry(item["payload"]) for item in page["Items"])
+            if "LastEvaluatedKey" not in page:
+                break
+            kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+        entries.sort(key=lambda entry: entry["created_at"], reverse=True)
+        return entries[:limit]
+
+    def save(self, entry):
+        self._table.put_item(
+            Item={
+                "key": entry["key"],
+                "payload": encode_entry(entry),
+                "data_version": entry["data_version"],
+                "expires_at": int(entry["expires_at"]),
+            }
+        )
+
+    def delete(self, entry):
+        self._table.delete_item(Key={"key": entry["key"]})
+
+    def purge(self, expired_before):
+        # done by the TTL of the table
+        return 0
+
+
+class SemanticCache:
+    """
+    Cosine similarity cache of question answers with TTL and LRU eviction.
+
+    Args:
+        backend: Persistence backend, see the *Backend classes.
+        threshold (float): Minimum cosine similarity of a hit.
+        ttl (float): Lifetime of an entry in seconds.
+        max_entries (int): Maximum number of entries, least recently used evicted first.
+        refresh_interval (float): Seconds between two background reloads from a
+            shared backend.
+    """
+
+    def __init__(
+        self, backend, threshold=0.95, ttl=86400, max_entries=1000, refresh_interval=300
+    ):
+        self._backend = backend
+        self._threshold = threshold
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._loaded_at = None
+        self._reloading = False
+        self._data_version = None
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def stats(self):
+        """
+        Returns a copy of the hit/miss counters, including the hit rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def _maybe_reload(self):
+        # called with the lock held
+        now = time.monotonic()
+        if self._reloading or (
+            self._loaded_at is not None
+            and now - self._loaded_at < self._refresh_interval
+        ):
+            return
+        self._loaded_at = now
+        self._reloading = True
+        threading.Thread(
+            target=self._reload,
+            args=(self._data_version,),
+            name="semantic-cache-reload",
+            daemon=True,
+        ).start()
+
+    def _reload(self, data_version):
+        entries = []
+        try:
+            entries = self._backend.load(data_version, self._max_entries)
+            purged = self._backend.purge(time.time() - self._ttl)
+            if purged:
+                logger.info(f"Purged {purged} expired semantic cache entries.")
+        except Exception as e:
+            logger.warning(f"Could not reload the semantic cache: {e}")
+        with self._lock:
+            self._reloading = False
+            if data_version != self._data_version:
+                # the version changed meanwhile, reload the new one
+                self._loaded_at = None
+                return
+            now = time.time()
+            room = self._max_entries - len(self._entries)
+            entries.sort(key=lambda entry: entry["created_at"], reverse=True)
+            loaded = [
+                entry
+                for entry in entries
+                if now - entry["created_at"] <= self._ttl
+                and entry["key"] not in self._entries
+            ][: max(room, 0)]
+            # oldest of all, the first evicted
+            for entry in loaded:
+                self._entries[entry["key"]] = entry
+                self._entries.move_to_end(entry["key"], last=False)
+            if loaded:
+                self._matrix = None
+
+    def _similarities(self, embedding):
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            vectors = np.asarray(
+                [self._entries[key]["embedding"] for key in self._keys], dtype=np.float32
+            ).reshape(len(self._keys), -1)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self._matrix = vectors / norms
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        return self._matrix @ query
+
+    def _remove(self, key, persist=True):
+        entry = self._entries.pop(key, None)
+        self._matrix = None
+        if not persist or entry is None:
+            return
+        try:
+            self._backend.delete(entry)
+        except Exception as e:
+            logger.warning(f"Could not delete semantic cache entry {key}: {e}")
+
+    def lookup(self, embedding, data_version, entities=()):
+        """
+        Returns the cached entry of the most similar question with the same
+        entities, if any.
+
+        Args:
+            embedding (list): Question embedding.
+            data_version (str): Current data version, entries of other versions
+                are skipped.
+            entities (list): Entities of the question, see
+                `build_query_engine.get_question_entities`. Questions such as
+                "price of p3.8xlarge" and "price of p3.2xlarge" are within the
+                similarity threshold, only their entities tell them apart.
+
+        Returns:
+            entry (dict): Entry with "question", "sql" and "answer", or None on a miss.
+        """
+        with self._lock:
+            if data_version != self._data_version:
+                # only drop the entries held in memory and reload those of the
+                # new version in the background, the backend may be shared with
+                # containers still on another version
+                logger.info("Data version changed, reloading the semantic cache.")
+                self._data_version = data_version
+                self.invalidate()
+                self._loaded_at = None
+            self._maybe_reload()
+
+            entry = None
+            if self._entries:
+                similarities = self._similarities(embedding)
+                entities = list(entities)
+                # similar questions about other entities are never hits
+                mismatched = [
+                    self._entries[key]["data_version"] != data_version
+                    or self._entries[key].get("entities", []) != entities
+                    for key in self._keys
+                ]
+                similarities[mismatched] = -np.inf
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self._threshold:
+                    entry = self._entries[self._keys[best]]
+                    if time.time() - entry["created_at"] > self._ttl:
+                        self._remove(entry["key"])
+                        entry = None
+                    else:
+                        self._entries.move_to_end(entry["key"])
+                        logger.info(
+                            f"Semantic cache hit ({similarities[best]:.4f}): {entry['question']}"
+                        )
+
+            self._stats["hits" if entry else "misses"] += 1
+            return entry
+
+    def store(self, question, embedding, sql, answer, data_version, entities=()):
+        """
+        Stores an answered question, evicting the least recently used entries.
+
+        Args:
+            question (str): User question.
+            embedding (list): Question embedding.
+            sql (str): SQL query that answered the question.
+            answer (str): Synthesized answer.
+            data_version (str): Data version the answer was computed on.
+            entities (list): Entities of the question, see `lookup`.
+        """
+        created_at = time.time()
+        entry = {
+            "key": entry_key(question, data_version),
+            "question": question,
+            "embedding": np.asarray(embedding, dtype=np.float32),
+            "sql": sql,
+            "answer": answer,
+            "created_at": created_at,
+            "expires_at": created_at + self._ttl,
+            "data_version": data_version,
+            "entities": list(entities),
+        }
+        with self._lock:
+            self._entries[entry["key"]] = entry
+            self._entries.move_to_end(entry["key"])
+            self._matrix = None
+            self._stats["stores"] += 1
+            while len(self._entries) > self._max_entries:
+                oldest = next(iter(self._entries))
+                self._stats["evictions"] += 1
+                # evicted from this container only, the entry expires from
+                # the backend with its TTL
+                self._remove(oldest, persist=False)
+        try:
+            self._backend.save(entry)
+        except Exception as e:
+            logger.warning(f"Could not persist semantic cache entry: {e}")
+
+    def invalidate(self):
+        """
+        Drops the entries held in memory, e.g. after the pricing data was
+        refreshed. The backend keeps its entries, which are skipped by the
+        lookups of other versions and expire with their TTL.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
@@ -0,0 +1,136 @@
+"""
+sql_cache.py
+
+Cache of SQL query results keyed on the canonical form of the query and the
+data version of the tables it reads.
+
+Different phrasings of a question often produce the same SQL up to
+whitespace, keyword case or the order of the values of an IN-list; the
+canonical form maps all of them to one cache entry.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SQL_DIALECT = "athena"
+
+
+def _sort_in_lists(node):
+    if isinstance(node, exp.In) and node.expressions:
+        if all(isinstance(e, exp.Literal) for e in node.expressions):
+            node.set(
+                "expressions",
+                sorted(node.expressions, key=lambda e: (e.is_string, e.this)),
+            )
+    return node
+
+
+def canonicalize_sql(sql):
+    """
+    Returns the canonical form of a SQL statement: parsed and regenerated with
+    normalized whitespace, keyword and identifier case, sorted IN-list literals
+    and no trailing semicolon.
+
+    Args:
+        sql (str): SQL statement.
+
+    Returns:
+        canonical (str): Canonical SQL.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=SQL_DIALECT) if s is not None]
+    except SqlglotError:
+        statements = []
+    if len(statements) != 1:
+        # fall back to whitespace and semicolon normalization only
+        return re.sub(r"\s+", " ", sql).strip().rstrip(";").strip()
+    tree = statements[0].transform(_sort_in_lists)
+    return tree.sql(dialect=SQL_DIALECT, normalize=True)
+
+
+def referenced_tables(sql):
+    """
+    Returns the names of the tables a SQL statement reads, or None if it cannot be parsed.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read=SQL_DIALECT)
+    except SqlglotError:
+        return None
+    ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    return sorted({t.name for t in tree.find_all(exp.Table)} - ctes)
+
+
+class SQLResultCache:
+    """
+    In-process LRU cache of query results with a TTL.
+
+    Args:
+        max_entries (int): Maximum number of cached results.
+        ttl (float): Lifetime of a cached result in seconds.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    @property
+    def stats(self):
+        """
+        Returns a copy of the hit/miss counters, including the hit rate.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    @staticmethod
+    def make_key(canonical_sql, data_version):
+        """
+        Returns the cache key of a canonical query on a given data version.
+        """
+        return hashlib.sha256(
+            f"{data_version}\0{canonical_sql}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached result of a key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self._ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, result):
+        """
+        Stores a result, evicting the least recently used ones.
+        """
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
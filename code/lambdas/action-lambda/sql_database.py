@@ -0,0 +1,300 @@
+"""
+sql_database.py
+
+SQLDatabase used by the query engine to run the LLM-generated SQL.
+"""
+
+import copy
+import logging
+import time
+
+from llama_index.core import SQLDatabase
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from athena_execution import last_query_finished, last_query_stats
+from local_sql import (
+    LocalSQLQueryError,
+    LocalSQLUnsupportedError,
+    transpile_to_duckdb,
+)
+from metrics import record, set_property, stage
+from result_summary import fetch_bounded, order_by_columns
+from sql_cache import SQLResultCache, canonicalize_sql, referenced_tables
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class TextToSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase that validates and bounds the generated SQL with a guard, serves
+    repeated queries from a result cache keyed on the canonical SQL and the data
+    version of the tables it reads, runs queries on small tables in the local SQL
+    tier, and reports the Athena statistics of the queries it runs in the result
+    metadata.
+
+    Results are fetched in batches up to a row and character cap; past it, the
+    first rows and statistics of all rows replace the full result (see
+    `result_summary`).
+
+    With a table context store or a schema provider, the tables and their prompt
+    schema come from them instead of SQLAlchemy reflection, so creating the
+    database makes no Athena calls.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): SQL Alchemy engine.
+        result_cache (SQLResultCache): Result cache. None disables caching.
+        data_version (DataVersion): Data version of the tables.
+        local_engine (LocalSQLEngine): Local SQL tier. None runs everything on Athena.
+        guard (SQLGuard): SQL guard. None runs the SQL as generated.
+        table_context (TableContextStore): Precomputed table context.
+        schema_provider (GlueSchemaProvider): Catalog schema, listing the tables and
+            rendering those missing from the table context. Without either, the
+            tables are reflected through the engine.
+        max_result_rows (int): Largest number of result rows returned in full,
+            0 for no cap.
+        max_result_chars (int): Largest length of the result rows as text, 0
+            for no cap.
+        top_result_rows (int): Number of first rows kept with the summary of a
+            truncated result.
+        **kwargs: Arguments of SQLDatabase.
+    """
+
+    def __init__(
+        self,
+        engine,
+        result_cache=None,
+        data_version=None,
+        local_engine=None,
+        guard=None,
+        table_context=None,
+        schema_provider=None,
+        max_result_rows=0,
+        max_result_chars=0,
+        top_result_rows=10,
+        **kwargs,
+    ):
+        self._table_context = table_context
+        self._schema_provider = schema_provider
+        self._lazy_inspector = None
+        if table_context is None and schema_provider is None:
+            super().__init__(engine, **kwargs)
+        else:
+            # the catalog is the source of truth for which tables exist
+            source = schema_provider if schema_provider is not None else table_context
+            self._init_without_reflection(engine, source.tables, **kwargs)
+        self._result_cache = result_cache
+        self._data_version = data_version
+        self._local_engine = local_engine
+        self._guard = guard
+        self._max_result_rows = max_result_rows
+        self._max_result_chars = max_result_chars
+        self._top_result_rows = top_result_rows
+
+    def _init_without_reflection(
+        self, engine, table_names, schema=None, max_string_length=300, **kwargs
+    ):
+        # state set by SQLDatabase.__init__, without its reflection queries
+        self._engine = engine
+        self._schema = schema
+        self._all_tables = set(table_names)
+        self._include_tables = set()
+        self._ignore_tables = set()
+        self._usable_tables = set(self._all_tables)
+        self._sample_rows_in_table_info = kwargs.get("sample_rows_in_table_info", 3)
+        self._indexes_in_table_info = kwargs.get("indexes_in_table_info", False)
+        self._custom_table_info = kwargs.get("custom_table_info")
+        self._max_string_length = max_string_length
+        self._metadata = kwargs.get("metadata") or MetaData()
+
+    @property
+    def _inspector(self):
+        # created on first use, connecting to the database
+        if self._lazy_inspector is None:
+            self._lazy_inspector = inspect(self._engine)
+        return self._lazy_inspector
+
+    @_inspector.setter
+    def _inspector(self, inspector):
+        self._lazy_inspector = inspector
+
+    def get_single_table_info(self, table_name):
+        """
+        Returns the schema of a table for the prompt, with its statistics when
+        it is in the table context store, else from the catalog.
+        """
+        if self._table_context is not None and table_name in self._table_context:
+            return self._table_context.render(table_name)
+        if self._schema_provider is not None and table_name in self._schema_provider:
+            return self._schema_provider.table_info(table_name)
+        return super().get_single_table_info(table_name)
+
+    def column_names(self, table_name):
+        """
+        Returns the lower-case column names of a table, or None if it is not in
+        the database.
+        """
+        if table_name not in self._usable_tables:
+            return None
+        if self._schema_provider is not None and table_name in self._schema_provider:
+            columns = self._schema_provider.columns(table_name)
+        elif self._table_context is not None and table_name in self._table_context:
+            columns = self._table_context.columns(table_name)
+        else:
+            columns = self.get_table_columns(table_name)
+        return {column["name"].lower() for column in columns}
+
+    def _cache_key(self, command):
+        canonical_sql = canonicalize_sql(command)
+        tables = referenced_tables(canonical_sql)
+        if self._data_version is None:
+            version = ""
+        elif tables is None:
+            version = self._data_version.current()
+        else:
+            version = ",".join(
+                f"{table}={self._data_version.table_version(table)}" for table in tables
+            )
+        return SQLResultCache.make_key(canonical_sql, version)
+
+    def _fetch(self, command, fetchmany, col_keys):
+        """
+        Fetches a result within the row and character caps.
+
+        Returns:
+            result_str (str): String representation of the rows, or the summary
+                of a truncated result.
+            metadata (dict): Dictionary with the "result" rows and "col_keys",
+                and the "truncated" statistics of all the rows of a truncated
+                result.
+        """
+        rows, summary = fetch_bounded(
+            fetchmany,
+            col_keys,
+            row_fn=lambda row: tuple(
+                self.truncate_word(column, length=self._max_string_length)
+                for column in row
+            ),
+            max_rows=self._max_result_rows,
+            max_chars=self._max_result_chars,
+            top_rows=self._top_result_rows,
+        )
+        metadata = {"result": rows, "col_keys": col_keys}
+        if summary is None:
+            return str(rows), metadata
+        set_property("result_truncated", True)
+        metadata["truncated"] = summary.to_dict()
+        return summary.render(rows, order_by_columns(command)), metadata
+
+    def _run_athena(self, command):
+        # SQLDatabase.run_sql, reading the rows within the caps
+        with self._engine.begin() as connection:
+            try:
+                if self._schema:
+                    command = command.replace("FROM ", f"FROM {self._schema}.")
+                    command = command.replace("JOIN ", f"JOIN {self._schema}.")
+                cursor = connection.execute(text(command))
+            except (ProgrammingError, OperationalError) as exc:
+                raise NotImplementedError(
+                    f"Statement {command!r} is invalid SQL.\nError: {exc.orig}"
+                ) from exc
+            if not cursor.returns_rows:
+                return "", {}
+            return self._fetch(command, cursor.fetchmany, list(cursor.keys()))
+
+    def _run_local(self, command):
+        try:
+            duckdb_sql, tables = transpile_to_duckdb(
+                command, schema=self._local_engine.schema
+            )
+        except ValueError as e:
+            logger.info(f"Running on Athena, dialect check failed: {e}")
+            return None
+        if not tables or not tables <= self._local_engine.tables:
+            return None
+        if self._data_version is not None and self._local_engine.is_stale(
+            tables, self._data_version
+        ):
+            # Athena answers until the changed tables are reloaded locally
+            if self._local_engine.reload(self._data_version):
+                logger.info(f"Reloading the changed local tables of {sorted(tables)}.")
+            return None
+
+        try:
+            with stage("local_execution"):
+                result_str, metadata = self._local_engine.run_sql(
+                    duckdb_sql,
+                    fetch=lambda fetchmany, col_keys: self._fetch(
+                        command, fetchmany, col_keys
+                    ),
+                )
+        except LocalSQLUnsupportedError as e:
+            logger.warning(f"Local SQL tier cannot run it, falling back to Athena: {e}")
+            return None
+        except LocalSQLQueryError as exc:
+            raise NotImplementedError(
+                f"Statement {command!r} is invalid SQL.\nError: {exc}"
+            ) from exc
+        logger.info(f"Ran on the local SQL tier: {duckdb_sql}")
+        return result_str, dict(metadata, execution="local")
+
+    def run_sql(self, command):
+        """
+        Runs a SQL statement, or returns its cached result.
+
+        Args:
+            command (str): SQL statement.
+
+        Returns:
+            result_str (str): String representation of the rows.
+            metadata (dict): Dictionary with "result" rows, "col_keys", the
+                "execution" tier ("local" or "athena"), the "truncated"
+                statistics of a result past the caps and, for queries that ran
+                on Athena, "athena_stats" and the guard "scan_estimate_bytes".
+
+        Raises:
+            SQLGuardError: If the guard refuses the statement.
+        """
+        if self._guard is not None:
+            command = self._guard.rewrite(command)
+
+        key = None
+        if self._result_cache is not None:
+            key = self._cache_key(command)
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                logger.info("SQL result cache hit.")
+                set_property("execution", "cache")
+                return cached[0], copy.copy(cached[1])
+
+        local_result = None
+        if self._local_engine is not None:
+            local_result = self._run_local(command)
+
+        if local_result is not None:
+            result_str, metadata = local_result
+        else:
+            scan_bytes = None
+            if self._guard is not None:
+                with stage("scan_estimate"):
+                    scan_bytes = self._guard.check_scan(command)
+            last_query_stats.set(None)
+            with stage("athena_query"):
+                result_str, metadata = self._run_athena(command)
+            metadata = dict(metadata, execution="athena", scan_estimate_bytes=scan_bytes)
+            stats = last_query_stats.get()
+            if stats is not None:
+                metadata["athena_stats"] = stats
+                record("athena_queue", stats["queue_time_ms"])
+                record("athena_execution", stats["execution_time_ms"])
+                record(
+                    "result_fetch",
+                    (time.perf_counter() - last_query_finished.get()) * 1000,
+                )
+        set_property("execution", metadata["execution"])
+
+        if key is not None:
+            self._result_cache.put(key, (result_str, metadata))
+        return result_str, copy.copy(metadata)
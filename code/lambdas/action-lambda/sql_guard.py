@@ -0,0 +1,381 @@
+"""
+sql_guard.py
+
+Guard between SQL generation and execution.
+
+The LLM is only asked not to write expensive SQL; the guard enforces it. A
+generated statement must be a single SELECT without `SELECT *`, gets a `LIMIT`
+injected or capped, and its Athena scan is estimated from the S3 size of the
+tables it reads, pruned by the partition predicates of its WHERE clauses.
+Statements above the bytes-scanned budget are refused before they reach Athena;
+the `BytesScannedCutoffPerQuery` of the Athena workgroup is the backstop for
+anything the estimate misses.
+"""
+
+import logging
+import threading
+
+import sqlglot
+from botocore.exceptions import BotoCoreError, ClientError
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from sql_cache import SQL_DIALECT
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Formats whose scan only reads the referenced columns
+COLUMNAR_FORMATS = ("parquet", "orc")
+
+
+class SQLGuardError(ValueError):
+    """
+    Raised when a generated SQL statement is refused by the guard.
+    """
+
+
+def parse_query(sql):
+    """
+    Parses a single read-only query.
+
+    Args:
+        sql (str): SQL statement.
+
+    Returns:
+        tree (sqlglot.exp.Query): Parsed query.
+
+    Raises:
+        SQLGuardError: If the SQL is not a single SELECT statement.
+    """
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=SQL_DIALECT) if s is not None]
+    except SqlglotError as e:
+        raise SQLGuardError(f"The SQL query could not be parsed: {e}") from e
+    if len(statements) != 1:
+        raise SQLGuardError("Only a single SQL statement is allowed.")
+    tree = statements[0]
+    if not isinstance(tree, exp.Query) or tree.find(exp.DDL, exp.DML, exp.Command):
+        raise SQLGuardError("Only SELECT statements are allowed.")
+    return tree
+
+
+def has_star_projection(tree):
+    """
+    Returns True if any SELECT of the query projects `*` or `table.*`.
+    """
+    for select in tree.find_all(exp.Select):
+        for projection in select.expressions:
+            if isinstance(projection, exp.Star) or (
+                isinstance(projection, exp.Column) and projection.is_star
+            ):
+                return True
+    return False
+
+
+def enforce_limit(tree, max_rows):
+    """
+    Adds `LIMIT max_rows` to a query without a limit, or lowers a larger one.
+
+    Args:
+        tree (sqlglot.exp.Query): Parsed query, modified in place.
+        max_rows (int): Largest number of returned rows.
+
+    Returns:
+        tree (sqlglot.exp.Query): The limited query.
+    """
+    limit = tree.args.get("limit")
+    if limit is not None:
+        value = limit.expression
+        if isinstance(value, exp.Literal) and value.is_int and int(value.name) <= max_rows:
+            return tree
+    return tree.limit(max_rows, copy=False)
+
+
+def _conjuncts(condition):
+    if isinstance(condition, exp.And):
+        return list(condition.flatten())
+    return [condition]
+
+
+def _literal_sql(literal):
+    if literal.is_string:
+        return "'" + literal.name.replace("'", "''") + "'"
+    return literal.name
+
+
+def partition_filters(tree, table, partition_keys):
+    """
+    Returns the equality and IN predicates on the partition keys of a table that
+    appear in the top-level conjunctions of the WHERE clauses reading it.
+
+    Args:
+        tree (sqlglot.exp.Query): Parsed query.
+        table (sqlglot.exp.Table): Table node of the query.
+        partition_keys (list): Partition key names of the table.
+
+    Returns:
+        filters (dict): Mapping of partition key to the list of SQL literals it is restricted to.
+    """
+    select = table.find_ancestor(exp.Select)
+    if select is None or select.args.get("where") is None:
+        return {}
+    names = {table.name, table.alias_or_name}
+    keys = {key.lower() for key in partition_keys}
+
+    filters = {}
+    for condition in _conjuncts(select.args["where"].this):
+        if isinstance(condition, exp.EQ):
+            column, values = condition.this, [condition.expression]
+            if isinstance(values[0], exp.Column):
+                column, values = values[0], [condition.this]
+        elif isinstance(condition, exp.In) and not condition.args.get("query"):
+            column, values = condition.this, condition.expressions
+        else:
+            continue
+        if (
+            isinstance(column, exp.Column)
+            and column.name.lower() in keys
+            and (not column.table or column.table in names)
+            and values
+            and all(isinstance(v, exp.Literal) for v in values)
+        ):
+            filters[column.name.lower()] = [_literal_sql(v) for v in values]
+    return filters
+
+
+def referenced_columns(tree, table):
+    """
+    Returns the lower-case names of the columns a query reads from a table, or
+    None if it cannot tell (unqualified columns in a multi-table query).
+    """
+    names = {table.name, table.alias_or_name}
+    single_table = len({t.name for t in tree.find_all(exp.Table)}) == 1
+    columns = set()
+    for column in tree.find_all(exp.Column):
+        if column.table in names or (not column.table and single_table):
+            columns.add(column.name.lower())
+        elif not column.table:
+            return None
+    return columns
+
+
+def check_schema(tree, column_names):
+    """
+    Checks that a query only reads tables and columns of the schema.
+
+    Columns are checked against all the tables the query reads, and names
+    defined by the query itself (CTEs, aliases) are accepted.
+
+    Args:
+        tree (sqlglot.exp.Query): Parsed query.
+        column_names (callable): Returns the lower-case column names of a table,
+            or None if the table does not exist.
+
+    Raises:
+        SQLGuardError: If the query reads an unknown table or column.
+    """
+    defined = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    defined |= {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    defined |= {
+        subquery.alias_or_name.lower() for subquery in tree.find_all(exp.Subquery)
+    }
+
+    known = set()
+    for table in tree.find_all(exp.Table):
+        if table.name.lower() in defined:
+            continue
+        columns = column_names(table.name.lower())
+        if columns is None:
+            raise SQLGuardError(f"Unknown table: {table.name}")
+        known |= columns
+
+    for column in tree.find_all(exp.Column):
+        if column.is_star:
+            continue
+        if column.name.lower() not in known and column.name.lower() not in defined:
+            raise SQLGuardError(f"Unknown column: {column.sql(dialect=SQL_DIALECT)}")
+
+
+class ScanEstimator:
+    """
+    Estimates the bytes an Athena query scans from the S3 size of the tables
+    and partitions it reads.
+
+    Args:
+        glue_client (boto3.client): Glue client.
+        s3_resource (boto3.resource): S3 resource.
+        database (str): Glue database name.
+        data_version (DataVersion): Data version of the tables, sizes are cached per version.
+    """
+
+    def __init__(self, glue_client, s3_resource, database, data_version=None):
+        self._glue_client = glue_client
+        self._s3_resource = s3_resource
+        self._database = database
+        self._data_version = data_version
+        self._lock = threading.Lock()
+        self._tables = {}
+        self._sizes = {}
+
+    def _version(self, name):
+        if self._data_version is None:
+            return None
+        return self._data_version.table_version(name)
+
+    def _table(self, name):
+        version = self._version(name)
+        with self._lock:
+            cached = self._tables.get(name)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        table = self._glue_client.get_table(DatabaseName=self._database, Name=name)[
+            "Table"
+        ]
+        with self._lock:
+            self._tables[name] = (version, table)
+        return table
+
+    def _location_size(self, location, version):
+        with self._lock:
+            cached = self._sizes.get(location)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+        bucket, _, prefix = location.removeprefix("s3://").partition("/")
+        size = sum(
+            obj.size for obj in self._s3_resource.Bucket(bucket).objects.filter(Prefix=prefix)
+        )
+        with self._lock:
+            self._sizes[location] = (version, size)
+        return size
+
+    def _partition_locations(self, name, expression):
+        paginator = self._glue_client.get_paginator("get_partitions")
+        for page in paginator.paginate(
+            DatabaseName=self._database, TableName=name, Expression=expression
+        ):
+            for partition in page["Partitions"]:
+                yield partition["StorageDescriptor"]["Location"]
+
+    def table_scan_bytes(self, tree, table_node):
+        """
+        Estimates the bytes scanned from one table of a query.
+
+        Args:
+            tree (sqlglot.exp.Query): Parsed query.
+            table_node (sqlglot.exp.Table): Table node of the query.
+
+        Returns:
+            scan_bytes (int): Estimated bytes scanned.
+        """
+        name = table_node.name
+        version = self._version(name)
+        table = self._table(name)
+        storage = table.get("StorageDescriptor", {})
+        partition_keys = [key["Name"] for key in table.get("PartitionKeys", [])]
+
+        filters = partition_filters(tree, table_node, partition_keys)
+        if filters:
+            expression = " AND ".join(
+                f"{key} IN ({', '.join(values)})" for key, values in filters.items()
+            )
+            scan_bytes = sum(
+                self._location_size(location, version)
+                for location in self._partition_locations(name, expression)
+            )
+        else:
+            scan_bytes = self._location_size(storage.get("Location", ""), version)
+
+        classification = table.get("Parameters", {}).get("classification", "").lower()
+        all_columns = [column["Name"].lower() for column in storage.get("Columns", [])]
+        columns = referenced_columns(tree, table_node)
+        if classification in COLUMNAR_FORMATS and columns and all_columns:
+            read_columns = len(columns & set(all_columns)) or 1
+            scan_bytes = scan_bytes * read_columns // len(all_columns)
+        return scan_bytes
+
+    def estimate(self, tree):
+        """
+        Estimates the bytes scanned by a query.
+
+        Args:
+            tree (sqlglot.exp.Query): Parsed query.
+
+        Returns:
+            scan_bytes (int): Estimated bytes scanned, or None if the catalog could not be read.
+        """
+        ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+        try:
+            return sum(
+                self.table_scan_bytes(tree, table)
+                for table in tree.find_all(exp.Table)
+                if table.name not in ctes
+            )
+        except (BotoCoreError, ClientError) as e:
+            logger.warning(f"Could not estimate the query scan: {e}")
+            return None
+
+
+class SQLGuard:
+    """
+    Validates and bounds generated SQL before it runs.
+
+    Args:
+        max_rows (int): Largest number of returned rows, enforced with LIMIT.
+        max_scan_bytes (int): Bytes-scanned budget of an Athena query, 0 disables the check.
+        estimator (ScanEstimator): Scan estimator. None disables the budget check.
+    """
+
+    def __init__(self, max_rows=1000, max_scan_bytes=0, estimator=None):
+        self._max_rows = max_rows
+        self._max_scan_bytes = max_scan_bytes
+        self._estimator = estimator
+
+    def rewrite(self, sql):
+        """
+        Rejects statements that are not a single SELECT or that select `*`, and
+        injects or caps their LIMIT.
+
+        Args:
+            sql (str): Generated SQL statement.
+
+        Returns:
+            guarded_sql (str): Statement to run.
+
+        Raises:
+            SQLGuardError: If the statement is refused.
+        """
+        tree = parse_query(sql)
+        if has_star_projection(tree):
+            raise SQLGuardError(
+                "SELECT * is not allowed, select only the columns needed to answer."
+            )
+        if self._max_rows > 0:
+            tree = enforce_limit(tree, self._max_rows)
+        return tree.sql(dialect=SQL_DIALECT)
+
+    def check_scan(self, sql):
+        """
+        Refuses a statement whose estimated Athena scan is above the budget.
+
+        Args:
+            sql (str): Statement returned by `rewrite`.
+
+        Returns:
+            scan_bytes (int): Estimated bytes scanned, or None if not estimated.
+
+        Raises:
+            SQLGuardError: If the estimate is above the budget.
+        """
+        if self._estimator is None or self._max_scan_bytes <= 0:
+            return None
+        scan_bytes = self._estimator.estimate(parse_query(sql))
+        if scan_bytes is not None and scan_bytes > self._max_scan_bytes:
+            logger.warning(f"Refused query scanning ~{scan_bytes} bytes: {sql}")
+            raise SQLGuardError(
+                f"The query would scan about {scan_bytes / 2**20:.0f} MiB, above the "
+                f"{self._max_scan_bytes / 2**20:.0f} MiB budget. Filter on the "
+                "partition columns or narrow the question."
+            )
+        return scan_bytes
@@ -0,0 +1,283 @@
+"""
+sql_template_cache.py
+
+Cache of parameterized SQL templates learned from answered questions.
+
+Many questions differ only in the instance names or numbers they mention, e.g.
+"how much is p3.8xlarge per hour?" and "how much is c5.4xlarge per hour?".
+When a question is answered from a successful query, its entities (the values
+found by the value linker and the numbers) are abstracted out of the question
+into a pattern, "how much is {ec2_pricing.instance_name} per hour", and the
+SQL literals equal to them into the slots of a SQL skeleton. A new question
+with the same pattern gets the skeleton filled with its own entities and runs
+without calling the LLM to generate the SQL.
+
+Templates learned from SQL that never ran, such as the fewshot examples, are
+unverified until a filled SQL of theirs returns rows.
+"""
+
+import logging
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from sql_cache import SQL_DIALECT
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Numbers standing on their own, not the digits of names such as "p3.2xlarge"
+NUMBER_PATTERN = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.]*\w)")
+NUMBER_SLOT = "number"
+
+
+def question_entities(question, value_linker=None):
+    """
+    Finds the entities of a question: the values of the value index it
+    mentions, then the numbers outside of them.
+
+    Args:
+        question (str): Linked question.
+        value_linker (ValueLinker): Value index, None only finds numbers.
+
+    Returns:
+        entities (list): Dictionaries with the "start" and "end" offsets, the
+            "value" and the slot "type" (the "table.column" of the value, or
+            "number"), in the order of the question.
+    """
+    entities = []
+    if value_linker is not None:
+        entities = [
+            {
+                "start": mention["start"],
+                "end": mention["end"],
+                "value": mention["value"],
+                "type": mention["column"],
+            }
+            for mention in value_linker.find(question)
+        ]
+    for match in NUMBER_PATTERN.finditer(question):
+        if not any(e["start"] <= match.start() < e["end"] for e in entities):
+            entities.append(
+                {
+                    "start": match.start(),
+                    "end": match.end(),
+                    "value": match.group(),
+                    "type": NUMBER_SLOT,
+                }
+            )
+    return sorted(entities, key=lambda entity: entity["start"])
+
+
+def question_pattern(question, entities):
+    """
+    Returns the pattern of a question: its entities replaced by their slot
+    type, in lower case, with normalized whitespace and no final punctuation.
+    """
+    parts, position = [], 0
+    for entity in entities:
+        parts.extend([question[position : entity["start"]], f"{{{entity['type']}}}"])
+        position = entity["end"]
+    parts.append(question[position:])
+    pattern = re.sub(r"\s+", " ", "".join(parts)).strip().rstrip("?.! ")
+    return pattern.lower()
+
+
+def _literal_slot(literal, entities):
+    # slot of the entity a SQL literal stands for, if any
+    for slot, entity in enumerate(entities):
+        if entity["type"] == NUMBER_SLOT:
+            if not literal.is_string and float(literal.this) == float(entity["value"]):
+                return slot
+        elif literal.is_string and literal.this == entity["value"]:
+            return slot
+    return None
+
+
+class SQLTemplateCache:
+    """
+    In-process LRU cache of SQL skeletons keyed on question patterns.
+
+    Args:
+        value_linker (ValueLinker): Value index finding the entities of the
+            questions, None only abstracts numbers.
+        max_entries (int): Maximum number of templates.
+    """
+
+    def __init__(self, value_linker=None, max_entries=256):
+        self.value_linker = value_linker
+        self._max_entries = max_entries
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "fallbacks": 0, "learned": 0}
+
+    @property
+    def stats(self):
+        """
+        Returns a copy of the counters, including the hit rate.
+
+        A matched template only counts as a hit once its filled SQL answered,
+        see `hit`; otherwise it counts as a fallback, see `fallback`.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._templates)
+            stats["unverified"] = sum(
+                not verified for _, verified in self._templates.values()
+            )
+        lookups = stats["hits"] + stats["misses"] + stats["fallbacks"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+    def learn(self, question, sql, verified=True):
+        """
+        Abstracts a template out of a question and the SQL that answered it.
+
+        The template is only kept when every entity of the question is a
+        literal of the SQL, no two entities have the same value and each number
+        is a single literal, so that filling its slots cannot mix them up.
+
+        Args:
+            question (str): Linked question.
+            sql (str): SQL statement that answered it.
+            verified (bool): False for SQL that never ran, see `verify`. Such
+                a template does not replace a verified one.
+
+        Returns:
+            pattern (str): Pattern of the learned template, or None.
+        """
+        entities = question_entities(question, self.value_linker)
+        values = [(entity["type"], entity["value"]) for entity in entities]
+        if len(set(values)) != len(values):
+            return None
+        try:
+            statements = [
+                statement
+                for statement in sqlglot.parse(sql, read=SQL_DIALECT)
+                if statement is not None
+            ]
+        except SqlglotError:
+            return None
+        if len(statements) != 1:
+            return None
+
+        uses = Counter()
+
+        def to_placeholder(node):
+            if isinstance(node, exp.Literal):
+                slot = _literal_slot(node, entities)
+                if slot is not None:
+                    uses[slot] += 1
+                    return exp.Placeholder(this=f"s{slot}")
+            return node
+
+        skeleton = statements[0].transform(to_placeholder)
+        if len(uses) != len(entities) or any(
+            uses[slot] > 1
+            for slot, entity in enumerate(entities)
+            if entity["type"] == NUMBER_SLOT
+        ):
+            return None
+
+        pattern = question_pattern(question, entities)
+        with self._lock:
+            current = self._templates.get(pattern)
+            if not verified and current is not None and current[1]:
+                return pattern
+            self._templates[pattern] = (skeleton, verified)
+            self._templates.move_to_end(pattern)
+            while len(self._templates) > self._max_entries:
+                self._templates.popitem(last=False)
+            self._stats["learned"] += 1
+        logger.info(
+            f"Learned SQL template {pattern!r}: {skeleton.sql(dialect=SQL_DIALECT)}"
+        )
+        return pattern
+
+    def match(self, question):
+        """
+        Fills the template of a question pattern with the entities of the question.
+
+        A match is neither a hit nor a fallback until the filled SQL ran, see
+        `hit` and `fallback`.
+
+        Args:
+            question (str): Linked question.
+
+        Returns:
+            sql (str): Filled SQL statement, or None on a miss.
+            pattern (str): Pattern of the question.
+            verified (bool): False if the template never returned rows.
+        """
+        entities = question_entities(question, self.value_linker)
+        pattern = question_pattern(question, entities)
+        with self._lock:
+            template = self._templates.get(pattern)
+            if template is None:
+                self._stats["misses"] += 1
+                return None, pattern, False
+            self._templates.move_to_end(pattern)
+        skeleton, verified = template
+
+        def fill(node):
+            if isinstance(node, exp.Placeholder):
+                entity = entities[int(node.name[1:])]
+                if entity["type"] == NUMBER_SLOT:
+                    return exp.Literal.number(entity["value"])
+                return exp.Literal.string(entity["value"])
+            return node
+
+        sql = skeleton.copy().transform(fill).sql(dialect=SQL_DIALECT)
+        return sql, pattern, verified
+
+    def seed(self, examples):
+        """
+        Learns the unverified templates of examples whose SQL never ran, and
+        drops the unverified templates of earlier examples that are gone.
+
+        Args:
+            examples (list): (linked question, SQL) pairs.
+
+        Returns:
+            seeded (int): Number of templates of the examples.
+        """
+        patterns = set()
+        for question, sql in examples:
+            pattern = self.learn(question, sql, verified=False)
+            if pattern is not None:
+                patterns.add(pattern)
+        with self._lock:
+            for pattern, (_, verified) in list(self._templates.items()):
+                if not verified and pattern not in patterns:
+                    del self._templates[pattern]
+        return len(patterns)
+
+    def hit(self, pattern):
+        """
+        Counts a hit once the filled SQL of a matched template answered, and
+        marks the template as verified.
+        """
+        with self._lock:
+            self._stats["hits"] += 1
+            template = self._templates.get(pattern)
+            if template is not None:
+                self._templates[pattern] = (template[0], True)
+
+    def fallback(self, pattern, discard=False):
+        """
+        Counts a fallback to the SQL generation after a matched template did
+        not answer.
+
+        Args:
+            pattern (str): Pattern of the matched template.
+            discard (bool): The filled SQL failed: drop the template.
+        """
+        with self._lock:
+            if discard:
+                self._templates.pop(pattern, None)
+            self._stats["fallbacks"] += 1
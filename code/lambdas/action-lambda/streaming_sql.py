@@ -0,0 +1,234 @@
+"""
+streaming_sql.py
+
+Streaming text-to-SQL generation with the Bedrock ConverseStream API.
+
+The SQL prompt asks for `SQLQuery:` followed by `SQLResult:` and `Answer:`
+lines, but only the statement is used. Generation stops on the `SQLResult:`
+stop sequence, and the stream is cut as soon as the text received so far holds
+a statement terminated by a semicolon outside quotes or a closing code fence
+that parses, so the query can start on Athena without waiting for the remaining
+output tokens. A semicolon is not a stop sequence, since Bedrock would stop on
+one inside a string literal. Without a terminator, the whole completion is
+parsed once the stream ends. The prompt gets cache
+checkpoints before its few-shot examples and its question, see `converse_llm`.
+"""
+
+import json
+import logging
+import time
+
+import sqlglot
+from llama_index.core.indices.struct_store.sql_retriever import NLSQLRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from sqlglot.errors import SqlglotError
+
+from converse_llm import cache_usage, prompt_content
+from metrics import record, stage
+from sql_cache import SQL_DIALECT
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+STOP_SEQUENCES = ["SQLResult:"]
+SQL_QUERY_PREFIX = "SQLQuery:"
+
+
+def _statement_end(text):
+    # end of the first statement: a semicolon outside quotes, a closing code
+    # fence or the SQLResult line; a blank line is not one, the statement may
+    # go on after it
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == ";":
+            return i
+        elif text.startswith("SQLResult:", i):
+            return i
+        elif text.startswith("```", i) and text[:i].strip():
+            return i
+    return None
+
+
+def find_complete_sql(text):
+    """
+    Returns the SQL statement of a partial completion once it is terminated and parses.
+
+    Args:
+        text (str): Completion received so far.
+
+    Returns:
+        sql (str): Complete statement, or None if more text is needed.
+    """
+    start = text.find(SQL_QUERY_PREFIX)
+    body = text[start + len(SQL_QUERY_PREFIX) :] if start != -1 else text
+    body = body.replace("```sql", "").lstrip()
+    end = _statement_end(body)
+    if end is None:
+        return None
+    sql = body[:end].strip()
+    if not sql:
+        return None
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=SQL_DIALECT) if s is not None]
+    except SqlglotError:
+        return None
+    return sql if len(statements) == 1 else None
+
+
+class StreamingSQLGenerator:
+    """
+    Generates SQL with ConverseStream, stopping as soon as a statement is complete.
+
+    Args:
+        client (boto3.client): Bedrock runtime client.
+        model_id (str): Bedrock model id.
+        max_tokens (int): Maximum number of output tokens.
+        stop_sequences (list): Stop sequences of the generation.
+        cache_boundaries (list): Prompt texts preceded by a cache checkpoint,
+            see `converse_llm.prompt_content`.
+        cache_min_tokens (int): Minimum number of tokens of a cached prefix.
+    """
+
+    def __init__(
+        self,
+        client,
+        model_id,
+        max_tokens=1024,
+        stop_sequences=None,
+        cache_boundaries=None,
+        cache_min_tokens=0,
+    ):
+        self._client = client
+        self._model_id = model_id
+        self._max_tokens = max_tokens
+        self._stop_sequences = stop_sequences or STOP_SEQUENCES
+        self._cache_boundaries = cache_boundaries or []
+        self._cache_min_tokens = cache_min_tokens
+
+    def generate(self, prompt):
+        """
+        Streams the completion of a text-to-SQL prompt.
+
+        Args:
+            prompt (str): Formatted text-to-SQL prompt.
+
+        Returns:
+            completion (str): The statement if the stream was cut, else the whole completion.
+            stats (dict): Generation statistics.
+        """
+        started = time.monotonic()
+        response = self._client.converse_stream(
+            modelId=self._model_id,
+            messages=[
+                {
+                    "role": "user",
+                    "content": prompt_content(
+                        prompt, self._cache_boundaries, self._cache_min_tokens
+                    ),
+                }
+            ],
+            inferenceConfig={
+                "maxTokens": self._max_tokens,
+                "temperature": 0,
+                "stopSequences": self._stop_sequences,
+            },
+        )
+        stream = response["stream"]
+        stats = {"model_id": self._model_id, "stop_reason": None, "first_token_ms": None}
+        completion = ""
+        try:
+            for event in stream:
+                if "contentBlockDelta" in event:
+                    if stats["first_token_ms"] is None:
+                        stats["first_token_ms"] = round((time.monotonic() - started) * 1000)
+                    completion += event["contentBlockDelta"]["delta"].get("text", "")
+                    sql = find_complete_sql(completion)
+                    if sql is not None:
+                        stats["stop_reason"] = "complete_statement"
+                        completion = sql
+                        break
+                elif "messageStop" in event:
+                    stats["stop_reason"] = event["messageStop"].get("stopReason")
+                elif "metadata" in event:
+                    stats.update(cache_usage(event["metadata"]["usage"]))
+        finally:
+            stream.close()
+
+        stats["generation_ms"] = round((time.monotonic() - started) * 1000)
+        stats["output_chars"] = len(completion)
+        record("sql_first_token", stats["first_token_ms"])
+        record("sql_generation", stats["generation_ms"])
+        logger.info(f"SQL generation stats: {json.dumps(stats)}")
+        return completion, stats
+
+
+class StreamingNLSQLRetriever(NLSQLRetriever):
+    """
+    NLSQLRetriever generating the SQL with a StreamingSQLGenerator instead of `llm.predict`.
+
+    Args:
+        sql_database (SQLDatabase): SQL database.
+        sql_generator (StreamingSQLGenerator): SQL generator.
+        **kwargs: Arguments of NLSQLRetriever.
+    """
+
+    def __init__(self, sql_database, sql_generator, **kwargs):
+        super().__init__(sql_database, **kwargs)
+        self._sql_generator = sql_generator
+
+    def _render_prompt(self, query_bundle, table_desc_str):
+        with stage("prompt_rendering"):
+            return self._text_to_sql_prompt.format(
+                query_str=query_bundle.query_str,
+                schema=table_desc_str,
+                dialect=self._sql_database.dialect,
+            )
+
+    def _generate_sql(self, query_bundle, prompt, sql_generator=None):
+        sql_generator = sql_generator or self._sql_generator
+        completion, stats = sql_generator.generate(prompt)
+        sql_query_str = self._sql_parser.parse_response_to_sql(completion, query_bundle)
+        return sql_query_str, {"sql_generation": stats}
+
+    def _error_result(self, error):
+        # if handle_sql_errors is True, then return error message
+        if not self._handle_sql_errors:
+            raise error
+        err_node = TextNode(text=f"Error: {error!s}")
+        return [NodeWithScore(node=err_node)], {}
+
+    def retrieve_with_metadata(self, str_or_query_bundle):
+        """Retrieve with metadata."""
+        if isinstance(str_or_query_bundle, str):
+            query_bundle = QueryBundle(str_or_query_bundle)
+        else:
+            query_bundle = str_or_query_bundle
+        table_desc_str = self._get_table_context(query_bundle)
+        logger.info(f"> Table desc str: {table_desc_str}")
+
+        prompt = self._render_prompt(query_bundle, table_desc_str)
+        sql_query_str, generation_metadata = self._generate_sql(query_bundle, prompt)
+        logger.debug(f"> Predicted SQL query: {sql_query_str}")
+
+        if self._sql_only:
+            retrieved_nodes = [NodeWithScore(node=TextNode(text=sql_query_str))]
+            metadata = {"result": sql_query_str}
+        else:
+            try:
+                retrieved_nodes, metadata = self._sql_retriever.retrieve_with_metadata(
+                    sql_query_str
+                )
+            except BaseException as e:
+                retrieved_nodes, metadata = self._error_result(e)
+
+        return retrieved_nodes, {
+            "sql_query": sql_query_str,
+            **generation_metadata,
+            **metadata,
+        }
@@ -0,0 +1,286 @@
+"""
+table_context.py
+
+Precomputed table context rendered into the text-to-SQL prompt.
+
+For every table of the Glue database the store holds the columns, their types
+and comments, min/max values, distinct counts, a few representative values and
+the curated `table_details` description. It is built once after the data is
+crawled (see `build_table_context.py`), serialized as JSON to the image and
+optionally to S3, and loaded at cold start, so neither SQLAlchemy reflection
+nor sample-row queries run against Athena when the Lambda starts.
+
+For the columns linked by `value_linker`, the store also holds every distinct
+value, from which the value index is built at cold start.
+"""
+
+import json
+import logging
+import os
+
+from sqlalchemy import text
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TABLE_CONTEXT_VERSION = 1
+
+# Column types whose min/max values are profiled
+ORDERED_TYPES = (
+    "tinyint",
+    "smallint",
+    "int",
+    "integer",
+    "bigint",
+    "float",
+    "double",
+    "decimal",
+    "real",
+    "date",
+    "timestamp",
+)
+# Column types whose most frequent values are profiled
+CATEGORICAL_TYPES = ("string", "varchar", "char", "boolean")
+
+
+def _base_type(column_type):
+    return column_type.split("(")[0].strip().lower()
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def profile_table(
+    connection, table_name, columns, max_values=5, link_columns=(), max_link_values=10000
+):
+    """
+    Computes the row count and per-column statistics of a table with Athena.
+
+    Args:
+        connection (sqlalchemy.engine.Connection): Connection to the database.
+        table_name (str): Table name.
+        columns (list): Dictionaries with the "name", "type" and "comment" of the columns.
+        max_values (int): Number of representative values of categorical columns.
+        link_columns (list): Names of the columns whose distinct values are all kept.
+        max_link_values (int): Columns with more distinct values are not kept.
+
+    Returns:
+        profile (dict): Dictionary with "row_count" and "columns", the columns
+            extended with "min", "max", "distinct_count", "values" and, for the
+            linked columns, "link_values".
+    """
+    selections = ["count(*)"]
+    for column in columns:
+        quoted = f'"{column["name"]}"'
+        selections.append(f"approx_distinct({quoted})")
+        if _base_type(column["type"]) in ORDERED_TYPES:
+            selections.extend([f"min({quoted})", f"max({quoted})"])
+    row = connection.execute(
+        text(f'SELECT {", ".join(selections)} FROM "{table_name}"')
+    ).one()
+
+    values = iter(row[1:])
+    profiled_columns = []
+    for column in columns:
+        profiled = dict(column, distinct_count=next(values))
+        if _base_type(column["type"]) in ORDERED_TYPES:
+            profiled["min"] = _json_value(next(values))
+            profiled["max"] = _json_value(next(values))
+        if _base_type(column["type"]) in CATEGORICAL_TYPES and max_values > 0:
+            quoted = f'"{column["name"]}"'
+            profiled["values"] = [
+                _json_value(value)
+                for (value,) in connection.execute(
+                    text(
+                        f'SELECT {quoted} FROM "{table_name}" WHERE {quoted} IS NOT NULL '
+                        f"GROUP BY {quoted} ORDER BY count(*) DESC, {quoted} LIMIT {max_values}"
+                    )
+                )
+            ]
+        if column["name"] in link_columns:
+            quoted = f'"{column["name"]}"'
+            link_values = [
+                _json_value(value)
+                for (value,) in connection.execute(
+                    text(
+                        f'SELECT DISTINCT {quoted} FROM "{table_name}" WHERE {quoted} IS NOT NULL '
+                        f"ORDER BY {quoted} LIMIT {max_link_values + 1}"
+                    )
+                )
+            ]
+            if len(link_values) <= max_link_values:
+                profiled["link_values"] = link_values
+            else:
+                logger.warning(
+                    f"{table_name}.{column['name']} has more than {max_link_values} "
+                    "distinct values, it will not be linked."
+                )
+        profiled_columns.append(profiled)
+    return {"row_count": row[0], "columns": profiled_columns}
+
+
+def build_table_context(engine, schema_provider, database, max_values=5, link_columns=()):
+    """
+    Builds the table context of every table of a Glue database.
+
+    Args:
+        engine (sqlalchemy.engine.base.Engine): SQL Alchemy engine of the database.
+        schema_provider (GlueSchemaProvider): Loaded catalog schema of the database.
+        database (str): Glue database name.
+        max_values (int): Number of representative values of categorical columns.
+        link_columns (list): "table.column" names whose distinct values are all kept.
+
+    Returns:
+        store (TableContextStore): Table context of all tables.
+    """
+    tables = {}
+    with engine.connect() as connection:
+        for name in schema_provider.tables:
+            columns = schema_provider.columns(name)
+            logger.info(f"Profiling table {name} ({len(columns)} columns).")
+            tables[name] = {
+                "description": schema_provider.description(name),
+                **profile_table(
+                    connection,
+                    name,
+                    columns,
+                    max_values=max_values,
+                    link_columns=[
+                        column.partition(".")[2]
+                        for column in link_columns
+                        if column.partition(".")[0] == name
+                    ],
+                ),
+            }
+    return TableContextStore(
+        {"version": TABLE_CONTEXT_VERSION, "database": database, "tables": tables}
+    )
+
+
+class TableContextStore:
+    """
+    Serialized table context of a database.
+
+    Args:
+        context (dict): Dictionary with "version", "database" and the "tables" context.
+    """
+
+    def __init__(self, context):
+        if context.get("version") != TABLE_CONTEXT_VERSION:
+            raise ValueError(f"Unsupported table context version: {context.get('version')}")
+        self._context = context
+
+    def __contains__(self, table_name):
+        return table_name in self._context["tables"]
+
+    @property
+    def tables(self):
+        """
+        Sorted names of the tables.
+        """
+        return sorted(self._context["tables"])
+
+    def description(self, table_name):
+        """
+        Returns the description of a table.
+        """
+        return self._context["tables"][table_name]["description"]
+
+    def columns(self, table_name):
+        """
+        Returns the profiled columns of a table.
+        """
+        return self._context["tables"][table_name]["columns"]
+
+    def link_values(self, table_name, column_name):
+        """
+        Returns every distinct value of a linked column, or None if they were not kept.
+        """
+        for column in self._context["tables"][table_name]["columns"]:
+            if column["name"] == column_name:
+                return column.get("link_values")
+        return None
+
+    def render(self, table_name):
+        """
+        Renders the schema and statistics of a table for the prompt.
+
+        Args:
+            table_name (str): Table name.
+
+        Returns:
+            table_info (str): Table description line, in the format of
+                `SQLDatabase.get_single_table_info` extended with statistics.
+        """
+        table = self._context["tables"][table_name]
+        columns = []
+        for column in table["columns"]:
+            details = [column["type"]]
+            if column.get("min") is not None:
+                details.append(f"{column['min']} to {column['max']}")
+            if column.get("distinct_count") is not None:
+                details.append(f"~{column['distinct_count']} distinct values")
+            if column.get("values"):
+                examples = ", ".join(repr(value) for value in column["values"])
+                details.append(f"e.g. {examples}")
+            column_str = f"{column['name']} ({'; '.join(details)})"
+            if column.get("comment"):
+                column_str += f": '{column['comment']}'"
+            columns.append(column_str)
+        return (
+            f"Table '{table_name}' has {table['row_count']} rows and columns: "
+            f"{', '.join(columns)}."
+        )
+
+    def to_json(self):
+        """
+        Serializes the store to a JSON string.
+        """
+        return json.dumps(self._context, indent=1, sort_keys=True)
+
+    def save(self, path):
+        """
+        Writes the store to a local file atomically.
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_json())
+        os.replace(tmp_path, path)
+
+    def upload(self, s3_resource, bucket, key):
+        """
+        Writes the store to an S3 object.
+        """
+        s3_resource.Bucket(bucket).put_object(Key=key, Body=self.to_json())
+
+
+def load_table_context(path=None, s3_resource=None, bucket=None, key=None):
+    """
+    Loads the table context from S3 when an object is given, otherwise from a local file.
+
+    Args:
+        path (str): Local file path.
+        s3_resource (boto3.resource): S3 resource.
+        bucket (str): S3 bucket of the object.
+        key (str): S3 key of the object.
+
+    Returns:
+        store (TableContextStore): The table context, or None if none could be loaded.
+    """
+    if bucket and key:
+        try:
+            body = s3_resource.Object(bucket, key).get()["Body"].read()
+            return TableContextStore(json.loads(body))
+        except Exception as e:
+            logger.warning(f"Could not load the table context from s3://{bucket}/{key}: {e}")
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return TableContextStore(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load the table context from {path}: {e}")
+    return None
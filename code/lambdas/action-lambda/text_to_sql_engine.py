@@ -0,0 +1,195 @@
+"""
+text_to_sql_engine.py
+
+Query engine translating questions to SQL and answering from the results.
+"""
+
+import logging
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.indices.struct_store import SQLTableRetrieverQueryEngine
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.retrievers import SQLRetriever
+
+from answer_renderer import render_answer, truncation_notice
+from metrics import count, set_property, stage
+from model_cascade import CascadeNLSQLRetriever
+from streaming_sql import StreamingNLSQLRetriever
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+RESPONSE_MODES = ("auto", "llm")
+
+
+class TextToSQLQueryEngine(SQLTableRetrieverQueryEngine):
+    """
+    SQLTableRetrieverQueryEngine with a deterministic fast path for the answer.
+
+    In the "auto" response mode, small and unambiguous results are rendered from
+    templates (see `answer_renderer.render_answer`) instead of being synthesized
+    by the LLM; large results, unnamed columns and SQL errors still go to the
+    LLM. The "llm" mode always synthesizes. Answers from a truncated result end
+    with a notice.
+
+    With a SQL generator, the SQL is streamed and cut as soon as the statement
+    is complete (see `streaming_sql`) instead of being generated with the LLM.
+    With a model cascade, it is streamed by the cheapest model first and by
+    stronger models when it fails (see `model_cascade`).
+
+    With a template cache, a question with the same pattern as one answered
+    before runs the SQL of that answer with its own values, without generating
+    the SQL (see `sql_template_cache`). A filled SQL that fails drops the
+    template and falls back to the SQL generation; an empty result is the
+    answer, except for a template that never returned rows (a fewshot example
+    seed), which falls back without being dropped.
+
+    Args:
+        sql_database (SQLDatabase): SQL database.
+        table_retriever (ObjectRetriever): Table retriever.
+        response_mode (str): "auto" or "llm".
+        sql_generator (StreamingSQLGenerator): SQL generator. None generates the
+            SQL with the LLM.
+        cascade (dict): Arguments of CascadeNLSQLRetriever ("sql_generators",
+            "escalate_on", "min_rows", "stats"), replacing `sql_generator`.
+        template_cache (SQLTemplateCache): SQL template cache. None always
+            generates the SQL.
+        **kwargs: Arguments of SQLTableRetrieverQueryEngine.
+    """
+
+    def __init__(
+        self,
+        sql_database,
+        table_retriever,
+        response_mode="auto",
+        sql_generator=None,
+        cascade=None,
+        template_cache=None,
+        **kwargs,
+    ):
+        if response_mode not in RESPONSE_MODES:
+            raise ValueError(f"Unknown response mode: {response_mode}")
+        super().__init__(sql_database, table_retriever, **kwargs)
+        self._response_mode = response_mode
+        self._template_cache = template_cache
+        self._template_retriever = SQLRetriever(sql_database, return_raw=True)
+        retriever_kwargs = {
+            "llm": kwargs.get("llm"),
+            "text_to_sql_prompt": kwargs.get("text_to_sql_prompt"),
+            "context_query_kwargs": kwargs.get("context_query_kwargs"),
+            "table_retriever": table_retriever,
+            "context_str_prefix": kwargs.get("context_str_prefix"),
+            "sql_only": kwargs.get("sql_only", False),
+            "callback_manager": kwargs.get("callback_manager"),
+            "verbose": kwargs.get("verbose", False),
+        }
+        if cascade is not None:
+            self._sql_retriever = CascadeNLSQLRetriever(
+                sql_database, **cascade, **retriever_kwargs
+            )
+        elif sql_generator is not None:
+            self._sql_retriever = StreamingNLSQLRetriever(
+                sql_database, sql_generator, **retriever_kwargs
+            )
+
+    def _synthesize(self, query_bundle, retrieved_nodes, metadata):
+        partial_synthesis_prompt = self._response_synthesis_prompt.partial_format(
+            sql_query=metadata["sql_query"],
+        )
+        response_synthesizer = get_response_synthesizer(
+            llm=self._llm,
+            callback_manager=self.callback_manager,
+            text_qa_template=partial_synthesis_prompt,
+            refine_template=self._refine_synthesis_prompt,
+            verbose=self._verbose,
+        )
+        with stage("response_synthesis"):
+            response = response_synthesizer.synthesize(
+                query=query_bundle.query_str,
+                nodes=retrieved_nodes,
+            )
+        response.metadata.update(metadata)
+        return response
+
+    def _retrieve_from_template(self, query_bundle):
+        """
+        Runs the SQL template of the question pattern, if any.
+
+        Returns:
+            retrieved (tuple): Result nodes and metadata, or None on a miss, an
+                error or an empty result of an unverified template.
+        """
+        if self._template_cache is None:
+            return None
+        with stage("sql_template"):
+            sql, pattern, verified = self._template_cache.match(
+                query_bundle.query_str
+            )
+        if sql is None:
+            return None
+        logger.info(f"SQL template match for {pattern!r}: {sql}")
+        try:
+            retrieved_nodes, metadata = self._template_retriever.retrieve_with_metadata(
+                sql
+            )
+        except Exception as e:
+            logger.warning(
+                f"SQL template of {pattern!r} failed, generating the SQL: {e}"
+            )
+            self._template_cache.fallback(pattern, discard=True)
+            count("sql_template_fallback")
+            logger.info(f"Template stats: {self._template_cache.stats}")
+            return None
+        if not verified:
+            if not metadata.get("result"):
+                # the seed may be wrong rather than the data missing
+                logger.info(
+                    f"Unverified SQL template of {pattern!r} returned no rows, "
+                    "generating the SQL."
+                )
+                self._template_cache.fallback(pattern)
+                count("sql_template_fallback")
+                return None
+        self._template_cache.hit(pattern)
+        count("sql_template_hit")
+        set_property("sql_source", "template")
+        logger.info(f"Template stats: {self._template_cache.stats}")
+        return retrieved_nodes, dict(metadata, sql_query=sql, sql_template=pattern)
+
+    def _query(self, query_bundle):
+        """Answer a query."""
+        if not self._synthesize_response or self._streaming:
+            return super()._query(query_bundle)
+
+        retrieved = self._retrieve_from_template(query_bundle)
+        if retrieved is None:
+            retrieved_nodes, metadata = self.sql_retriever.retrieve_with_metadata(
+                query_bundle
+            )
+            if self._template_cache is not None and metadata.get("result"):
+                self._template_cache.learn(
+                    query_bundle.query_str, metadata["sql_query"]
+                )
+        else:
+            retrieved_nodes, metadata = retrieved
+
+        answer = None
+        if self._response_mode == "auto" and "result" in metadata:
+            answer = render_answer(metadata.get("col_keys"), metadata["result"])
+        if answer is not None:
+            logger.info("Rendered the answer from the result without the LLM.")
+            metadata["response_mode"] = "template"
+            set_property("response_mode", "template")
+            response = Response(
+                response=answer, source_nodes=retrieved_nodes, metadata=metadata
+            )
+        else:
+            metadata["response_mode"] = "llm"
+            set_property("response_mode", "llm")
+            response = self._synthesize(query_bundle, retrieved_nodes, metadata)
+
+        notice = truncation_notice(metadata)
+        if notice is not None:
+            response.response = f"{response.response}\n\n{notice}"
+        return response
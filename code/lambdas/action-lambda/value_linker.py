@@ -0,0 +1,224 @@
+"""
+value_linker.py
+
+Links the column values mentioned in a question to their canonical form.
+
+At cold start an index of the distinct values of a few key columns, e.g.
+`ec2_pricing.instance_name`, is built. Mentions in the question are matched
+against it after normalization (lower case, letters and digits only), so
+"p32xlarge", "P3 2xlarge" and "p3.2xlarge" all link to 'p3.2xlarge'. A mention
+without an exact match links to the single value within one edit of it, found
+through a trigram index. The question is rewritten with the canonical values
+before prompting, so the generated SQL filters on values that exist.
+"""
+
+import logging
+import re
+import threading
+from collections import defaultdict
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Words of a question, keeping dotted, dashed and underscored names whole
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[._-][A-Za-z0-9]+)*")
+
+
+def normalize(text):
+    """
+    Returns the lower-case letters and digits of a text, the key values and
+    mentions are matched on.
+    """
+    return re.sub(r"[^0-9a-z]", "", text.lower())
+
+
+def trigrams(key):
+    """
+    Returns the set of character trigrams of a normalized key.
+    """
+    return {key[i : i + 3] for i in range(len(key) - 2)}
+
+
+def within_one_edit(a, b):
+    """
+    Returns True if two strings differ by at most one insertion, deletion,
+    substitution or transposition of adjacent characters.
+    """
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return (
+            a[i + 1 :] == b[i + 1 :]
+            or (a[i + 2 :] == b[i + 2 :] and a[i : i + 2] == b[i : i + 2][::-1])
+        )
+    return a[i:] == b[i + 1 :]
+
+
+class ValueLinker:
+    """
+    Index of the distinct values of key columns, rewriting the mentions of
+    these values in a question to their canonical form.
+
+    Args:
+        values (dict): Distinct values of each column, keyed by "table.column".
+        min_length (int): Mentions with a shorter normalized key are not linked.
+        fuzzy_min_length (int): Mentions with a shorter normalized key are only
+            linked on an exact match.
+        max_span_tokens (int): Number of consecutive words a mention may span,
+            e.g. 2 for "p3 8xlarge".
+    """
+
+    def __init__(self, values, min_length=3, fuzzy_min_length=6, max_span_tokens=3):
+        self._min_length = min_length
+        self._fuzzy_min_length = fuzzy_min_length
+        self._max_span_tokens = max_span_tokens
+        # normalized key -> {canonical value: column}
+        self._values = defaultdict(dict)
+        self._trigrams = defaultdict(set)
+        for column, column_values in values.items():
+            for value in column_values:
+                if not isinstance(value, str):
+                    continue
+                key = normalize(value)
+                if len(key) < min_length:
+                    continue
+                self._values[key].setdefault(value, column)
+                for trigram in trigrams(key):
+                    self._trigrams[trigram].add(key)
+        # link() runs from the threads answering the sub-questions of a request
+        self._lock = threading.Lock()
+        self._stats = {"questions": 0, "exact": 0, "fuzzy": 0}
+
+    @property
+    def stats(self):
+        """
+        Returns a copy of the counters of linked questions and mentions.
+        """
+        with self._lock:
+            return dict(self._stats)
+
+    def __len__(self):
+        return len(self._values)
+
+    def _exact(self, key):
+        candidates = self._values.get(key)
+        if candidates is None or len(candidates) != 1:
+            # unknown, or ambiguous once normalized
+            return None
+        return next(iter(candidates.items()))
+
+    def _fuzzy(self, key):
+        # an edit changes at most three trigrams of the key, a transposition four
+        key_trigrams = trigrams(key)
+        shared = defaultdict(int)
+        for trigram in key_trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        matches = {
+            value: column
+            for candidate, count in shared.items()
+            if count >= len(key_trigrams) - 4 and within_one_edit(key, candidate)
+            for value, column in self._values[candidate].items()
+        }
+        if len(matches) != 1:
+            return None
+        return next(iter(matches.items()))
+
+    def _match(self, question, tokens, start):
+        """
+        Returns the longest mention starting at a token, as the number of tokens,
+        the canonical value, its column and "exact" or "fuzzy", or None.
+        """
+        spans = [tokens[start : start + 1]]
+        for end in range(start + 1, min(start + self._max_span_tokens, len(tokens))):
+            # mentions span words separated by spaces only
+            if not question[tokens[end - 1].end() : tokens[end].start()].isspace():
+                break
+            spans.append(tokens[start : end + 1])
+        for span in reversed(spans):
+            key = normalize("".join(token.group() for token in span))
+            if len(key) >= self._min_length:
+                match = self._exact(key)
+                if match is not None:
+                    return (len(span), *match, "exact")
+        for span in reversed(spans):
+            key = normalize("".join(token.group() for token in span))
+            # typos are only corrected in code-like words, not in prose
+            if len(key) >= self._fuzzy_min_length and all(
+                any(c.isdigit() for c in token.group()) for token in span
+            ):
+                match = self._fuzzy(key)
+                if match is not None:
+                    return (len(span), *match, "fuzzy")
+        return None
+
+    def find(self, question):
+        """
+        Finds the mentions of indexed values in a question, canonical or not.
+
+        Args:
+            question (str): User question.
+
+        Returns:
+            mentions (list): Dictionaries with the "start" and "end" offsets of
+                the "mention", its canonical "value", the "column" and the
+                "match" ("exact" or "fuzzy"), in the order of the question.
+        """
+        tokens = list(TOKEN_PATTERN.finditer(question))
+        mentions = []
+        i = 0
+        while i < len(tokens):
+            match = self._match(question, tokens, i)
+            if match is None:
+                i += 1
+                continue
+            length, value, column, kind = match
+            start, end = tokens[i].start(), tokens[i + length - 1].end()
+            mentions.append(
+                {
+                    "start": start,
+                    "end": end,
+                    "mention": question[start:end],
+                    "value": value,
+                    "column": column,
+                    "match": kind,
+                }
+            )
+            i += length
+        return mentions
+
+    def link(self, question):
+        """
+        Rewrites the mentions of indexed values in a question to their canonical form.
+
+        Args:
+            question (str): User question.
+
+        Returns:
+            linked_question (str): The question with the canonical values.
+            links (list): Dictionaries with the "mention", its canonical "value",
+                the "column" and the "match" ("exact" or "fuzzy"), for the
+                mentions that were rewritten.
+        """
+        parts, links = [], []
+        position = 0
+        for mention in self.find(question):
+            if mention["mention"] == mention["value"]:
+                continue
+            parts.extend([question[position : mention["start"]], mention["value"]])
+            position = mention["end"]
+            links.append(
+                {key: mention[key] for key in ("mention", "value", "column", "match")}
+            )
+        parts.append(question[position:])
+        with self._lock:
+            self._stats["questions"] += 1
+            for link in links:
+                self._stats[link["match"]] += 1
+        return "".join(parts), links
@@ -0,0 +1,73 @@
+"""
+Deterministic answers of small SQL results, see `answer_renderer.render_answer`:
+
+    python -m pytest tests/unit/test_answer_renderer.py
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from answer_renderer import NO_DATA_ANSWER, render_answer  # noqa: E402
+
+
+def test_no_rows():
+    assert render_answer(["instance_name"], []) == NO_DATA_ANSWER
+
+
+def test_single_text_value():
+    # e.g. the cheapest instance, SELECT instance_name ... LIMIT 1
+    assert render_answer(["instance_name"], [("p3.2xlarge",)]) == (
+        "According to the latest information, the instance name is p3.2xlarge."
+    )
+
+
+def test_single_number():
+    assert render_answer(["on_demand_hourly_price"], [(3.06,)]) == (
+        "According to the latest information, the on demand hourly price is \\$3.06."
+    )
+    assert render_answer(["instance_count"], [(1200,)]) == (
+        "According to the latest information, the instance count is 1,200."
+    )
+
+
+def test_single_row_named_by_its_text_column():
+    answer = render_answer(
+        ["instance_name", "number_vcpus", "on_demand_hourly_price"],
+        [("p3.2xlarge", 8, 3.06)],
+    )
+    assert answer == (
+        "According to the latest information, for p3.2xlarge the number vcpus "
+        "is 8 and the on demand hourly price is \\$3.06."
+    )
+
+
+def test_single_row_of_several_text_columns():
+    answer = render_answer(["instance_name", "region"], [("p3.2xlarge", "us-east-1")])
+    assert answer == (
+        "According to the latest information, the instance name is p3.2xlarge "
+        "and the region is us-east-1."
+    )
+
+
+def test_rows_as_table():
+    answer = render_answer(
+        ["instance_name", "on_demand_hourly_price"],
+        [("p3.2xlarge", 3.06), ("a|b", None)],
+    )
+    assert answer == (
+        "According to the latest information:\n\n"
+        "| Instance name | On demand hourly price |\n"
+        "| --- | --- |\n"
+        "| p3.2xlarge | \\$3.06 |\n"
+        "| a\\|b | not available |"
+    )
+
+
+def test_left_to_the_llm():
+    assert render_answer(["_col0"], [(1,)]) is None
+    assert render_answer(["a"], [(i,) for i in range(21)]) is None
+    assert render_answer([f"c{i}" for i in range(7)], [tuple(range(7))]) is None
@@ -0,0 +1,63 @@
+"""
+File tier of the embedding cache, see `embedding_cache.TieredEmbeddingCache`:
+
+    python -m pytest tests/unit/test_embedding_cache.py
+"""
+
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from embedding_cache import TieredEmbeddingCache  # noqa: E402
+
+VECTOR = [0.5] * 256  # 1 KiB as float32
+
+
+def file_cache(cache_dir, **kwargs):
+    # no in-process tier, every lookup reads the files
+    return TieredEmbeddingCache(
+        "model", max_entries=0, cache_dir=str(cache_dir), **kwargs
+    )
+
+
+def test_file_hit(tmp_path):
+    file_cache(tmp_path).put("question", {"k": VECTOR})
+    cache = file_cache(tmp_path)
+    assert next(iter(cache.get("question").values())) == VECTOR
+    assert cache.stats["file_hits"] == 1
+
+
+def test_oldest_files_are_evicted(tmp_path):
+    cache = file_cache(tmp_path, max_file_bytes=3 * 1024)
+    for i in range(5):
+        cache.put(f"question {i}", {"k": VECTOR})
+    assert cache.get("question 0") is None
+    assert cache.get("question 4") is not None
+    assert cache.stats["file_evictions"] == 2
+    files = [f for _, _, names in os.walk(tmp_path) for f in names]
+    assert len(files) == 3
+    # the capacity also holds for the files of earlier invocations
+    assert file_cache(tmp_path, max_file_bytes=1024).stats["file_evictions"] == 2
+
+
+def test_torn_file_is_a_miss(tmp_path):
+    cache = file_cache(tmp_path)
+    cache.put("question", {"k": VECTOR})
+    (path,) = [Path(d) / f for d, _, names in os.walk(tmp_path) for f in names]
+    path.write_bytes(b"\0" * 7)
+    assert cache.get("question") is None
+    assert cache.stats["file_errors"] == 1
+    assert not path.exists()
+
+
+def test_write_error_is_not_raised(tmp_path):
+    cache = file_cache(tmp_path)
+    # a file where the shard directory should be, as a stand-in for a full disk
+    (tmp_path / cache._digest("question")[:2]).write_bytes(b"")
+    cache.put("question", {"k": VECTOR})
+    assert cache.stats["file_errors"] == 1
+    assert cache.get("question") is None
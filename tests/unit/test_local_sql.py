@@ -0,0 +1,119 @@
+"""
+Constructs whose results differ between Trino (Athena) and DuckDB unless the
+local SQL tier transpiles them, run on DuckDB and, when
+LOCAL_SQL_TEST_ATHENA_OUTPUT is set to an S3 URI for the query results, on
+Athena too (with AWS credentials and AWS_REGION set):
+
+    python -m pytest tests/unit/test_local_sql.py
+"""
+
+import os
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from local_sql import transpile_to_duckdb  # noqa: E402
+
+duckdb = pytest.importorskip("duckdb")
+
+# inline table, so that the statements run on both engines without any data
+TABLE = (
+    "WITH t AS (SELECT * FROM (VALUES (5, 2, 2.5, NULL), (-7, 2, 1.0, 3)) "
+    "AS v(a, b, price, n)) "
+)
+
+# statements and their Trino results
+CASES = [
+    # integer division truncates towards zero
+    ("SELECT a / b FROM t ORDER BY a", [(-3,), (2,)]),
+    ("SELECT COUNT(*) / 3, SUM(a) / 2 FROM t", [(0, -1)]),
+    ("SELECT COUNT(*) OVER () / 3 FROM t", [(0,), (0,)]),
+    ("SELECT (a / b) / 2 FROM t ORDER BY a", [(-1,), (1,)]),
+    ("SELECT a FROM t WHERE a / 2 = 2", [(5,)]),
+    # any non-integer operand divides as a decimal or a double
+    ("SELECT a / price FROM t ORDER BY a", [(-7,), (2,)]),
+    (
+        "SELECT CAST(a AS DOUBLE) / b, a / 2.0 FROM t ORDER BY a",
+        [(-3.5, -3.5), (2.5, 2.5)],
+    ),
+    ("SELECT AVG(a) / 2 FROM t", [(-0.5,)]),
+    # remainder has the sign of the dividend, NULLs sort last both ways
+    ("SELECT a % b FROM t ORDER BY a", [(-1,), (1,)]),
+    ("SELECT n FROM t ORDER BY n DESC", [(3,), (None,)]),
+    ("SELECT n FROM t ORDER BY n", [(3,), (None,)]),
+]
+
+
+def normalize(rows):
+    # numbers compare by value, whatever their type and rendering
+    return [
+        tuple(
+            None if value is None else Decimal(str(value)).normalize() for value in row
+        )
+        for row in rows
+    ]
+
+
+def run_athena(sql):
+    import boto3
+
+    client = boto3.client("athena", region_name=os.environ["AWS_REGION"])
+    query_id = client.start_query_execution(
+        QueryString=sql,
+        ResultConfiguration={
+            "OutputLocation": os.environ["LOCAL_SQL_TEST_ATHENA_OUTPUT"]
+        },
+    )["QueryExecutionId"]
+    while True:
+        status = client.get_query_execution(QueryExecutionId=query_id)
+        state = status["QueryExecution"]["Status"]["State"]
+        if state not in ("QUEUED", "RUNNING"):
+            break
+        time.sleep(0.5)
+    assert state == "SUCCEEDED", status["QueryExecution"]["Status"]
+    rows = client.get_query_results(QueryExecutionId=query_id)["ResultSet"]["Rows"]
+    return [tuple(cell.get("VarCharValue") for cell in row["Data"]) for row in rows[1:]]
+
+
+@pytest.mark.parametrize("sql, expected", CASES)
+def test_duckdb_matches_trino(sql, expected):
+    duckdb_sql, _ = transpile_to_duckdb(TABLE + sql)
+    rows = duckdb.connect().execute(duckdb_sql).fetchall()
+    assert normalize(rows) == normalize(expected)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("LOCAL_SQL_TEST_ATHENA_OUTPUT"),
+    reason="LOCAL_SQL_TEST_ATHENA_OUTPUT is not set",
+)
+@pytest.mark.parametrize("sql, expected", CASES)
+def test_athena_matches_trino(sql, expected):
+    assert normalize(run_athena(TABLE + sql)) == normalize(expected)
+
+
+@pytest.mark.parametrize(
+    "sql, schema",
+    [
+        # operand types unknown without the schema of the table
+        ("SELECT a / 2 FROM db.t", None),
+        ("SELECT missing / 2 FROM t", {"t": {"a": "INTEGER"}}),
+    ],
+)
+def test_untyped_division_goes_to_athena(sql, schema):
+    with pytest.raises(ValueError):
+        transpile_to_duckdb(sql, schema=schema)
+
+
+def test_integer_division_with_schema():
+    duckdb_sql, tables = transpile_to_duckdb(
+        "SELECT a / b FROM db.t", schema={"t": {"a": "INTEGER", "b": "BIGINT"}}
+    )
+    assert tables == {"t"}
+    assert "//" in duckdb_sql
@@ -0,0 +1,62 @@
+"""
+Semantic answer cache and its file backend, see `semantic_cache`:
+
+    python -m pytest tests/unit/test_semantic_cache.py
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from semantic_cache import FileBackend, SemanticCache  # noqa: E402
+
+
+def reloaded(cache, *lookup):
+    # the first lookup starts the background reload
+    cache.lookup(*lookup)
+    deadline = time.monotonic() + 5
+    while cache._reloading and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return cache.lookup(*lookup)
+
+
+def test_entities_must_match(tmp_path):
+    cache = SemanticCache(FileBackend(str(tmp_path)))
+    cache.lookup([1.0, 0.0], "v1")
+    cache.store(
+        "price of p3.8xlarge", [1.0, 0.0], "sql", "answer", "v1", ["p3.8xlarge"]
+    )
+    assert cache.lookup([1.0, 0.0], "v1", ["p3.2xlarge"]) is None
+    assert cache.lookup([1.0, 0.0], "v1", ["p3.8xlarge"])["answer"] == "answer"
+
+
+def test_reload_keeps_the_newest_entries_of_the_version(tmp_path):
+    writer = SemanticCache(FileBackend(str(tmp_path)), max_entries=10)
+    for i in range(4):
+        writer.store(f"question {i}", [1.0, i / 10], "sql", f"answer {i}", "v1")
+        time.sleep(0.01)
+    writer.store("question", [1.0, 0.3], "sql", "old answer", "v0")
+
+    reader = SemanticCache(FileBackend(str(tmp_path)), max_entries=2)
+    assert reloaded(reader, [1.0, 0.3], "v1")["answer"] == "answer 3"
+    assert reader.stats["entries"] == 2
+    # entries of other versions are skipped
+    assert reader.lookup([1.0, 0.0], "v1") is not None
+    assert reader.lookup([1.0, 0.3], "v1")["data_version"] == "v1"
+
+
+def test_expired_entries_are_purged(tmp_path):
+    writer = SemanticCache(FileBackend(str(tmp_path)), ttl=60)
+    writer.store("question", [1.0, 0.0], "sql", "answer", "v0")
+    for root, _, names in os.walk(tmp_path):
+        for name in names:
+            os.utime(os.path.join(root, name), (0, 0))
+
+    reader = SemanticCache(FileBackend(str(tmp_path)), ttl=60)
+    assert reloaded(reader, [1.0, 0.0], "v1") is None
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names]
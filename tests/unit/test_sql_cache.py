@@ -0,0 +1,88 @@
+"""
+Canonical SQL and cache keys of the SQL result cache, see `sql_cache`:
+
+    python -m pytest tests/unit/test_sql_cache.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from sql_cache import SQLResultCache, canonicalize_sql, referenced_tables  # noqa: E402
+
+
+def key(sql, data_version="v1"):
+    return SQLResultCache.make_key(canonicalize_sql(sql), data_version)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        # whitespace, keyword case and the trailing semicolon
+        "select  instance_name\nfrom ec2_pricing where vcpus in ('8', '4');",
+        # order of the IN-list values
+        "SELECT instance_name FROM ec2_pricing WHERE vcpus IN ('8','4')",
+        # identifier case
+        "SELECT INSTANCE_NAME FROM EC2_PRICING WHERE VCPUS IN ('4', '8')",
+    ],
+)
+def test_equivalent_sql_same_key(sql):
+    reference = "SELECT instance_name FROM ec2_pricing WHERE vcpus IN ('4', '8')"
+    assert canonicalize_sql(sql) == canonicalize_sql(reference)
+    assert key(sql) == key(reference)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT instance_name FROM ec2_pricing WHERE vcpus IN ('4', '16')",
+        # string literals are case sensitive
+        "SELECT instance_name FROM ec2_pricing WHERE instance_name = 'P3.2xlarge'",
+        "SELECT instance_name FROM ec2_pricing WHERE vcpus IN ('4', '8') LIMIT 10",
+    ],
+)
+def test_different_sql_different_key(sql):
+    reference = "SELECT instance_name FROM ec2_pricing WHERE vcpus IN ('4', '8')"
+    assert key(sql) != key(reference)
+
+
+def test_literal_case_kept():
+    assert canonicalize_sql("select a from t where b = 'X'") == (
+        "SELECT a FROM t WHERE b = 'X'"
+    )
+
+
+def test_data_version_in_key():
+    sql = "SELECT instance_name FROM ec2_pricing"
+    assert key(sql, "v1") != key(sql, "v2")
+
+
+def test_unparsable_sql_whitespace_normalized():
+    assert canonicalize_sql("SELECT 1;  SELECT 2 ;") == canonicalize_sql(
+        "SELECT 1; SELECT 2"
+    )
+
+
+def test_referenced_tables_without_ctes():
+    assert referenced_tables(
+        "WITH cheap AS (SELECT instance_name FROM ec2_pricing) "
+        "SELECT c.instance_name FROM cheap c JOIN instance_types i "
+        "ON c.instance_name = i.instance_name"
+    ) == ["ec2_pricing", "instance_types"]
+
+
+def test_cache_hit_after_put():
+    cache = SQLResultCache(max_entries=1)
+    first, second = key("SELECT a FROM t"), key("SELECT b FROM t")
+    assert cache.get(first) is None
+    cache.put(first, "result")
+    assert cache.get(key("select a  from t;")) == "result"
+    cache.put(second, "other")
+    assert cache.get(first) is None
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 2
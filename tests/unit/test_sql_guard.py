@@ -0,0 +1,105 @@
+"""
+LIMIT injection and statement checks of the SQL guard, see `sql_guard.SQLGuard`:
+
+    python -m pytest tests/unit/test_sql_guard.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from sql_guard import SQLGuard, SQLGuardError  # noqa: E402
+
+
+@pytest.fixture
+def guard():
+    return SQLGuard(max_rows=100)
+
+
+def test_limit_injected(guard):
+    assert guard.rewrite("select instance_name from ec2_pricing") == (
+        "SELECT instance_name FROM ec2_pricing LIMIT 100"
+    )
+
+
+def test_smaller_limit_kept(guard):
+    assert guard.rewrite("SELECT instance_name FROM ec2_pricing LIMIT 10") == (
+        "SELECT instance_name FROM ec2_pricing LIMIT 10"
+    )
+
+
+def test_larger_limit_capped(guard):
+    assert guard.rewrite("SELECT instance_name FROM ec2_pricing LIMIT 5000;") == (
+        "SELECT instance_name FROM ec2_pricing LIMIT 100"
+    )
+
+
+def test_subquery_limit_left_alone(guard):
+    # only the outer query bounds the returned rows
+    assert guard.rewrite(
+        "SELECT instance_name FROM (SELECT instance_name FROM ec2_pricing LIMIT 5000) s"
+    ) == (
+        "SELECT instance_name FROM (SELECT instance_name FROM ec2_pricing LIMIT 5000)"
+        " AS s LIMIT 100"
+    )
+    assert guard.rewrite(
+        "SELECT instance_name FROM ec2_pricing WHERE instance_name IN "
+        "(SELECT instance_name FROM instance_types)"
+    ).endswith(") LIMIT 100")
+
+
+def test_union_limited_as_a_whole(guard):
+    sql = guard.rewrite(
+        "SELECT instance_name FROM ec2_pricing UNION ALL "
+        "SELECT instance_name FROM instance_types"
+    )
+    assert sql == (
+        "SELECT instance_name FROM ec2_pricing UNION ALL "
+        "SELECT instance_name FROM instance_types LIMIT 100"
+    )
+    assert sql.count("LIMIT") == 1
+    assert guard.rewrite(
+        "SELECT instance_name FROM ec2_pricing UNION "
+        "SELECT instance_name FROM instance_types LIMIT 10"
+    ).endswith("instance_types LIMIT 10")
+
+
+def test_with_query_limited(guard):
+    assert guard.rewrite(
+        "WITH cheap AS (SELECT instance_name FROM ec2_pricing) "
+        "SELECT instance_name FROM cheap"
+    ) == (
+        "WITH cheap AS (SELECT instance_name FROM ec2_pricing) "
+        "SELECT instance_name FROM cheap LIMIT 100"
+    )
+
+
+def test_no_limit_without_max_rows():
+    assert SQLGuard(max_rows=0).rewrite("SELECT instance_name FROM ec2_pricing") == (
+        "SELECT instance_name FROM ec2_pricing"
+    )
+
+
+@pytest.mark.parametrize(
+    "sql, message",
+    [
+        ("SELECT * FROM ec2_pricing", "SELECT *"),
+        ("SELECT p.* FROM ec2_pricing p", "SELECT *"),
+        ("DROP TABLE ec2_pricing", "Only SELECT"),
+        ("INSERT INTO ec2_pricing SELECT instance_name FROM u", "Only SELECT"),
+        ("SELECT 1; SELECT 2", "single SQL statement"),
+        ("SELEC instance_name FRM ec2_pricing", "could not be parsed"),
+    ],
+)
+def test_refused(guard, sql, message):
+    with pytest.raises(SQLGuardError, match=message):
+        guard.rewrite(sql)
+
+
+def test_scan_not_checked_without_estimator(guard):
+    assert guard.check_scan("SELECT instance_name FROM ec2_pricing LIMIT 100") is None
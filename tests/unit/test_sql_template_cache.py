@@ -0,0 +1,143 @@
+"""
+Learning, matching and discarding of SQL templates, see
+`sql_template_cache.SQLTemplateCache`:
+
+    python -m pytest tests/unit/test_sql_template_cache.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from sql_template_cache import SQLTemplateCache  # noqa: E402
+from value_linker import ValueLinker  # noqa: E402
+
+PRICE_SQL = (
+    "SELECT on_demand_hourly_price FROM ec2_pricing "
+    "WHERE instance_name = 'p3.8xlarge'"
+)
+
+
+@pytest.fixture
+def cache():
+    linker = ValueLinker(
+        {"ec2_pricing.instance_name": ["p3.8xlarge", "c5.4xlarge", "m5.large"]}
+    )
+    return SQLTemplateCache(value_linker=linker)
+
+
+def test_learn_and_match(cache):
+    pattern = cache.learn("How much is p3.8xlarge per hour?", PRICE_SQL)
+    assert pattern == "how much is {ec2_pricing.instance_name} per hour"
+    sql, matched, verified = cache.match("how much is c5.4xlarge per hour")
+    assert sql == (
+        "SELECT on_demand_hourly_price FROM ec2_pricing "
+        "WHERE instance_name = 'c5.4xlarge'"
+    )
+    assert (matched, verified) == (pattern, True)
+
+
+def test_numbers_filled(cache):
+    cache.learn(
+        "Which instances have more than 8 vCPUs?",
+        "SELECT instance_name FROM ec2_pricing WHERE vcpus > 8",
+    )
+    sql, _, _ = cache.match("Which instances have more than 64 vCPUs?")
+    assert sql == "SELECT instance_name FROM ec2_pricing WHERE vcpus > 64"
+
+
+def test_miss(cache):
+    cache.learn("How much is p3.8xlarge per hour?", PRICE_SQL)
+    sql, pattern, _ = cache.match("How many vCPUs has c5.4xlarge?")
+    assert sql is None
+    assert pattern == "how many vcpus has {ec2_pricing.instance_name}"
+    assert cache.stats["misses"] == 1
+
+
+@pytest.mark.parametrize(
+    "question, sql",
+    [
+        # the entity is not a literal of the SQL
+        (
+            "How much is c5.4xlarge per hour?",
+            PRICE_SQL,
+        ),
+        # a number used twice cannot be filled unambiguously
+        (
+            "Instances with 8 vCPUs",
+            "SELECT instance_name FROM ec2_pricing WHERE vcpus = 8 OR gpus = 8",
+        ),
+        # two entities with the same value
+        (
+            "Compare m5.large and m5.large",
+            "SELECT instance_name FROM ec2_pricing WHERE instance_name = 'm5.large'",
+        ),
+        ("How much is p3.8xlarge per hour?", "not SQL at all ("),
+    ],
+)
+def test_not_learned(cache, question, sql):
+    assert cache.learn(question, sql) is None
+    assert cache.stats["entries"] == 0
+
+
+def test_hit_counted_after_success(cache):
+    pattern = cache.learn("How much is p3.8xlarge per hour?", PRICE_SQL)
+    cache.match("How much is m5.large per hour?")
+    assert cache.stats["hits"] == 0
+    cache.hit(pattern)
+    assert cache.stats["hits"] == 1
+    assert cache.stats["hit_rate"] == 1.0
+
+
+def test_discard_on_failure(cache):
+    pattern = cache.learn("How much is p3.8xlarge per hour?", PRICE_SQL)
+    cache.match("How much is m5.large per hour?")
+    cache.fallback(pattern, discard=True)
+    assert cache.match("How much is m5.large per hour?")[0] is None
+    stats = cache.stats
+    assert (stats["hits"], stats["fallbacks"], stats["misses"]) == (0, 1, 1)
+    assert stats["entries"] == 0
+
+
+def test_unverified_seed(cache):
+    assert cache.seed([("How much is p3.8xlarge per hour?", PRICE_SQL)]) == 1
+    sql, pattern, verified = cache.match("How much is m5.large per hour?")
+    assert sql is not None and not verified
+    # an empty result falls back without dropping the seed
+    cache.fallback(pattern)
+    assert cache.match("How much is m5.large per hour?")[2] is False
+    cache.hit(pattern)
+    assert cache.match("How much is m5.large per hour?")[2] is True
+    assert cache.stats["unverified"] == 0
+
+
+def test_seed_does_not_replace_verified(cache):
+    verified_sql = PRICE_SQL.replace("on_demand_hourly_price", "price")
+    cache.learn("How much is p3.8xlarge per hour?", verified_sql)
+    cache.seed([("How much is p3.8xlarge per hour?", PRICE_SQL)])
+    sql, _, verified = cache.match("How much is c5.4xlarge per hour?")
+    assert verified and sql.startswith("SELECT price FROM")
+
+
+def test_reseed_drops_removed_examples(cache):
+    cache.seed([("How much is p3.8xlarge per hour?", PRICE_SQL)])
+    cache.learn(
+        "Which instances have more than 8 vCPUs?",
+        "SELECT instance_name FROM ec2_pricing WHERE vcpus > 8",
+    )
+    assert cache.seed([]) == 0
+    assert cache.match("How much is m5.large per hour?")[0] is None
+    assert cache.match("Which instances have more than 4 vCPUs?")[0] is not None
+
+
+def test_least_recently_used_evicted():
+    cache = SQLTemplateCache(max_entries=1)
+    cache.learn("top 5 instances", "SELECT instance_name FROM t LIMIT 5")
+    cache.learn("instances with 8 vcpus", "SELECT instance_name FROM t WHERE v = 8")
+    assert cache.match("top 3 instances")[0] is None
+    assert cache.match("instances with 4 vcpus")[0] is not None
@@ -0,0 +1,57 @@
+"""
+Cuts of a streamed SQL completion, see `streaming_sql.find_complete_sql`:
+
+    python -m pytest tests/unit/test_streaming_sql.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from streaming_sql import STOP_SEQUENCES, find_complete_sql  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "completion",
+    [
+        # the statement goes on after a blank line, the cut would drop a clause
+        "SELECT a FROM t\n\nWHERE b > 1 ORDER BY a\n",
+        "SQLQuery: SELECT instance_name, price\n\nFROM ec2_pricing\n",
+        # no terminator yet
+        "SELECT a FROM t WHERE b > 1",
+        "SELECT a FROM t WHERE name = 'x;",
+        "```sql\nSELECT a FROM t",
+    ],
+)
+def test_incomplete_statement_is_not_cut(completion):
+    assert find_complete_sql(completion) is None
+
+
+@pytest.mark.parametrize(
+    "completion, sql",
+    [
+        (
+            "SQLQuery: SELECT a\nFROM t\n\nWHERE b > 1;\nSQLResult:",
+            "SELECT a\nFROM t\n\nWHERE b > 1",
+        ),
+        (
+            "SELECT name FROM t WHERE name = 'a;b' AND c = \"x;y\";",
+            "SELECT name FROM t WHERE name = 'a;b' AND c = \"x;y\"",
+        ),
+        ("SELECT 'it''s;' AS s FROM t;", "SELECT 'it''s;' AS s FROM t"),
+        ("```sql\nSELECT a\n\nFROM t\n```\nThe query", "SELECT a\n\nFROM t"),
+        ("SQLQuery: SELECT a FROM t\nSQLResult: [(1,)]", "SELECT a FROM t"),
+    ],
+)
+def test_terminated_statement_is_cut(completion, sql):
+    assert find_complete_sql(completion) == sql
+
+
+def test_semicolon_is_not_a_stop_sequence():
+    # Bedrock would stop inside a string literal
+    assert ";" not in STOP_SEQUENCES
@@ -0,0 +1,104 @@
+"""
+Linking of the values mentioned in questions, see `value_linker.ValueLinker`:
+
+    python -m pytest tests/unit/test_value_linker.py
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[2] / "code" / "lambdas" / "action-lambda")
+)
+
+from value_linker import ValueLinker, within_one_edit  # noqa: E402
+
+INSTANCE_NAMES = ["p3.2xlarge", "p3.8xlarge", "c5.4xlarge", "m5.large", "m5.xlarge"]
+
+
+@pytest.fixture
+def linker():
+    return ValueLinker({"ec2_pricing.instance_name": INSTANCE_NAMES})
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("p32xlarge", "p32xlarge"),
+        ("p32xlarge", "p32xlarg"),  # deletion
+        ("p32xlarge", "p32xxlarge"),  # insertion
+        ("p32xlarge", "p38xlarge"),  # substitution
+        ("p32xlarge", "3p2xlarge"),  # transposition
+    ],
+)
+def test_within_one_edit(a, b):
+    assert within_one_edit(a, b)
+    assert within_one_edit(b, a)
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        ("p32xlarge", "p3xlarg"),  # two deletions
+        ("p32xlarge", "p38xlarga"),  # two substitutions
+        ("p32xlarge", "2p3xlarge"),  # transposition of distant characters
+    ],
+)
+def test_not_within_one_edit(a, b):
+    assert not within_one_edit(a, b)
+
+
+@pytest.mark.parametrize(
+    "question", ["price of p32xlarge", "price of P3 2xlarge", "price of p3.2xlarge"]
+)
+def test_exact_match_after_normalization(linker, question):
+    mentions = linker.find(question)
+    assert [(m["value"], m["match"]) for m in mentions] == [("p3.2xlarge", "exact")]
+
+
+def test_fuzzy_match_within_one_edit(linker):
+    linked, links = linker.link("How much is c5.4xlarg per hour?")
+    assert linked == "How much is c5.4xlarge per hour?"
+    assert links == [
+        {
+            "mention": "c5.4xlarg",
+            "value": "c5.4xlarge",
+            "column": "ec2_pricing.instance_name",
+            "match": "fuzzy",
+        }
+    ]
+    assert linker.stats == {"questions": 1, "exact": 0, "fuzzy": 1}
+
+
+def test_canonical_mention_not_rewritten(linker):
+    assert linker.link("How much is p3.8xlarge per hour?") == (
+        "How much is p3.8xlarge per hour?",
+        [],
+    )
+
+
+def test_ambiguous_fuzzy_match_not_linked(linker):
+    # one edit away from both p3.2xlarge and p3.8xlarge
+    assert linker.find("price of p3.4xlarge") == []
+
+
+def test_prose_typo_not_linked():
+    linker = ValueLinker({"ec2_pricing.region": ["us-east-1", "Europe"]})
+    # words without digits are only linked on an exact match
+    assert linker.find("prices in Europa") == []
+    assert [m["value"] for m in linker.find("prices in europe")] == ["Europe"]
+
+
+def test_short_mentions_not_fuzzy_matched():
+    # "m5.larg" normalizes to 6 characters, below fuzzy_min_length of 7
+    linker = ValueLinker(
+        {"ec2_pricing.instance_name": INSTANCE_NAMES}, fuzzy_min_length=7
+    )
+    assert linker.find("price of m5.larg") == []
+
+
+def test_words_not_linked_to_values(linker):
+    # "large" and "xlarge" are parts of values, not values
+    assert linker.find("Which large or xlarge instances are cheap?") == []